@@ -0,0 +1,258 @@
+# asgi.py — async serving mode: /ask and /status on one event loop (Starlette)
+#
+#   uvicorn asgi:app --host 0.0.0.0 --port $PORT --workers 2
+#
+# Same request/response contract as server.py, whose config, caches, store and helpers
+# it reuses. Embed, vector search and chat go through httpx.AsyncClient, so a question
+# waiting on upstreams costs a coroutine, not a thread: one worker holds hundreds.
+# CPU-bound steps (BM25, context packing, local-index search) run on a small pool of
+# ASGI_CPU_THREADS; the SDK-based web search, which blocks a thread for seconds, gets
+# its own ASGI_WEB_THREADS so slow web calls never hold up context packing.
+# Backpressure: past ASK_MAX_IN_FLIGHT questions in flight /ask answers 503 with
+# Retry-After at once, and a question still running after ASK_TIMEOUT_S gets a 504,
+# so nothing queues forever.
+import os, time, asyncio, contextvars
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+import server
+import metrics
+import deadline
+import http_client
+from metrics import span
+from openai_integration import aembed_text, achat_answer, EMBED_MODEL
+from singleflight import AsyncSingleFlight
+from query_log import query_log
+from server import (answer_cache, embed_cache, collection_version, store, context_from_hits, wants_web,
+                    prewarmed, fallback_answer, is_no_answer, web_budget, _web, _web_out, _ms, ENABLE_WEB_SEARCH,
+                    WEB_SPECULATE, TOP_K, SHOW_SOURCES, SINGLEFLIGHT, NO_ANSWER, DEBUG_TIMINGS_HEADER,
+                    PREWARM, ASK_DEADLINE_S, CHAT_RESERVE_S)
+
+ASK_MAX_IN_FLIGHT = int(os.getenv("ASK_MAX_IN_FLIGHT", "512"))   # per worker; more → 503
+ASK_TIMEOUT_S     = float(os.getenv("ASK_TIMEOUT_S", "90"))      # per question; longer → 504
+ASGI_CPU_THREADS  = int(os.getenv("ASGI_CPU_THREADS", "2"))      # context packing, BM25, local search
+ASGI_WEB_THREADS  = int(os.getenv("ASGI_WEB_THREADS", "32"))     # blocking web searches at once
+
+cpu_pool = ThreadPoolExecutor(max_workers=ASGI_CPU_THREADS, thread_name_prefix="asgi-cpu")
+web_pool = ThreadPoolExecutor(max_workers=ASGI_WEB_THREADS, thread_name_prefix="asgi-web")
+
+flights = AsyncSingleFlight()
+_in_flight = 0
+
+def run_in(pool: ThreadPoolExecutor, fn, *args):
+    """asyncio.to_thread() on a given pool: fn runs with the caller's context (deadline, spans)."""
+    return asyncio.get_running_loop().run_in_executor(pool, contextvars.copy_context().run, fn, *args)
+
+async def embed(q: str):
+    with span("embed"):
+        qvec = embed_cache.get(q, EMBED_MODEL)
+        if qvec is None:
+            qvec = await aembed_text(q)
+            embed_cache.put(q, EMBED_MODEL, qvec)
+    return qvec
+
+async def retrieve(q: str):
+    """server.retrieve() with the embed and search round trips awaited."""
+    qvec = await embed(q)
+    with span("search"):
+        hits = await store.asearch(qvec, top_k=TOP_K, executor=cpu_pool)
+    return await run_in(cpu_pool, context_from_hits, q, hits)
+
+async def web(q: str, web_domains: list) -> dict:
+    return await run_in(web_pool, _web, q, web_domains)
+
+async def race_web(q: str, web_domains: list):
+    """server._race_web(): a non-empty web answer within web_budget() wins (retrieval is cancelled)."""
+    web_t = asyncio.ensure_future(web(q, web_domains))
+    ret_t = asyncio.ensure_future(retrieve(q))
+
+    def corpus_sources():
+        if SHOW_SOURCES and ret_t.done() and not ret_t.cancelled() and ret_t.exception() is None:
+            return ret_t.result()[1]
+        return []
+
+    budget = web_budget()
+    try:
+        try:
+            out = _web_out(await asyncio.wait_for(asyncio.shield(web_t), budget), [])
+            if out:
+                if SHOW_SOURCES:
+                    out["sources"] = corpus_sources() + out["sources"]
+                ret_t.cancel()
+                return out, "", []
+        except asyncio.TimeoutError:
+            print(f"[ask] web branch over {budget:.1f}s budget; using corpus if it has context")
+        except Exception as e:
+            print(f"[ask] web branch failed: {type(e).__name__}: {e}")
+
+        context, sources = await ret_t
+        if not context.strip() and not web_t.done():
+            try:
+                return _web_out(await web_t, sources), context, sources
+            except deadline.DeadlineExceeded:
+                raise
+            except Exception as e:
+                print(f"[ask] web branch failed: {type(e).__name__}: {e}")
+        return None, context, sources
+    finally:
+        ret_t.cancel()
+
+async def gather(q: str, use_web: bool, web_domains: list):
+    """server.gather(): (web response dict or None, corpus context, corpus sources)."""
+    if ENABLE_WEB_SEARCH and WEB_SPECULATE and wants_web(q, use_web):
+        return await race_web(q, web_domains)
+    context, sources = await retrieve(q)
+    if not (ENABLE_WEB_SEARCH and (wants_web(q, use_web) or not context.strip())):
+        return None, context, sources
+    if deadline.remaining() is None or not context.strip():
+        return _web_out(await web(q, web_domains), sources), context, sources
+    # as server.try_web(): with a corpus answer possible, the web gets what chat can spare
+    budget = deadline.remaining() - CHAT_RESERVE_S
+    if budget <= 0:
+        metrics.inc("ask_degraded_total", step="skip_web")
+        return None, context, sources
+    try:
+        with deadline.budget(budget):
+            return _web_out(await web(q, web_domains), sources), context, sources
+    except deadline.DeadlineExceeded:
+        print(f"[ask] web search cut after {budget:.1f}s to leave time for chat; answering from the corpus")
+        metrics.inc("ask_degraded_total", step="cut_web")
+        return None, context, sources
+
+async def answer_question(q: str, use_web: bool, web_domains: list):
+    """server.answer_question(): (response dict, came_from_web)."""
+    out, context, sources = await gather(q, use_web, web_domains)
+    if out:
+        return out, True
+    if context.strip():
+        with span("chat"):
+            ans = (await achat_answer(context, q, temperature=0.2) or "").strip()
+        return {"answer": ans, "sources": sources if SHOW_SOURCES else []}, False
+    return {"answer": NO_ANSWER, "sources": []}, False
+
+async def prewarmed_answer(q: str, use_web: bool, web_domains: list):
+    """server.prewarmed_answer() with the embed awaited."""
+    version = collection_version.get()
+    if not PREWARM or use_web or web_domains or wants_web(q, False) or not prewarmed.ready(version):
+        return None
+    qvec = await embed(q)
+    with span("prewarm"):
+        hit = prewarmed.lookup(qvec, version)
+    if hit is None:
+        return None
+    pre, _ = hit
+    return {"answer": pre["answer"], "sources": pre["sources"] if SHOW_SOURCES else []}
+
+def _error(status: int, message: str, **headers) -> JSONResponse:
+    return JSONResponse({"error": message, "answer": "", "sources": []}, status_code=status, headers=headers or None)
+
+async def ask(request):
+    global _in_flight
+    if _in_flight >= ASK_MAX_IN_FLIGHT:
+        metrics.inc("ask_requests_total", endpoint="ask", outcome="overloaded")
+        return _error(503, "Server busy, retry shortly", **{"Retry-After": "1"})
+    _in_flight += 1
+    try:
+        return await _ask(request)
+    finally:
+        _in_flight -= 1
+
+async def _ask(request):
+    t0 = time.perf_counter()
+    timings = metrics.start_request()
+    outcome = "ok"
+    q, use_web = "", False
+    try:
+        try:
+            data = await request.json() or {}
+        except ValueError:
+            data = {}
+        q = (data.get("question") or "").strip()
+        use_web, web_domains = bool(data.get("web")), data.get("web_domains") or []
+        if not q:
+            outcome = "bad_request"
+            return JSONResponse({"error": "Missing question"}, status_code=400)
+
+        key = answer_cache.key(q, use_web, web_domains, collection_version.get())
+        stale_key = answer_cache.stale_key(q, use_web, web_domains)
+        with span("answer_cache"):
+            out = answer_cache.get(key)
+        if out is None:
+            async def compute():
+                nonlocal outcome
+                with deadline.budget(ASK_DEADLINE_S - (time.perf_counter() - t0)):
+                    res = await prewarmed_answer(q, use_web, web_domains)
+                    if res is not None:
+                        outcome = "prewarmed"
+                        answer_cache.put(key, res, from_web=False, stale_key=stale_key)
+                        return res
+                    res, from_web = await answer_question(q, use_web, web_domains)
+                answer_cache.put(key, res, from_web=from_web, short=is_no_answer(res), stale_key=stale_key)
+                return res
+            try:
+                if SINGLEFLIGHT:
+                    out, shared = await asyncio.wait_for(flights.do(key, compute), ASK_TIMEOUT_S)
+                    if shared:
+                        outcome = "coalesced"
+                else:
+                    out = await asyncio.wait_for(compute(), ASK_TIMEOUT_S)
+            except deadline.DeadlineExceeded as e:
+                metrics.inc("ask_deadline_exceeded_total", at=e.what)
+                out = fallback_answer(q, use_web, web_domains)
+                if out is None:
+                    outcome = "timeout"
+                    return _error(504, f"No answer within {ASK_DEADLINE_S:g}s")
+                outcome = "degraded"
+            except asyncio.TimeoutError:
+                outcome = "timeout"
+                return _error(504, f"No answer within {ASK_TIMEOUT_S:g}s")
+        else:
+            outcome = "cached"
+
+        metrics.record("total", time.perf_counter() - t0)
+        if request.headers.get(DEBUG_TIMINGS_HEADER):
+            return JSONResponse({**out, "timings": _ms(timings)})
+        return JSONResponse(out)
+
+    except Exception as e:
+        outcome = "error"
+        return _error(500, f"{type(e).__name__}: {e}")
+    finally:
+        metrics.inc("ask_requests_total", endpoint="ask", outcome=outcome)
+        if query_log and q:
+            query_log.record(q, outcome, use_web, timings)
+
+async def status(request):
+    body = server.status_body()
+    body["singleflight"] = flights.stats()
+    body["asgi"] = {"in_flight": _in_flight, "max_in_flight": ASK_MAX_IN_FLIGHT}
+    return JSONResponse(body)
+
+async def prometheus_metrics(request):
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
+def _asgi_counters():
+    return [("ask_in_flight", {}, _in_flight)]
+
+metrics.describe("ask_in_flight", "gauge", "/ask questions in flight (this async worker).")
+metrics.register_collector(_asgi_counters)
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    await http_client.aclose()
+    web_pool.shutdown(wait=False, cancel_futures=True)
+    cpu_pool.shutdown(wait=False, cancel_futures=True)
+
+app = Starlette(routes=[Route("/ask", ask, methods=["POST"]),
+                        Route("/status", status, methods=["GET"]),
+                        Route("/metrics", prometheus_metrics, methods=["GET"])],
+                middleware=[Middleware(CORSMiddleware, allow_origins=server.CORS_ORIGINS,
+                                       allow_methods=["*"], allow_headers=["*"])],
+                lifespan=lifespan)
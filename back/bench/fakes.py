@@ -0,0 +1,460 @@
+# bench/fakes.py — local stand-ins for the OpenAI and Qdrant endpoints the backend calls
+#
+#   python bench/fakes.py --port 8900 --latency chat=0.4,embeddings=0.03 --error-rate 0.02
+#
+# then point the backend at it:
+#   OPENAI_BASE_URL=http://127.0.0.1:8900/v1  QDRANT_URL=http://127.0.0.1:8900  QDRANT_API_KEY=bench
+#
+# OpenAI:  POST /v1/embeddings, /v1/chat/completions (plain and SSE stream), /v1/responses
+# Qdrant:  GET/PUT/PATCH/DELETE /collections/{c}, PUT /collections/{c}/points and /index,
+#          POST /collections/{c}/points/search, /points/search/batch, /points/delete
+# Embeddings are deterministic per text; search is a real cosine top-k over what was upserted.
+import os, re, sys, json, time, random, hashlib, argparse, threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+
+EMBED_DIM = int(os.getenv("QDRANT_VECTOR_SIZE", "1536"))
+
+# Seconds added before answering, per endpoint ("chat" is time to first token when streaming)
+DEFAULT_LATENCY = {"embeddings": 0.03, "chat": 0.4, "responses": 1.5,
+                   "search": 0.005, "upsert": 0.01, "collection": 0.002, "delete": 0.005}
+
+class FakeConfig:
+    def __init__(self, latency=None, jitter=0.2, error_rate=0.0, error_status=(429, 503),
+                 retry_after=None, chat_tokens=60, token_interval=0.01, rpm=0, tpm=0,
+                 stall_rate=0.0, stall=0.0, stall_on=()):
+        self.latency = {**DEFAULT_LATENCY, **(latency or {})}
+        self.jitter = jitter                  # ± fraction applied to each latency
+        self.error_rate = error_rate          # share of calls answered with an error status
+        self.error_status = tuple(error_status)
+        self.retry_after = retry_after        # seconds, sent with injected 429s when set
+        self.chat_tokens = chat_tokens        # completion length in tokens
+        self.token_interval = token_interval  # seconds between streamed tokens
+        self.rpm, self.tpm = rpm, tpm         # OpenAI-style per-minute limits (0 = none)
+        self.stall_rate = stall_rate          # share of calls that hang `stall` extra seconds (a slow tail)
+        self.stall = stall
+        self.stall_on = set(stall_on)         # endpoints that stall (empty = all)
+
+    def delay(self, endpoint: str):
+        base = self.latency.get(endpoint, 0.0)
+        if self.stall_rate and (not self.stall_on or endpoint in self.stall_on) and random.random() < self.stall_rate:
+            base += self.stall
+        if base > 0:
+            time.sleep(max(0.0, base * (1 + random.uniform(-self.jitter, self.jitter))))
+
+    def fault(self):
+        if self.error_rate and random.random() < self.error_rate:
+            return random.choice(self.error_status)
+        return None
+
+def fake_embedding(text: str, dim: int = EMBED_DIM) -> list:
+    """Unit vector seeded by the text hash: same text, same vector, across processes."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    v = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return (v / np.linalg.norm(v)).tolist()
+
+def _tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+class _Collection:
+    def __init__(self, size: int, config: dict = None):
+        self.size = size
+        self.config = config or {"params": {"vectors": {"size": size, "distance": "Cosine"}}}
+        self.payload_schema = {}
+        self.lock = threading.Lock()
+        self.ids, self.payloads, self.rows, self.pos = [], [], [], {}
+        self._mat = None
+
+    def upsert(self, points):
+        with self.lock:
+            for p in points:
+                pid, v = str(p["id"]), np.asarray(p["vector"], dtype=np.float32)
+                v = v / max(float(np.linalg.norm(v)), 1e-12)
+                i = self.pos.get(pid)
+                if i is None:
+                    self.pos[pid] = len(self.ids)
+                    self.ids.append(pid); self.payloads.append(p.get("payload", {})); self.rows.append(v)
+                else:
+                    self.payloads[i], self.rows[i] = p.get("payload", {}), v
+            self._mat = None
+
+    def delete(self, ids):
+        drop = {str(i) for i in ids}
+        with self.lock:
+            keep = [i for i, pid in enumerate(self.ids) if pid not in drop]
+            self.ids = [self.ids[i] for i in keep]
+            self.payloads = [self.payloads[i] for i in keep]
+            self.rows = [self.rows[i] for i in keep]
+            self.pos = {pid: i for i, pid in enumerate(self.ids)}
+            self._mat = None
+
+    def search(self, vector, limit: int):
+        with self.lock:
+            if not self.ids:
+                return []
+            if self._mat is None:
+                self._mat = np.vstack(self.rows)
+            mat, ids, payloads = self._mat, self.ids, self.payloads
+        q = np.asarray(vector, dtype=np.float32)
+        scores = mat @ (q / max(float(np.linalg.norm(q)), 1e-12))
+        top = np.argsort(-scores)[:limit]
+        return [{"id": ids[i], "version": 0, "score": float(scores[i]), "payload": payloads[i]} for i in top]
+
+class _Limit:
+    """Per-minute bucket that answers like OpenAI's rate limiter (x-ratelimit-* headers, 429)."""
+    def __init__(self, per_minute: float):
+        self.cap, self.level, self.stamp = float(per_minute), float(per_minute), time.monotonic()
+
+    def take(self, n: float):
+        now = time.monotonic()
+        self.level = min(self.cap, self.level + (now - self.stamp) * self.cap / 60.0)
+        self.stamp = now
+        if self.level < n:
+            return False
+        self.level -= n
+        return True
+
+    def reset_in(self) -> str:
+        return f"{(self.cap - self.level) * 60.0 / self.cap:.3f}s"
+
+class FakeState:
+    def __init__(self, config: FakeConfig):
+        self.config = config
+        self.collections = {}
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.limits = {k: _Limit(v) for k, v in (("requests", config.rpm), ("tokens", config.tpm)) if v}
+        self.rate_limited = 0
+
+    def admit(self, tokens: int):
+        """(ok, headers) under the configured OpenAI limits."""
+        if not self.limits:
+            return True, {}
+        with self.lock:
+            ok = True
+            for kind, lim in self.limits.items():
+                ok = lim.take(1 if kind == "requests" else tokens) and ok
+            headers = {}
+            for kind, lim in self.limits.items():
+                headers[f"x-ratelimit-limit-{kind}"] = str(int(lim.cap))
+                headers[f"x-ratelimit-remaining-{kind}"] = str(max(0, int(lim.level)))
+                headers[f"x-ratelimit-reset-{kind}"] = lim.reset_in()
+            if not ok:
+                self.rate_limited += 1
+            return ok, headers
+
+    def count(self, endpoint: str):
+        with self.lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+
+def _make_handler(state: FakeState):
+    cfg = state.config
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"   # keep-alive, like the real upstreams
+
+        def log_message(self, *args):
+            pass
+
+        def _body(self):
+            n = int(self.headers.get("Content-Length") or 0)
+            return json.loads(self.rfile.read(n) or b"{}") if n else {}
+
+        def _openai(self, endpoint: str, body: dict, fn):
+            """Apply the fake OpenAI rate limits before serving; every reply carries the headers."""
+            tokens = sum(_tokens(t) for t in ([body["input"]] if isinstance(body.get("input"), str)
+                                              else [x for x in body.get("input") or [] if isinstance(x, str)]))
+            tokens += sum(_tokens(m.get("content") or "") for m in body.get("messages") or [])
+            ok, self._limit_headers = state.admit(tokens)
+            if not ok:
+                state.count(endpoint)
+                return self._send(429, {"error": {"message": "Rate limit reached", "type": "requests"}})
+            return self._serve(endpoint, fn)
+
+        _limit_headers = {}
+
+        def _send(self, status: int, obj=None, headers=None):
+            data = json.dumps(obj if obj is not None else {}).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for k, v in {**self._limit_headers, **(headers or {})}.items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _serve(self, endpoint: str, fn):
+            state.count(endpoint)
+            status = cfg.fault()
+            if status:
+                headers = {"Retry-After": str(cfg.retry_after)} if status == 429 and cfg.retry_after else None
+                return self._send(status, {"error": {"message": f"injected {status}"}}, headers)
+            cfg.delay(endpoint)
+            return fn()
+
+        # --- routing ---
+        def do_GET(self):
+            m = re.fullmatch(r"/collections/([^/?]+)", self.path.split("?")[0])
+            if m:
+                return self._serve("collection", lambda: self._get_collection(m.group(1)))
+            self._send(404, {"status": {"error": "not found"}})
+
+        def do_PUT(self):
+            path = self.path.split("?")[0]
+            body = self._body()
+            m = re.fullmatch(r"/collections/([^/]+)(/points|/index)?", path)
+            if m and m.group(2) == "/index":
+                return self._serve("collection", lambda: self._index(m.group(1), body))
+            if m and m.group(2):
+                return self._serve("upsert", lambda: self._upsert(m.group(1), body))
+            if m:
+                return self._serve("collection", lambda: self._create(m.group(1), body))
+            self._send(404, {"status": {"error": "not found"}})
+
+        def do_PATCH(self):
+            m = re.fullmatch(r"/collections/([^/?]+)", self.path.split("?")[0])
+            body = self._body()
+            if m:
+                return self._serve("collection", lambda: self._patch(m.group(1), body))
+            self._send(404, {"status": {"error": "not found"}})
+
+        def do_DELETE(self):
+            m = re.fullmatch(r"/collections/([^/?]+)", self.path.split("?")[0])
+            if m:
+                state.collections.pop(m.group(1), None)
+                return self._send(200, {"result": True, "status": "ok"})
+            self._send(404, {"status": {"error": "not found"}})
+
+        def do_POST(self):
+            path = self.path.split("?")[0]
+            body = self._body()
+            if path == "/v1/embeddings":
+                return self._openai("embeddings", body, lambda: self._embeddings(body))
+            if path == "/v1/chat/completions":
+                return self._openai("chat", body, lambda: self._chat(body))
+            if path == "/v1/responses":
+                return self._openai("responses", body, lambda: self._responses(body))
+            m = re.fullmatch(r"/collections/([^/]+)/points/(search/batch|search|delete)", path)
+            if m and m.group(2) == "search/batch":
+                return self._serve("search", lambda: self._search_batch(m.group(1), body))
+            if m and m.group(2) == "search":
+                return self._serve("search", lambda: self._search(m.group(1), body))
+            if m:
+                return self._serve("delete", lambda: self._delete(m.group(1), body))
+            self._send(404, {"error": {"message": f"no route for {path}"}})
+
+        # --- Qdrant ---
+        def _get_collection(self, name):
+            c = state.collections.get(name)
+            if c is None:
+                return self._send(404, {"status": {"error": f"Collection `{name}` doesn't exist!"}})
+            self._send(200, {"result": {"status": "green", "points_count": len(c.ids), "config": c.config,
+                                        "payload_schema": c.payload_schema}, "status": "ok"})
+
+        def _create(self, name, body):
+            vectors = dict(body.get("vectors") or {})
+            size = int(vectors.get("size") or EMBED_DIM)
+            config = {"params": {"vectors": vectors, "on_disk_payload": body.get("on_disk_payload", True)},
+                      "hnsw_config": body.get("hnsw_config") or {"m": 16, "ef_construct": 100},
+                      "quantization_config": body.get("quantization_config")}
+            state.collections.setdefault(name, _Collection(size, config))
+            self._send(200, {"result": True, "status": "ok"})
+
+        def _patch(self, name, body):
+            c = state.collections.get(name)
+            if c is None:
+                return self._send(404, {"status": {"error": f"Collection `{name}` doesn't exist!"}})
+            params = c.config.setdefault("params", {})
+            if "" in (body.get("vectors") or {}):
+                params.setdefault("vectors", {}).update(body["vectors"][""])
+            params.update(body.get("params") or {})
+            if "hnsw_config" in body:
+                c.config["hnsw_config"] = {**(c.config.get("hnsw_config") or {}), **body["hnsw_config"]}
+            if "quantization_config" in body:
+                q = body["quantization_config"]
+                c.config["quantization_config"] = None if q == "Disabled" else q
+            self._send(200, {"result": True, "status": "ok"})
+
+        def _index(self, name, body):
+            c = state.collections.get(name)
+            if c is None:
+                return self._send(404, {"status": {"error": f"Collection `{name}` doesn't exist!"}})
+            c.payload_schema[body["field_name"]] = {"data_type": body["field_schema"], "points": len(c.ids)}
+            self._send(200, {"result": {"operation_id": 0, "status": "completed"}, "status": "ok"})
+
+        def _upsert(self, name, body):
+            c = state.collections.get(name)
+            if c is None:
+                return self._send(404, {"status": {"error": f"Collection `{name}` doesn't exist!"}})
+            c.upsert(body.get("points") or [])
+            self._send(200, {"result": {"operation_id": 0, "status": "completed"}, "status": "ok"})
+
+        def _delete(self, name, body):
+            c = state.collections.get(name)
+            if c is not None:
+                c.delete(body.get("points") or [])
+            self._send(200, {"result": {"operation_id": 0, "status": "completed"}, "status": "ok"})
+
+        def _search(self, name, body):
+            c = state.collections.get(name)
+            if c is None:
+                return self._send(404, {"status": {"error": f"Collection `{name}` doesn't exist!"}})
+            self._send(200, {"result": c.search(body["vector"], int(body.get("limit") or 10)), "status": "ok"})
+
+        def _search_batch(self, name, body):
+            c = state.collections.get(name)
+            if c is None:
+                return self._send(404, {"status": {"error": f"Collection `{name}` doesn't exist!"}})
+            self._send(200, {"result": [c.search(q["vector"], int(q.get("limit") or 10))
+                                        for q in body.get("searches") or []], "status": "ok"})
+
+        # --- OpenAI ---
+        def _embeddings(self, body):
+            inputs = body.get("input")
+            inputs = [inputs] if isinstance(inputs, str) else list(inputs or [])
+            data = [{"object": "embedding", "index": i, "embedding": fake_embedding(t)}
+                    for i, t in enumerate(inputs)]
+            n = sum(_tokens(t) for t in inputs)
+            self._send(200, {"object": "list", "data": data, "model": body.get("model"),
+                             "usage": {"prompt_tokens": n, "total_tokens": n}})
+
+        def _chat(self, body):
+            prompt = sum(_tokens(m.get("content") or "") for m in body.get("messages") or [])
+            words = [f"word{i}" for i in range(cfg.chat_tokens)]
+            usage = {"prompt_tokens": prompt, "completion_tokens": cfg.chat_tokens,
+                     "total_tokens": prompt + cfg.chat_tokens}
+            if not body.get("stream"):
+                time.sleep(cfg.token_interval * cfg.chat_tokens)
+                return self._send(200, {"id": "chatcmpl-bench", "object": "chat.completion",
+                                        "model": body.get("model"),
+                                        "choices": [{"index": 0, "finish_reason": "stop",
+                                                     "message": {"role": "assistant", "content": " ".join(words)}}],
+                                        "usage": usage})
+            self.send_response(200)
+            for k, v in self._limit_headers.items():
+                self.send_header(k, v)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")   # no Content-Length: the body ends with the socket
+            self.end_headers()
+            self.close_connection = True
+
+            def event(obj):
+                self.wfile.write(f"data: {json.dumps(obj)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+            for i, w in enumerate(words):
+                event({"id": "chatcmpl-bench", "object": "chat.completion.chunk",
+                       "choices": [{"index": 0, "delta": {"content": (" " if i else "") + w}}]})
+                time.sleep(cfg.token_interval)
+            event({"id": "chatcmpl-bench", "object": "chat.completion.chunk", "choices": [], "usage": usage})
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+
+        def _responses(self, body):
+            text = "Web answer: " + " ".join(f"word{i}" for i in range(cfg.chat_tokens))
+            self._send(200, {
+                "id": "resp_bench", "object": "response", "created_at": int(time.time()),
+                "status": "completed", "model": body.get("model"), "tool_choice": "auto",
+                "tools": [], "parallel_tool_calls": True,
+                "output": [{"type": "message", "id": "msg_bench", "role": "assistant", "status": "completed",
+                            "content": [{"type": "output_text", "text": text, "annotations": [
+                                {"type": "url_citation", "url": "https://example.com/bench",
+                                 "title": "bench", "start_index": 0, "end_index": 3}]}]}],
+                "usage": {"input_tokens": _tokens(str(body.get("input"))), "output_tokens": cfg.chat_tokens,
+                          "total_tokens": cfg.chat_tokens, "input_tokens_details": {"cached_tokens": 0},
+                          "output_tokens_details": {"reasoning_tokens": 0}},
+            })
+
+    return Handler
+
+class _Server(ThreadingHTTPServer):
+    request_queue_size = 1024   # socketserver's default backlog of 5 resets bursts of connects
+
+    def handle_error(self, request, client_address):
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return   # the client gave up (timeout, deadline, abandoned hedge)
+        super().handle_error(request, client_address)
+
+class FakeUpstreams:
+    """Both fakes on one local port, served from a background thread."""
+    def __init__(self, config: FakeConfig = None, host: str = "127.0.0.1", port: int = 0):
+        self.state = FakeState(config or FakeConfig())
+        self.server = _Server((host, port), _make_handler(self.state))
+        self.server.daemon_threads = True
+        self.host, self.port = self.server.server_address[:2]
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def env(self) -> dict:
+        """Environment that points the backend at these fakes."""
+        return {"OPENAI_BASE_URL": f"{self.url}/v1", "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY") or "bench",
+                "QDRANT_URL": self.url, "QDRANT_API_KEY": "bench"}
+
+    def seed(self, collection: str, texts, source: str = "bench/seed"):
+        """Load `texts` straight into a collection (vectors from fake_embedding)."""
+        c = self.state.collections.setdefault(collection, _Collection(EMBED_DIM))
+        c.upsert([{"id": f"{source}#{i}", "vector": fake_embedding(t),
+                   "payload": {"source": source, "text": t, "brand": "AM/SM"}} for i, t in enumerate(texts)])
+        return len(c.ids)
+
+    def start(self) -> "FakeUpstreams":
+        self._thread = threading.Thread(target=self.server.serve_forever, name="fakes", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def parse_latency(spec: str) -> dict:
+    """'chat=0.4,embeddings=0.03' → {"chat": 0.4, "embeddings": 0.03} (seconds)."""
+    out = {}
+    for part in (spec or "").split(","):
+        if "=" in part:
+            k, v = part.split("=", 1)
+            out[k.strip()] = float(v)
+    return out
+
+def add_fake_args(ap: argparse.ArgumentParser):
+    ap.add_argument("--latency", default="", help="per-endpoint seconds, e.g. chat=0.4,embeddings=0.03,search=0.005")
+    ap.add_argument("--jitter", type=float, default=0.2, help="± fraction of each latency (default 0.2)")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="share of upstream calls that fail")
+    ap.add_argument("--error-status", default="429,503", help="statuses used for injected failures")
+    ap.add_argument("--retry-after", type=float, default=None, help="Retry-After seconds on injected 429s")
+    ap.add_argument("--chat-tokens", type=int, default=60, help="completion length")
+    ap.add_argument("--token-interval", type=float, default=0.01, help="seconds per completion token")
+    ap.add_argument("--rpm", type=float, default=0, help="OpenAI requests/min limit to enforce (0 = none)")
+    ap.add_argument("--tpm", type=float, default=0, help="OpenAI tokens/min limit to enforce (0 = none)")
+    ap.add_argument("--stall-rate", type=float, default=0.0, help="share of calls that stall (slow tail)")
+    ap.add_argument("--stall", type=float, default=0.0, help="seconds a stalled call hangs")
+    ap.add_argument("--stall-on", default="", help="endpoints that stall, e.g. embeddings,search (default all)")
+
+def config_from_args(args) -> FakeConfig:
+    return FakeConfig(latency=parse_latency(args.latency), jitter=args.jitter, error_rate=args.error_rate,
+                      error_status=[int(s) for s in args.error_status.split(",") if s.strip()],
+                      retry_after=args.retry_after, chat_tokens=args.chat_tokens,
+                      token_interval=args.token_interval, rpm=args.rpm, tpm=args.tpm,
+                      stall_rate=args.stall_rate, stall=args.stall,
+                      stall_on=[s.strip() for s in args.stall_on.split(",") if s.strip()])
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Serve fake OpenAI + Qdrant endpoints for benchmarking.")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8900)
+    add_fake_args(ap)
+    args = ap.parse_args()
+    fakes = FakeUpstreams(config_from_args(args), args.host, args.port)
+    print(f"[fake] serving on {fakes.url}")
+    for k, v in fakes.env().items():
+        print(f"[fake]   {k}={v}")
+    try:
+        fakes.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"[fake] calls: {json.dumps(fakes.state.calls)}")
+        sys.exit(0)
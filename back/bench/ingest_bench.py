@@ -0,0 +1,100 @@
+# bench/ingest_bench.py — ingest throughput over corpus/air_street against local fakes
+#
+#   python bench/ingest_bench.py --latency embeddings=0.08 --workers 4
+#
+# Three timed phases, all with state (manifest, BM25, version file, local index) in a temp dir:
+#   extract  ingest.iter_documents() only: read + extract + chunk every file
+#   cold     ingest_to_qdrant.main() on an empty collection: extract, embed, upsert
+#   warm     the same run again: nothing changed, so nothing should be embedded
+#   rebuild  collection dropped, then ingested again: vectors come from the embedding store
+# Reports files/sec and chunks/sec for each.
+import os, sys, json, time, shutil, logging, argparse, tempfile
+from pathlib import Path
+
+BACK = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACK))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fakes import FakeUpstreams, add_fake_args, config_from_args
+
+COLLECTION = "bench_ingest"
+
+def _rates(name: str, files: int, chunks: int, secs: float, **extra) -> dict:
+    secs = max(secs, 1e-9)
+    return {"phase": name, "files": files, "chunks": chunks, "seconds": round(secs, 3),
+            "files_per_s": round(files / secs, 2), "chunks_per_s": round(chunks / secs, 2), **extra}
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark corpus extraction and ingest against fake upstreams.")
+    ap.add_argument("--workers", type=int, default=0, help="EXTRACT_WORKERS (default: cpu count)")
+    ap.add_argument("--backend", choices=("qdrant", "local"), default="qdrant",
+                    help="vector store: the fake Qdrant, or the local NumPy index in the temp dir")
+    ap.add_argument("--skip-extract", action="store_true", help="skip the extraction-only phase")
+    ap.add_argument("--json", action="store_true", help="print results as JSON only")
+    ap.add_argument("-v", "--verbose", action="store_true", help="show ingest logs")
+    add_fake_args(ap)
+    args = ap.parse_args()
+
+    fakes = FakeUpstreams(config_from_args(args)).start()
+    state = Path(tempfile.mkdtemp(prefix="bench_ingest_"))
+    # Must be set before the backend modules are imported: they read config at import time
+    os.environ.update(fakes.env())
+    os.environ.update({
+        "QDRANT_COLLECTION": COLLECTION, "VECTOR_BACKEND": args.backend,
+        "LOCAL_INDEX_DIR": str(state / "local_index"), "BM25_DIR": str(state / "bm25"),
+        "INGEST_MANIFEST": str(state / "manifest.json"), "EMBED_STORE_DIR": str(state / "embeddings"),
+        "COLLECTION_VERSION_PATH": str(state / "collection_version.json"),
+        "QUERY_LOG": str(state / "query_log.jsonl"), "PREWARM_DIR": str(state / "prewarm"),
+        "WRITE_CSV": "0", "INGEST_CSV": "", "PREWARM_AFTER_INGEST": "0",
+    })
+    if args.workers:
+        os.environ["EXTRACT_WORKERS"] = str(args.workers)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format="[%(name)s] %(message)s")
+    logging.getLogger("pdfminer").setLevel(logging.ERROR)
+
+    import contextlib, io
+    import ingest, ingest_to_qdrant
+
+    quiet = (lambda: contextlib.nullcontext()) if args.verbose else (lambda: contextlib.redirect_stdout(io.StringIO()))
+    results = []
+    try:
+        n_files = len(ingest._scan_corpus())
+        if not args.skip_extract:
+            t0 = time.perf_counter()
+            chunks = chars = 0
+            with quiet():
+                for doc in ingest.iter_documents(None):
+                    for c in doc["chunks"] or ():
+                        chunks += 1
+                        chars += len(c)
+            results.append(_rates("extract", n_files, chunks, time.perf_counter() - t0,
+                                  chars=chars, workers=ingest.EXTRACT_WORKERS))
+
+        for phase in ("cold", "warm", "rebuild"):
+            if phase == "rebuild":
+                fakes.state.collections.pop(COLLECTION, None)
+                shutil.rmtree(state / "local_index", ignore_errors=True)
+            before = dict(fakes.state.calls)
+            t0 = time.perf_counter()
+            with quiet():
+                ingest_to_qdrant.main()
+            secs = time.perf_counter() - t0
+            calls = {k: v - before.get(k, 0) for k, v in fakes.state.calls.items() if v != before.get(k, 0)}
+            manifest = json.loads((state / "manifest.json").read_text(encoding="utf-8"))
+            chunks = sum(len(e.get("chunks", [])) for e in manifest["collections"][COLLECTION].values())
+            results.append(_rates(phase, n_files, chunks, secs, upstream_calls=calls))
+    finally:
+        fakes.stop()
+
+    if args.json:
+        print(json.dumps(results))
+        return
+    print(f"[bench] corpus: {ingest.CORPUS_DIR} ({n_files} files), backend={args.backend}, state in {state}")
+    for r in results:
+        extra = f"  calls={r['upstream_calls']}" if "upstream_calls" in r else ""
+        print(f"[bench] {r['phase']:<8} {r['files']} files, {r['chunks']} chunks in {r['seconds']}s → "
+              f"{r['files_per_s']} files/s, {r['chunks_per_s']} chunks/s{extra}")
+
+if __name__ == "__main__":
+    main()
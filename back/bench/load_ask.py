@@ -0,0 +1,206 @@
+# bench/load_ask.py — drive /ask on the real gunicorn setup (Procfile) against local fakes
+#
+#   python bench/load_ask.py --concurrency 16 --duration 30 --latency chat=0.4
+#   HEDGE_READS= python bench/load_ask.py --asgi --stall-rate 0.03 --stall 3 --stall-on embeddings,search
+#       (a slow tail on reads; compare with hedging on, the default)
+#   python bench/load_ask.py --asgi --web-share 0.3 --concurrency 32
+#       (a share of questions also ask the web, served by the fakes' /v1/responses)
+#
+# Starts bench/fakes.py in-process, seeds a collection, launches the Procfile's `web:`
+# command (or, with --asgi, uvicorn asgi:app) from back/ with the backend pointed at the
+# fakes, then reports throughput and latency percentiles. Nothing leaves the machine;
+# no API credits are used.
+import os, sys, json, time, shlex, random, signal, argparse, tempfile, threading, subprocess
+from pathlib import Path
+
+BACK = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACK))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import requests
+
+from fakes import FakeUpstreams, add_fake_args, config_from_args
+
+WORDS = ("launch mall budget emailer whatsapp onboarding tracker report access brand assets "
+         "content calendar campaign store opening social instagram tiktok audience reach "
+         "engagement spend allocation september july configuration account creation "
+         "requirements next steps guide arena trampoline parkour kids birthday party").split()
+
+def synthetic_chunks(n: int, words: int = 250, seed: int = 7) -> list:
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(WORDS) for _ in range(words)) for _ in range(n)]
+
+def questions(n: int, seed: int = 11) -> list:
+    rng = random.Random(seed)
+    return [f"What is the {rng.choice(WORDS)} plan for {rng.choice(WORDS)} and {rng.choice(WORDS)} #{i}?"
+            for i in range(n)]
+
+def procfile_command(port: int) -> list:
+    """The Procfile `web:` line, with $PORT filled in."""
+    for line in (BACK / "Procfile").read_text(encoding="utf-8").splitlines():
+        if line.startswith("web:"):
+            return shlex.split(line[4:].strip().replace("$PORT", str(port)))
+    raise SystemExit("no web: process in Procfile")
+
+def percentile(sorted_vals: list, p: float) -> float:
+    if not sorted_vals:
+        return float("nan")
+    i = min(len(sorted_vals) - 1, max(0, int(round(p / 100 * (len(sorted_vals) - 1)))))
+    return sorted_vals[i]
+
+def wait_ready(url: str, proc, timeout: float = 60):
+    t0 = time.time()
+    while time.time() - t0 < timeout:
+        if proc.poll() is not None:
+            raise SystemExit(f"server exited with {proc.returncode}")
+        try:
+            if requests.get(f"{url}/status", timeout=2).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise SystemExit("server did not become ready")
+
+def run_load(url: str, qs: list, concurrency: int, duration: float, total: int, stream: bool,
+             web_share: float = 0.0) -> dict:
+    lat, errors, statuses = [], 0, {}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+    issued = [0]
+    path = "/ask/stream" if stream else "/ask"
+
+    def worker(wid: int):
+        nonlocal errors
+        rng = random.Random(wid)
+        s = requests.Session()
+        while True:
+            with lock:
+                if (total and issued[0] >= total) or (not total and time.perf_counter() >= deadline):
+                    return
+                issued[0] += 1
+            q = rng.choice(qs)
+            use_web = rng.random() < web_share
+            t0 = time.perf_counter()
+            try:
+                r = s.post(url + path, json={"question": q, "web": use_web}, timeout=120, stream=stream)
+                ok = r.status_code == 200
+                if stream and ok:
+                    body = b"".join(r.iter_content(chunk_size=None))
+                    ok = b"event: done" in body
+                else:
+                    r.content
+                code = r.status_code
+            except requests.RequestException as e:
+                ok, code = False, type(e).__name__
+            dt = time.perf_counter() - t0
+            with lock:
+                statuses[code] = statuses.get(code, 0) + 1
+                if ok:
+                    lat.append(dt)
+                else:
+                    errors += 1
+
+    t_start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - t_start
+    lat.sort()
+    return {"requests": len(lat) + errors, "ok": len(lat), "errors": errors, "statuses": statuses,
+            "seconds": round(wall, 2), "throughput_rps": round(len(lat) / wall, 2) if wall else 0.0,
+            "p50_ms": round(percentile(lat, 50) * 1000, 1), "p95_ms": round(percentile(lat, 95) * 1000, 1),
+            "p99_ms": round(percentile(lat, 99) * 1000, 1),
+            "max_ms": round((lat[-1] if lat else float("nan")) * 1000, 1)}
+
+def server_counters(url: str, names=("ask_requests_total", "hedged_requests_total",
+                                      "ask_deadline_exceeded_total", "ask_degraded_total")) -> dict:
+    """Selected counters from /metrics (of whichever worker answers the scrape)."""
+    out = {}
+    try:
+        text = requests.get(f"{url}/metrics", timeout=5).text
+    except requests.RequestException:
+        return out
+    for line in text.splitlines():
+        if line.startswith(names):
+            key, _, value = line.rpartition(" ")
+            out[key] = float(value)
+    return out
+
+def main():
+    ap = argparse.ArgumentParser(description="Load-test /ask through gunicorn against fake upstreams.")
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--duration", type=float, default=20, help="seconds (ignored with --requests)")
+    ap.add_argument("--requests", type=int, default=0, help="stop after this many requests")
+    ap.add_argument("--questions", type=int, default=200, help="distinct questions; fewer means more cache hits")
+    ap.add_argument("--chunks", type=int, default=2000, help="synthetic chunks seeded into the collection")
+    ap.add_argument("--stream", action="store_true", help="use /ask/stream (SSE) instead of /ask")
+    ap.add_argument("--no-answer-cache", action="store_true", help="ANSWER_CACHE_SIZE=0 for the server")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--web-share", type=float, default=0.0,
+                    help="share of questions sent with web=true (enables ENABLE_WEB_SEARCH)")
+    ap.add_argument("--asgi", action="store_true", help="serve with uvicorn asgi:app instead of the Procfile")
+    ap.add_argument("--gunicorn-args", default="", help="extra args appended to the server command")
+    ap.add_argument("--json", action="store_true", help="print the result as JSON only")
+    add_fake_args(ap)
+    args = ap.parse_args()
+
+    collection = "bench_ask"
+    fakes = FakeUpstreams(config_from_args(args)).start()
+    fakes.seed(collection, synthetic_chunks(args.chunks))
+
+    state = tempfile.mkdtemp(prefix="bench_ask_")
+    env = {**os.environ, **fakes.env(),
+           "QDRANT_COLLECTION": collection, "VECTOR_BACKEND": "qdrant",
+           "BM25_DIR": os.path.join(state, "bm25"), "COLLECTION_VERSION_PATH": os.path.join(state, "version.json"),
+           "QUERY_LOG": os.path.join(state, "query_log.jsonl"), "PREWARM_DIR": os.path.join(state, "prewarm"),
+           "PREWARM_AFTER_INGEST": "0",
+           "ENABLE_WEB_SEARCH": "1" if args.web_share else "0", "WEB_SPECULATE": "0", "PYTHONUNBUFFERED": "1"}
+    if args.no_answer_cache:
+        env["ANSWER_CACHE_SIZE"] = "0"
+    if args.asgi:
+        cmd = [sys.executable, "-m", "uvicorn", "asgi:app", "--host", "0.0.0.0", "--port", str(args.port),
+               "--no-access-log"]
+    else:
+        cmd = procfile_command(args.port)
+    cmd += shlex.split(args.gunicorn_args)
+    log = open(os.path.join(state, "server.log"), "w")
+    if not args.json:
+        print(f"[bench] fakes on {fakes.url}, {args.chunks} chunks seeded")
+        print(f"[bench] starting: {' '.join(cmd)}  (log: {log.name})")
+    proc = subprocess.Popen(cmd, cwd=BACK, env=env, stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+    url = f"http://127.0.0.1:{args.port}"
+    try:
+        wait_ready(url, proc)
+        result = run_load(url, questions(args.questions), args.concurrency, args.duration,
+                          args.requests, args.stream, args.web_share)
+        result["upstream_calls"] = dict(fakes.state.calls)
+        result["server_counters"] = server_counters(url)
+        result["config"] = {"concurrency": args.concurrency, "stream": args.stream, "command": " ".join(cmd),
+                            "latency": fakes.state.config.latency, "error_rate": args.error_rate,
+                            "stall_rate": args.stall_rate, "stall": args.stall,
+                            "web_share": args.web_share}
+    finally:
+        os.killpg(proc.pid, signal.SIGTERM)
+        try:
+            proc.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            os.killpg(proc.pid, signal.SIGKILL)
+        log.close()
+        fakes.stop()
+
+    if args.json:
+        print(json.dumps(result))
+        return
+    print(f"[bench] {result['ok']} ok / {result['errors']} errors in {result['seconds']}s "
+          f"→ {result['throughput_rps']} req/s")
+    print(f"[bench] latency p50={result['p50_ms']}ms p95={result['p95_ms']}ms "
+          f"p99={result['p99_ms']}ms max={result['max_ms']}ms")
+    print(f"[bench] statuses: {result['statuses']}")
+    print(f"[bench] upstream calls: {result['upstream_calls']}")
+    for k, v in result["server_counters"].items():
+        print(f"[bench]   {k} {v:g}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+# bench/startup_bench.py — worker cold start: import cost and gunicorn time-to-ready
+#
+#   python bench/startup_bench.py --workers 4 --chunks 20000
+#
+# import  `import server` (WARM_START=0) in fresh interpreters, then server.warm(): median
+#         of --repeat, and which heavy modules the import pulled in
+# ready   the Procfile command with GUNICORN_PRELOAD=0 and =1 against local fakes and a
+#         local index + BM25 of --chunks synthetic chunks: seconds until /status answers,
+#         how many workers answered within 5s after that (one worker may take every
+#         connection), the first and second /ask, and total PSS of master + workers
+import os, sys, json, time, signal, argparse, statistics, tempfile, subprocess
+from pathlib import Path
+
+BACK = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACK))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import requests
+
+from fakes import FakeUpstreams, add_fake_args, config_from_args, fake_embedding
+from load_ask import synthetic_chunks, procfile_command
+
+HEAVY = ("openai", "pandas", "pdfminer", "docx", "bs4", "lxml", "numpy", "tiktoken", "httpx")
+COLLECTION = "bench_startup"
+
+_IMPORT_PROBE = (
+    "import sys, time, json; t = time.perf_counter(); import server; t1 = time.perf_counter(); "
+    "heavy = sorted(m for m in %r if m in sys.modules); n = len(sys.modules); server.warm(); "
+    "print(json.dumps({'seconds': t1 - t, 'warm': time.perf_counter() - t1, 'modules': n, 'heavy': heavy}))"
+    % (HEAVY,))
+
+def measure_import(env: dict, repeat: int) -> dict:
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", _IMPORT_PROBE], cwd=BACK, env={**env, "WARM_START": "0"},
+                             capture_output=True, text=True, check=True).stdout
+        runs.append(json.loads(out.strip().splitlines()[-1]))
+    return {"import_s": round(statistics.median(r["seconds"] for r in runs), 3),
+            "warm_s": round(statistics.median(r["warm"] for r in runs), 3),
+            "modules": runs[-1]["modules"], "heavy_loaded": runs[-1]["heavy"]}
+
+def build_local_state(state: Path, chunks: list):
+    """A local vector index and BM25 index for COLLECTION under `state` (what warm() loads)."""
+    os.environ["LOCAL_INDEX_DIR"] = str(state / "local_index")
+    os.environ["BM25_DIR"] = str(state / "bm25")
+    from vector_store import LocalStore
+    from bm25 import BM25Index, index_path
+    store, lexical = LocalStore(COLLECTION, root=state / "local_index"), BM25Index(index_path(COLLECTION))
+    for start in range(0, len(chunks), 1000):
+        points = [{"id": f"bench#{i}", "vector": fake_embedding(t),
+                   "payload": {"source": "bench/seed", "text": t, "brand": "AM/SM"}}
+                  for i, t in enumerate(chunks[start:start + 1000], start)]
+        store.upsert(points)
+        for p in points:
+            lexical.add(p["id"], p["payload"])
+    store.flush()
+    lexical.save()
+
+def pss_mb(pid: int) -> float:
+    """Proportional set size of pid and its children (shared pages split between them), Linux only."""
+    pids = [pid]
+    try:
+        pids += [int(c) for c in Path(f"/proc/{pid}/task/{pid}/children").read_text().split()]
+    except OSError:
+        return float("nan")
+    kb = 0
+    for p in pids:
+        try:
+            for line in Path(f"/proc/{p}/smaps_rollup").read_text().splitlines():
+                if line.startswith("Pss:"):
+                    kb += int(line.split()[1])
+        except OSError:
+            pass
+    return round(kb / 1024, 1)
+
+def measure_ready(env: dict, port: int, workers: int, preload: bool, log_path: str, timeout: float = 120) -> dict:
+    env = {**env, "GUNICORN_PRELOAD": "1" if preload else "0", "WEB_CONCURRENCY": str(workers)}
+    url = f"http://127.0.0.1:{port}"
+    out = {"preload": preload, "workers": workers}
+    with open(log_path, "w") as log:
+        t0 = time.perf_counter()
+        proc = subprocess.Popen(procfile_command(port), cwd=BACK, env=env, stdout=log,
+                                stderr=subprocess.STDOUT, start_new_session=True)
+        try:
+            seen, deadline = set(), t0 + timeout
+            while len(seen) < workers and time.perf_counter() < deadline:
+                if proc.poll() is not None:
+                    raise SystemExit(f"server exited with {proc.returncode} (log: {log_path})")
+                try:
+                    # a new connection each time, so different workers get to accept it
+                    r = requests.get(f"{url}/status", timeout=2, headers={"Connection": "close"})
+                    if r.ok:
+                        seen.add(r.json().get("worker"))
+                        if "first_ready_s" not in out:
+                            out["first_ready_s"] = round(time.perf_counter() - t0, 3)
+                            deadline = time.perf_counter() + 5
+                except requests.RequestException:
+                    pass
+                time.sleep(0.02)
+            out["workers_answered"] = len(seen)
+            if "first_ready_s" not in out:
+                raise SystemExit(f"server did not become ready (log: {log_path})")
+            for name, q in (("first_ask_ms", "What is the launch plan for the mall?"),
+                            ("second_ask_ms", "Which audience did the tiktok campaign reach?")):
+                t1 = time.perf_counter()
+                r = requests.post(f"{url}/ask", json={"question": q}, timeout=60)
+                out[name] = round((time.perf_counter() - t1) * 1000, 1) if r.ok else f"HTTP {r.status_code}"
+            out["pss_mb"] = pss_mb(proc.pid)
+        finally:
+            os.killpg(proc.pid, signal.SIGTERM)
+            try:
+                proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                os.killpg(proc.pid, signal.SIGKILL)
+    return out
+
+def main():
+    ap = argparse.ArgumentParser(description="Measure server import time and gunicorn time-to-ready.")
+    ap.add_argument("--workers", type=int, default=2, help="WEB_CONCURRENCY")
+    ap.add_argument("--chunks", type=int, default=5000, help="synthetic chunks in the local + BM25 index")
+    ap.add_argument("--repeat", type=int, default=5, help="fresh interpreters for the import timing")
+    ap.add_argument("--port", type=int, default=8766)
+    ap.add_argument("--json", action="store_true", help="print results as JSON only")
+    add_fake_args(ap)
+    args = ap.parse_args()
+
+    fakes = FakeUpstreams(config_from_args(args)).start()
+    state = Path(tempfile.mkdtemp(prefix="bench_startup_"))
+    try:
+        build_local_state(state, synthetic_chunks(args.chunks))
+        env = {**os.environ, **fakes.env(),
+               "QDRANT_COLLECTION": COLLECTION, "VECTOR_BACKEND": "local",
+               "LOCAL_INDEX_DIR": str(state / "local_index"), "BM25_DIR": str(state / "bm25"),
+               "COLLECTION_VERSION_PATH": str(state / "version.json"),
+               "ENABLE_WEB_SEARCH": "0", "WEB_SPECULATE": "0", "PYTHONUNBUFFERED": "1"}
+        results = [{"phase": "import", **measure_import(env, args.repeat)}]
+        for preload in (False, True):
+            results.append({"phase": "ready", **measure_ready(
+                env, args.port, args.workers, preload, str(state / f"server_preload{int(preload)}.log"))})
+    finally:
+        fakes.stop()
+
+    if args.json:
+        print(json.dumps(results))
+        return
+    imp = results[0]
+    print(f"[bench] import server: {imp['import_s']}s + warm {imp['warm_s']}s, {imp['modules']} modules, "
+          f"heavy loaded: {', '.join(imp['heavy_loaded']) or 'none'}")
+    for r in results[1:]:
+        print(f"[bench] preload={'on ' if r['preload'] else 'off'} workers={r['workers']}: "
+              f"ready {r['first_ready_s']}s ({r['workers_answered']} answered), "
+              f"/ask first {r['first_ask_ms']}ms then {r['second_ask_ms']}ms, PSS {r['pss_mb']}MB")
+    print(f"[bench] logs in {state}")
+
+if __name__ == "__main__":
+    main()
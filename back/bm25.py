@@ -0,0 +1,153 @@
+# bm25.py — lexical inverted index (BM25) over the ingested chunks, fused with vector hits
+import os, re, json, gzip, math, time, threading
+from collections import Counter
+from pathlib import Path
+
+ROOT = Path(__file__).parent
+BM25_DIR = Path(os.getenv("BM25_DIR") or ROOT / "data" / "bm25")
+BM25_K1  = float(os.getenv("BM25_K1", "1.2"))
+BM25_B   = float(os.getenv("BM25_B", "0.75"))
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+def tokenize(text: str) -> list:
+    return _TOKEN.findall((text or "").lower())
+
+def index_path(collection: str) -> Path:
+    return BM25_DIR / f"{collection}.json.gz"
+
+class BM25Index:
+    """
+    Point id → payload, plus postings built from payload["text"].
+    On disk (gzip JSON): ids, payloads, doc_len and postings {term: [doc, tf, doc, tf, ...]},
+    so loading is a parse, not a re-tokenize. Mutations (add/delete) rebuild on save().
+    """
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.ids, self.payloads, self.doc_len, self.postings = [], [], [], {}
+        self._docs = None   # pid → payload, only materialized when mutating
+        self._idset = None
+
+    @classmethod
+    def load(cls, path: Path) -> "BM25Index":
+        idx = cls(path)
+        if idx.path.exists():
+            with gzip.open(idx.path, "rt", encoding="utf-8") as f:
+                data = json.load(f)
+            idx.ids, idx.payloads, idx.doc_len = data["ids"], data["payloads"], data["doc_len"]
+            idx.postings = data["postings"]
+        return idx
+
+    @property
+    def dirty(self) -> bool:
+        return self._docs is not None
+
+    def __contains__(self, pid) -> bool:
+        if self._docs is not None:
+            return str(pid) in self._docs
+        if self._idset is None:
+            self._idset = set(self.ids)
+        return str(pid) in self._idset
+
+    def __len__(self):
+        return len(self._docs) if self._docs is not None else len(self.ids)
+
+    def _mutable(self) -> dict:
+        if self._docs is None:
+            self._docs = dict(zip(self.ids, self.payloads))
+        return self._docs
+
+    def add(self, pid: str, payload: dict):
+        self._mutable()[str(pid)] = payload
+
+    def delete(self, ids):
+        ids = [str(pid) for pid in ids if pid in self]
+        if not ids:
+            return
+        docs = self._mutable()
+        for pid in ids:
+            docs.pop(pid, None)
+
+    def save(self):
+        if self._docs is not None:
+            self.ids = list(self._docs)
+            self.payloads = [self._docs[pid] for pid in self.ids]
+            self.doc_len, postings = [], {}
+            for d, p in enumerate(self.payloads):
+                tf = Counter(tokenize(p.get("text", "")))
+                self.doc_len.append(sum(tf.values()))
+                for term, n in tf.items():
+                    postings.setdefault(term, []).extend((d, n))
+            self.postings = postings
+            self._docs = self._idset = None
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        with gzip.open(tmp, "wt", encoding="utf-8", compresslevel=6) as f:
+            json.dump({"ids": self.ids, "payloads": self.payloads, "doc_len": self.doc_len,
+                       "postings": self.postings}, f, ensure_ascii=False, separators=(",", ":"))
+        tmp.replace(self.path)
+        print(f"[bm25] saved {len(self.ids)} docs, {len(self.postings)} terms → {self.path}")
+
+    def search(self, query: str, top_k: int = 10) -> list:
+        """Qdrant-shaped hits: [{"id", "score", "payload"}], best first."""
+        n = len(self.ids)
+        if n == 0:
+            return []
+        avgdl = (sum(self.doc_len) / n) or 1.0
+        scores = {}
+        for term in set(tokenize(query)):
+            post = self.postings.get(term)
+            if not post:
+                continue
+            df = len(post) // 2
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for i in range(0, len(post), 2):
+                d, tf = post[i], post[i + 1]
+                norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * self.doc_len[d] / avgdl)
+                scores[d] = scores.get(d, 0.0) + idf * tf * (BM25_K1 + 1) / norm
+        best = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:int(top_k)]
+        return [{"id": self.ids[d], "score": s, "payload": self.payloads[d]} for d, s in best]
+
+def rrf_fuse(result_lists, k: int = 60, limit: int = None) -> list:
+    """Reciprocal rank fusion of Qdrant-shaped hit lists, keyed by point id."""
+    fused, first = {}, {}
+    for hits in result_lists:
+        for rank, h in enumerate(hits):
+            pid = str(h.get("id"))
+            fused[pid] = fused.get(pid, 0.0) + 1.0 / (k + rank + 1)
+            first.setdefault(pid, h)
+    order = sorted(fused, key=fused.get, reverse=True)[:limit]
+    return [{**first[pid], "score": fused[pid]} for pid in order]
+
+class _Shared:
+    """Per-worker read-only index, loaded once and reloaded when ingest rewrites the file."""
+    def __init__(self, collection: str):
+        self.path = index_path(collection)
+        self.index, self._mtime, self._checked = None, None, 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        now = time.monotonic()
+        if now - self._checked < 5.0:
+            return self.index
+        with self._lock:
+            self._checked = now
+            try:
+                mtime = self.path.stat().st_mtime_ns
+            except OSError:
+                self.index, self._mtime = None, None
+                return None
+            if mtime != self._mtime:
+                try:
+                    self.index, self._mtime = BM25Index.load(self.path), mtime
+                except Exception as e:
+                    print(f"[bm25] failed to load {self.path}: {e}")
+        return self.index
+
+_shared = {}
+
+def shared_index(collection: str):
+    """The worker's BM25Index for `collection`, or None if ingest hasn't built one."""
+    if collection not in _shared:
+        _shared[collection] = _Shared(collection)
+    return _shared[collection].get()
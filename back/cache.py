@@ -0,0 +1,231 @@
+# cache.py — in-process LRU caches with an optional SQLite tier shared by gunicorn workers
+import os, time, json, sqlite3, threading, hashlib
+from array import array
+from collections import OrderedDict
+from typing import Callable, List, Optional
+
+from utils.text import normalize_question
+from utils.manifest import VERSION_PATH, read_collection_version
+
+class LRUCache:
+    """Thread-safe bounded LRU with optional per-entry expiry and hit/miss counters."""
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = max(0, int(maxsize))
+        self._d: "OrderedDict[str, object]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key: str):
+        with self._lock:
+            item = self._d.get(key)
+            if item is not None and (item[0] is None or item[0] >= time.time()):
+                self._d.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            if item is not None:
+                del self._d[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value, expires: Optional[float] = None):
+        if self.maxsize == 0:
+            return
+        with self._lock:
+            self._d[key] = (expires, value)
+            self._d.move_to_end(key)
+            while len(self._d) > self.maxsize:
+                self._d.popitem(last=False)
+
+    def __len__(self):
+        return len(self._d)
+
+class SQLiteTier:
+    """
+    Key → blob table in a local SQLite file (WAL), safe to share between processes.
+    Connections are per thread and per pid, so a fork never reuses a parent's handle.
+    Rows may carry an absolute expiry; the table is trimmed to `max_rows` oldest-first.
+    """
+    def __init__(self, path: str, table: str, max_rows: int = 100_000):
+        self.path, self.table, self.max_rows = path, table, int(max_rows)
+        self._local = threading.local()
+        self._puts = 0
+        self.hits = self.misses = 0
+        d = os.path.dirname(os.path.abspath(path))
+        os.makedirs(d, exist_ok=True)
+
+    def _conn(self) -> sqlite3.Connection:
+        c = getattr(self._local, "conn", None)
+        if c is None or getattr(self._local, "pid", None) != os.getpid():
+            c = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            c.execute("PRAGMA journal_mode=WAL")
+            c.execute("PRAGMA synchronous=NORMAL")
+            c.execute(f"CREATE TABLE IF NOT EXISTS {self.table} "
+                      "(k TEXT PRIMARY KEY, v BLOB NOT NULL, ts REAL NOT NULL, expires REAL)")
+            self._local.conn, self._local.pid = c, os.getpid()
+        return c
+
+    def reset(self):
+        """Drop this process's connections (a forked child opens its own)."""
+        self._local = threading.local()
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            row = self._conn().execute(
+                f"SELECT v, expires FROM {self.table} WHERE k=?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            print(f"[cache] sqlite get failed ({self.table}): {e}")
+            row = None
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def put(self, key: str, value: bytes, expires: Optional[float] = None):
+        try:
+            c = self._conn()
+            c.execute(f"INSERT OR REPLACE INTO {self.table} (k, v, ts, expires) VALUES (?,?,?,?)",
+                      (key, value, time.time(), expires))
+            self._puts += 1
+            if self._puts % 256 == 0:
+                c.execute(f"DELETE FROM {self.table} WHERE expires IS NOT NULL AND expires < ?", (time.time(),))
+                c.execute(f"DELETE FROM {self.table} WHERE k IN (SELECT k FROM {self.table} "
+                          f"ORDER BY ts DESC LIMIT -1 OFFSET ?)", (self.max_rows,))
+        except sqlite3.Error as e:
+            print(f"[cache] sqlite put failed ({self.table}): {e}")
+
+def _key(*parts: str) -> str:
+    return hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    """
+    Query embeddings keyed on (model, normalized question). Memory LRU in front of an
+    optional SQLite tier (float32 blobs) that survives worker restarts.
+    """
+    def __init__(self, maxsize: int = 2048, db_path: Optional[str] = None):
+        self.mem = LRUCache(maxsize)
+        self.disk = SQLiteTier(db_path, "query_embeddings") if db_path else None
+
+    def get(self, question: str, model: str) -> Optional[List[float]]:
+        k = _key(model, normalize_question(question))
+        vec = self.mem.get(k)
+        if vec is None and self.disk:
+            blob = self.disk.get(k)
+            if blob is not None:
+                vec = array("f", blob).tolist()
+                self.mem.put(k, vec)
+        return vec
+
+    def put(self, question: str, model: str, vec: List[float]):
+        k = _key(model, normalize_question(question))
+        self.mem.put(k, vec)
+        if self.disk:
+            self.disk.put(k, array("f", vec).tobytes())
+
+    def get_or_embed(self, question: str, model: str, embed: Callable[[str], List[float]]) -> List[float]:
+        vec = self.get(question, model)
+        if vec is None:
+            vec = embed(question)
+            self.put(question, model, vec)
+        return vec
+
+    def get_or_embed_many(self, questions: List[str], model: str,
+                          embed_many: Callable[[List[str]], List[List[float]]]) -> List[List[float]]:
+        """Batch form: cached vectors are reused, all misses go to one embed_many() call."""
+        vecs = [self.get(q, model) for q in questions]
+        missing = [i for i, v in enumerate(vecs) if v is None]
+        if missing:
+            for i, vec in zip(missing, embed_many([questions[i] for i in missing])):
+                vecs[i] = vec
+                self.put(questions[i], model, vec)
+        return vecs
+
+    def stats(self) -> dict:
+        out = {"memory": {"hits": self.mem.hits, "misses": self.mem.misses, "size": len(self.mem)}}
+        if self.disk:
+            out["disk"] = {"hits": self.disk.hits, "misses": self.disk.misses}
+        return out
+
+def reset_tiers(*caches):
+    """reset() the SQLite tier of each cache that has one."""
+    for c in caches:
+        if getattr(c, "disk", None):
+            c.disk.reset()
+
+class CollectionVersion:
+    """A collection's ingest version, re-read only when the version file's mtime changes."""
+    def __init__(self, collection: str, path=VERSION_PATH, check_every: float = 1.0):
+        self.collection, self.path, self.check_every = collection, str(path), check_every
+        self._mtime, self._checked, self._value = None, 0.0, "0"
+        self._lock = threading.Lock()
+
+    def get(self) -> str:
+        now = time.monotonic()
+        if now - self._checked < self.check_every:
+            return self._value
+        with self._lock:
+            self._checked = now
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError:
+                mtime = None
+            if mtime != self._mtime:
+                self._mtime = mtime
+                self._value = read_collection_version(self.collection, self.path)
+        return self._value
+
+class AnswerCache:
+    """
+    Full /ask responses keyed on (collection version, normalized question, web flags).
+    Corpus answers live `ttl` seconds, web answers `web_ttl`. A re-ingest bumps the
+    collection version, so older entries simply stop matching.
+    The last answer per stale_key() is also kept in memory without expiry or version:
+    a request that runs out of time can still get it (stale()).
+    """
+    def __init__(self, maxsize: int = 1024, db_path: Optional[str] = None,
+                 ttl: float = 3600, web_ttl: float = 300):
+        self.mem = LRUCache(maxsize)
+        self.last = LRUCache(maxsize)
+        self.disk = SQLiteTier(db_path, "answers") if db_path else None
+        self.ttl, self.web_ttl = ttl, web_ttl
+
+    @staticmethod
+    def key(question: str, web: bool, web_domains, version: str) -> str:
+        domains = ",".join(sorted(d.strip().lower() for d in (web_domains or []) if d))
+        return _key(version, normalize_question(question), "web" if web else "", domains)
+
+    @classmethod
+    def stale_key(cls, question: str, web: bool, web_domains) -> str:
+        return cls.key(question, web, web_domains, "*")
+
+    def get(self, key: str) -> Optional[dict]:
+        val = self.mem.get(key)
+        if val is None and self.disk:
+            blob = self.disk.get(key)
+            if blob is not None:
+                val = json.loads(blob)
+                # remaining disk TTL isn't tracked; the shorter TTL is always safe here
+                self.mem.put(key, val, time.time() + min(self.ttl, self.web_ttl))
+        return val
+
+    def put(self, key: str, value: dict, from_web: bool = False, short: bool = False, stale_key: str = None):
+        """`short`: keep a corpus answer only `web_ttl` too (e.g. "don't know": the web may answer later)."""
+        if stale_key:
+            self.last.put(stale_key, value)
+        ttl = self.web_ttl if (from_web or short) else self.ttl
+        if ttl <= 0:
+            return
+        expires = time.time() + ttl
+        self.mem.put(key, value, expires)
+        if self.disk:
+            self.disk.put(key, json.dumps(value).encode("utf-8"), expires)
+
+    def stale(self, stale_key: str) -> Optional[dict]:
+        return self.last.get(stale_key)
+
+    def stats(self) -> dict:
+        out = {"memory": {"hits": self.mem.hits, "misses": self.mem.misses, "size": len(self.mem)},
+               "stale": {"hits": self.last.hits, "misses": self.last.misses, "size": len(self.last)}}
+        if self.disk:
+            out["disk"] = {"hits": self.disk.hits, "misses": self.disk.misses}
+        return out
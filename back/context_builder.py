@@ -0,0 +1,70 @@
+# context_builder.py — pack ranked chunks into a token budget, skipping near-duplicates
+import os, re
+from typing import List, Tuple
+
+CONTEXT_SEPARATOR = "\n\n---\n\n"
+SHINGLE_WORDS     = int(os.getenv("DEDUP_SHINGLE_WORDS", "5"))
+DEDUP_THRESHOLD   = float(os.getenv("DEDUP_THRESHOLD", "0.8"))   # shingle containment to call it a duplicate
+
+_encoder = None
+
+def _get_encoder():
+    """tiktoken when installed; otherwise False and count_tokens() estimates."""
+    global _encoder
+    if _encoder is None:
+        try:
+            import tiktoken
+            try:
+                _encoder = tiktoken.encoding_for_model(os.getenv("CHAT_MODEL", "gpt-4o-mini"))
+            except KeyError:
+                _encoder = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            _encoder = False
+    return _encoder
+
+def count_tokens(text: str) -> int:
+    enc = _get_encoder()
+    if enc:
+        return len(enc.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4   # ~4 chars per token for English prose
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+def shingles(text: str, n: int = SHINGLE_WORDS) -> set:
+    words = _WORD.findall(text.lower())
+    if len(words) <= n:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + n]) for i in range(len(words) - n + 1)}
+
+def _containment(a: set, b: set) -> float:
+    """Share of the smaller shingle set found in the other; catches a chunk quoted inside another."""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / min(len(a), len(b))
+
+def build_context(hits: List[dict], budget_tokens: int,
+                  threshold: float = DEDUP_THRESHOLD) -> Tuple[str, List[dict]]:
+    """
+    Walk `hits` (best first) and keep each chunk whose text is not a near-duplicate
+    of one already kept and which still fits in `budget_tokens`. Chunks that don't
+    fit are skipped, not cut, so a smaller lower-ranked chunk can still use the room.
+    Returns (context, kept hits).
+    """
+    sep_tokens = count_tokens(CONTEXT_SEPARATOR)
+    kept, kept_shingles, texts = [], [], []
+    used = 0
+    for h in hits:
+        text = ((h.get("payload") or {}).get("text") or "").strip()
+        if not text:
+            continue
+        sh = shingles(text)
+        if any(_containment(sh, other) >= threshold for other in kept_shingles):
+            continue
+        cost = count_tokens(text) + (sep_tokens if texts else 0)
+        if used + cost > budget_tokens:
+            continue
+        used += cost
+        kept.append(h)
+        kept_shingles.append(sh)
+        texts.append(text)
+    return CONTEXT_SEPARATOR.join(texts), kept
@@ -0,0 +1,63 @@
+# deadline.py — one time budget per request, carried in a contextvar to every upstream call
+#
+#   with deadline.budget(60):
+#       answer_question(q, ...)     # each HTTP call, retry sleep and scheduler wait gets what's left
+#
+# Threads started with the caller's context (metrics.submit, asyncio.to_thread) and asyncio tasks
+# inherit the budget. Outside any budget nothing changes: calls keep their own timeouts.
+import time, asyncio, contextvars
+from contextlib import contextmanager
+from typing import Optional
+
+class DeadlineExceeded(TimeoutError):
+    """The request's budget ran out before (or while) `what` ran."""
+    def __init__(self, what: str = "call"):
+        super().__init__(f"deadline exceeded at {what}")
+        self.what = what
+
+_deadline: contextvars.ContextVar = contextvars.ContextVar("deadline", default=None)   # time.monotonic()
+
+@contextmanager
+def budget(seconds: float):
+    """Code in this block must finish within `seconds`. Nested budgets never extend an outer one."""
+    end = time.monotonic() + seconds
+    outer = _deadline.get()
+    token = _deadline.set(end if outer is None else min(end, outer))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+def remaining() -> Optional[float]:
+    """Seconds left in the current budget (never negative), or None outside one."""
+    end = _deadline.get()
+    return None if end is None else max(0.0, end - time.monotonic())
+
+def expired() -> bool:
+    left = remaining()
+    return left is not None and left <= 0
+
+def allows(seconds: float) -> bool:
+    """True if there is no budget or at least `seconds` of it left."""
+    left = remaining()
+    return left is None or left >= seconds
+
+def timeout(seconds: float, what: str = "call") -> float:
+    """A call's own timeout cut to the budget left; raises DeadlineExceeded when none is."""
+    left = remaining()
+    if left is None:
+        return seconds
+    if left <= 0:
+        raise DeadlineExceeded(what)
+    return min(seconds, left)
+
+def sleep(seconds: float, what: str = "retry"):
+    """time.sleep() for a retry backoff, or DeadlineExceeded now if the retry couldn't start in time."""
+    if not allows(seconds):
+        raise DeadlineExceeded(what)
+    time.sleep(seconds)
+
+async def asleep(seconds: float, what: str = "retry"):
+    if not allows(seconds):
+        raise DeadlineExceeded(what)
+    await asyncio.sleep(seconds)
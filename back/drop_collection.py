@@ -1,6 +1,7 @@
 # drop_collection.py
 import os, requests
 from dotenv import load_dotenv
+from utils.manifest import bump_collection_version
 load_dotenv()
 
 base = os.getenv("QDRANT_URL")
@@ -9,3 +10,5 @@ coll = os.getenv("QDRANT_COLLECTION", "company_knowledge")
 
 r = requests.delete(f"{base}/collections/{coll}", headers={"api-key":key}, timeout=20)
 print(r.status_code, r.text)
+if r.ok:
+    bump_collection_version(coll)
@@ -0,0 +1,106 @@
+# embedding_store.py — local, append-only store of chunk embeddings keyed by (model, chunk text hash)
+# Re-creating or migrating a collection re-uses these instead of calling /embeddings again.
+import os, re, json, threading
+from pathlib import Path
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from utils.manifest import sha256_text
+
+ROOT = Path(__file__).parent
+EMBED_STORE_DIR   = Path(os.getenv("EMBED_STORE_DIR") or ROOT / "data" / "embeddings")
+EMBED_STORE_DTYPE = os.getenv("EMBED_STORE_DTYPE", "float16")   # float16 (half the disk) | float32
+
+class EmbeddingStore:
+    """
+    One directory per model under EMBED_STORE_DIR:
+      vectors.bin  (N, dim) matrix of EMBED_STORE_DTYPE, row i ↔ line i of keys.txt, memory-mapped
+      keys.txt     one sha256(chunk text) per line
+      meta.json    {"model", "dim", "dtype"}
+    Both files are append-only; after a crash the shorter of the two wins. One writer process at a time.
+    """
+    def __init__(self, model: str, root: Path = EMBED_STORE_DIR, dtype: str = EMBED_STORE_DTYPE):
+        self.model = model
+        self.dir = Path(root) / re.sub(r"[^A-Za-z0-9_.-]+", "_", model)
+        self.dtype = np.dtype(dtype)
+        self.dim = None
+        self._lock = threading.Lock()
+        self._index = {}     # hash → row
+        self._mm = None      # rows present when opened
+        self._tail = []      # rows appended since
+        self.hits = self.embedded = 0
+        self._open()
+
+    @property
+    def _vec_path(self): return self.dir / "vectors.bin"
+    @property
+    def _keys_path(self): return self.dir / "keys.txt"
+    @property
+    def _meta_path(self): return self.dir / "meta.json"
+
+    def _open(self):
+        try:
+            meta = json.loads(self._meta_path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return
+        self.dim, self.dtype = int(meta["dim"]), np.dtype(meta["dtype"])
+        keys = self._keys_path.read_text(encoding="utf-8").split() if self._keys_path.exists() else []
+        row_bytes = self.dim * self.dtype.itemsize
+        size = self._vec_path.stat().st_size if self._vec_path.exists() else 0
+        n = min(len(keys), size // row_bytes)
+        if n < len(keys) or n * row_bytes < size:   # torn append: trim both files to the complete rows
+            with self._vec_path.open("r+b") as f:
+                f.truncate(n * row_bytes)
+            self._keys_path.write_text("".join(k + "\n" for k in keys[:n]), encoding="utf-8")
+            keys = keys[:n]
+        self._index = {k: i for i, k in enumerate(keys)}
+        self._mm = np.memmap(self._vec_path, dtype=self.dtype, mode="r", shape=(n, self.dim)) if n else None
+
+    def __len__(self):
+        return len(self._index)
+
+    def _row(self, i: int):
+        n = 0 if self._mm is None else self._mm.shape[0]
+        return self._mm[i] if i < n else self._tail[i - n]
+
+    def get_many(self, hashes: List[str]) -> List[Optional[List[float]]]:
+        with self._lock:
+            rows = [self._index.get(h) for h in hashes]
+            return [None if i is None else self._row(i).astype(np.float32).tolist() for i in rows]
+
+    def put_many(self, hashes: List[str], vectors: List[List[float]]):
+        with self._lock:
+            new = list({h: v for h, v in zip(hashes, vectors) if h not in self._index}.items())
+            if not new:
+                return
+            mat = np.asarray([v for _, v in new], dtype=self.dtype)
+            if self.dim is None:
+                self.dim = mat.shape[1]
+                self.dir.mkdir(parents=True, exist_ok=True)
+                self._meta_path.write_text(json.dumps({"model": self.model, "dim": self.dim,
+                                                       "dtype": self.dtype.name}), encoding="utf-8")
+            elif mat.shape[1] != self.dim:
+                raise ValueError(f"vector size {mat.shape[1]} != stored dim {self.dim} for {self.model}")
+            with self._vec_path.open("ab") as f:
+                f.write(mat.tobytes())
+            with self._keys_path.open("a", encoding="utf-8") as f:
+                f.write("".join(h + "\n" for h, _ in new))
+            for (h, _), row in zip(new, mat):
+                self._index[h] = len(self._index)
+                self._tail.append(row)
+
+    def embed(self, texts: List[str], embed_many: Callable[[List[str]], List[List[float]]]) -> List[List[float]]:
+        """Vectors for `texts`, calling embed_many() only for chunks not stored yet."""
+        hashes = [sha256_text(t) for t in texts]
+        vecs = self.get_many(hashes)
+        missing = [i for i, v in enumerate(vecs) if v is None]
+        if missing:
+            fresh = embed_many([texts[i] for i in missing])
+            self.put_many([hashes[i] for i in missing], fresh)
+            for i, v in zip(missing, fresh):
+                vecs[i] = v
+        with self._lock:
+            self.hits += len(texts) - len(missing)
+            self.embedded += len(missing)
+        return vecs
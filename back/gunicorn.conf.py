@@ -0,0 +1,19 @@
+# gunicorn.conf.py — worker setup for the Procfile's `web:` process (run from back/)
+import os, gc, sys
+
+workers      = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "gthread"
+timeout      = 120
+# Import server.py (and warm its read-only state) once in the master; workers fork from it
+# and share those pages copy-on-write instead of each paying the import and warm-up
+preload_app  = (os.getenv("GUNICORN_PRELOAD") or "1").strip().lower() in ("1", "true", "yes", "on")
+
+def pre_fork(server, worker):
+    # Everything allocated so far is long-lived: keep the collector from walking (and so
+    # writing to, and un-sharing) those objects in every worker
+    gc.freeze()
+
+def post_fork(server, worker):
+    app = sys.modules.get("server")   # only imported here when preloaded
+    if app is not None:
+        app.after_fork()
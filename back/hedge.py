@@ -0,0 +1,166 @@
+# hedge.py — hedged idempotent reads (query embedding, vector search)
+#
+# A call that hasn't answered by the observed p95 latency of its endpoint gets a second,
+# identical request; whichever succeeds first is used and the other is abandoned. Only
+# endpoints named in HEDGE_READS are hedged, never more than HEDGE_MAX_RATIO of their
+# calls (so a slow upstream isn't hit with twice the load), and only once HEDGE_MIN_SAMPLES
+# latencies are known.
+import os, time, asyncio, threading, contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import deadline
+import metrics
+
+HEDGE_READS       = {s.strip() for s in os.getenv("HEDGE_READS", "embeddings,search").split(",") if s.strip()}
+HEDGE_QUANTILE    = float(os.getenv("HEDGE_QUANTILE", "0.95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "50"))
+HEDGE_MAX_RATIO   = float(os.getenv("HEDGE_MAX_RATIO", "0.1"))
+HEDGE_MIN_DELAY_S = float(os.getenv("HEDGE_MIN_DELAY_S", "0.005"))
+HEDGE_WORKERS     = int(os.getenv("HEDGE_WORKERS", "32"))   # threads for sync hedged calls, per process
+
+_pool = None
+_pool_lock = threading.Lock()
+_pool_room = threading.BoundedSemaphore(max(1, HEDGE_WORKERS // 2))   # hedged calls use up to 2 threads
+
+def _executor() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="hedge")
+    return _pool
+
+def reset():
+    """Forget the thread pool (a forked worker starts its own)."""
+    global _pool
+    _pool = None
+
+class Hedger:
+    """Latency window and hedging for one endpoint; call() for threads, acall() for coroutines."""
+    def __init__(self, name: str, enabled: bool = True, window: int = 512):
+        self.name, self.enabled = name, enabled
+        self._lat = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._p, self._n = None, 0
+        self.calls = self.hedged = self.won = 0
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self._lat.append(seconds)
+            self._n += 1
+            if self._n % 32 == 0:
+                self._p = None   # recomputed on the next delay()
+
+    def delay(self):
+        """Seconds to wait before hedging this call, or None to not hedge it."""
+        with self._lock:
+            self.calls += 1
+            if not self.enabled or len(self._lat) < HEDGE_MIN_SAMPLES or self.hedged >= self.calls * HEDGE_MAX_RATIO:
+                return None
+            if self._p is None:
+                lat = sorted(self._lat)
+                self._p = max(HEDGE_MIN_DELAY_S, lat[min(len(lat) - 1, int(len(lat) * HEDGE_QUANTILE))])
+            return self._p
+
+    def _timed(self, fn, *args):
+        t0 = time.perf_counter()
+        out = fn(*args)
+        self.observe(time.perf_counter() - t0)
+        return out
+
+    async def _atimed(self, fn, *args):
+        t0 = time.perf_counter()
+        out = await fn(*args)
+        self.observe(time.perf_counter() - t0)
+        return out
+
+    def _count_hedge(self):
+        with self._lock:
+            self.hedged += 1
+        metrics.inc("hedged_requests_total", endpoint=self.name, result="sent")
+
+    def _count_win(self):
+        with self._lock:
+            self.won += 1
+        metrics.inc("hedged_requests_total", endpoint=self.name, result="won")
+
+    def call(self, fn, *args):
+        delay = self.delay()
+        if delay is None or not _pool_room.acquire(blocking=False):
+            return self._timed(fn, *args)
+        pool = _executor()
+        futures = [pool.submit(contextvars.copy_context().run, self._timed, fn, *args)]
+        pending = set(futures)
+        try:
+            done, pending = wait(pending, timeout=delay)
+            if not done and deadline.allows(delay):
+                self._count_hedge()
+                futures.append(pool.submit(contextvars.copy_context().run, self._timed, fn, *args))
+                pending.add(futures[1])
+            while True:
+                for f in done:
+                    if f.exception() is None:
+                        if f is not futures[0]:
+                            self._count_win()
+                        return f.result()
+                if not pending:
+                    return futures[0].result()   # every attempt failed: the first one's error
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        finally:
+            # the threads are ours again once the abandoned attempt finishes too
+            left = [len(futures)]
+            lock = threading.Lock()
+
+            def release(_):
+                with lock:
+                    left[0] -= 1
+                    if left[0]:
+                        return
+                _pool_room.release()
+            for f in futures:
+                f.add_done_callback(release)
+
+    async def acall(self, fn, *args):
+        delay = self.delay()
+        if delay is None:
+            return await self._atimed(fn, *args)
+        tasks = [asyncio.ensure_future(self._atimed(fn, *args))]
+        pending = set(tasks)
+        try:
+            done, pending = await asyncio.wait(pending, timeout=delay)
+            if not done and deadline.allows(delay):
+                self._count_hedge()
+                tasks.append(asyncio.ensure_future(self._atimed(fn, *args)))
+                pending.add(tasks[1])
+            while True:
+                for t in done:
+                    if t.exception() is None:
+                        if t is not tasks[0]:
+                            self._count_win()
+                        return t.result()
+                if not pending:
+                    return tasks[0].result()
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for t in tasks:
+                if not t.done():
+                    t.cancel()
+                t.add_done_callback(lambda t: t.cancelled() or t.exception())   # retrieved
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"enabled": self.enabled, "calls": self.calls, "hedged": self.hedged, "won": self.won,
+                    "delay_ms": None if self._p is None else round(self._p * 1000, 1), "samples": len(self._lat)}
+
+_hedgers = {}
+
+def hedger(name: str) -> Hedger:
+    """The process-wide Hedger for endpoint `name` (hedging only if it's in HEDGE_READS)."""
+    h = _hedgers.get(name)
+    if h is None:
+        h = _hedgers.setdefault(name, Hedger(name, enabled=name in HEDGE_READS))
+    return h
+
+def stats() -> dict:
+    return {name: h.stats() for name, h in _hedgers.items()}
@@ -0,0 +1,139 @@
+# http_client.py — one shared keep-alive requests.Session for Qdrant, OpenAI and the crawler,
+# plus an httpx.AsyncClient per event loop for the async serving mode (asgi.py)
+import os, asyncio, threading
+import requests
+from requests.adapters import HTTPAdapter
+
+import deadline
+
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "8"))    # distinct hosts kept pooled
+HTTP_POOL_MAXSIZE     = int(os.getenv("HTTP_POOL_MAXSIZE", "32"))       # keep-alive sockets per host
+HTTP_CONNECT_TIMEOUT  = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))   # seconds; read timeout is per call
+HTTP_ASYNC_MAX_CONNECTIONS = int(os.getenv("HTTP_ASYNC_MAX_CONNECTIONS", "128"))   # per event loop, all hosts
+HTTP_ASYNC_SHARD_SIZE = 16   # sockets per httpx client; its pool does O(sockets²) work per request
+
+_lock = threading.Lock()
+_session = None
+_pid = None
+_aclients = {}   # event loop → ([httpx.AsyncClient, ...], asyncio.Semaphore, round-robin counter)
+
+def session() -> requests.Session:
+    """
+    The process-wide Session. urllib3 pools are thread-safe, so all threads share
+    one set of sockets per host. Re-created after a fork so workers never share sockets.
+    """
+    global _session, _pid
+    if _session is not None and _pid == os.getpid():
+        return _session
+    with _lock:
+        if _session is None or _pid != os.getpid():
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_CONNECTIONS,
+                                  pool_maxsize=HTTP_POOL_MAXSIZE, pool_block=False)
+            s.mount("https://", adapter)
+            s.mount("http://", adapter)
+            _session, _pid = s, os.getpid()
+    return _session
+
+def reset():
+    """Forget the session without closing it: after a fork its sockets belong to the parent."""
+    global _session, _pid
+    with _lock:
+        _session, _pid = None, None
+        _aclients.clear()
+
+def _what(url: str) -> str:
+    return url.split("?", 1)[0].rstrip("/").rsplit("/", 1)[-1]
+
+def request(method: str, url: str, timeout=60, **kw) -> requests.Response:
+    """
+    requests.request() on the pooled session; a bare number `timeout` is the read timeout.
+    Inside a deadline.budget() both timeouts are cut to what's left of it, and running out
+    raises deadline.DeadlineExceeded instead of requests.Timeout.
+    """
+    if isinstance(timeout, (int, float)):
+        timeout = (HTTP_CONNECT_TIMEOUT, timeout)
+    if deadline.remaining() is not None:
+        timeout = tuple(deadline.timeout(t, _what(url)) for t in timeout)
+    try:
+        return session().request(method, url, timeout=timeout, **kw)
+    except requests.Timeout as e:
+        if deadline.expired():
+            raise deadline.DeadlineExceeded(_what(url)) from e
+        raise
+
+def get(url, **kw):    return request("GET", url, **kw)
+def post(url, **kw):   return request("POST", url, **kw)
+def put(url, **kw):    return request("PUT", url, **kw)
+def delete(url, **kw): return request("DELETE", url, **kw)
+
+def _async_pool():
+    """
+    The running event loop's clients. httpcore's pool bookkeeping costs CPU per request in
+    proportion to queued requests × sockets, and to sockets² on its own; with hundreds of
+    questions in flight that, not the network, becomes the limit. So HTTP_ASYNC_MAX_CONNECTIONS
+    is split over clients of HTTP_ASYNC_SHARD_SIZE sockets, and callers beyond it queue on a
+    semaphore instead of inside httpcore.
+    """
+    import httpx
+    loop = asyncio.get_running_loop()
+    pool = _aclients.get(loop)
+    if pool is None:
+        size = min(HTTP_ASYNC_SHARD_SIZE, HTTP_ASYNC_MAX_CONNECTIONS)
+        limits = httpx.Limits(max_connections=size, max_keepalive_connections=size)
+        clients = [httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(60, connect=HTTP_CONNECT_TIMEOUT))
+                   for _ in range(max(1, HTTP_ASYNC_MAX_CONNECTIONS // size))]
+        pool = _aclients[loop] = [clients, asyncio.Semaphore(len(clients) * size), 0]
+    return pool
+
+def async_client():
+    """One of the running event loop's httpx.AsyncClients (round robin); keep-alive pools per host."""
+    pool = _async_pool()
+    pool[2] += 1
+    return pool[0][pool[2] % len(pool[0])]
+
+async def aclose():
+    """Close this event loop's clients (on shutdown)."""
+    pool = _aclients.pop(asyncio.get_running_loop(), None)
+    for c in (pool[0] if pool else ()):
+        await c.aclose()
+
+async def arequest(method: str, url: str, timeout=60, **kw):
+    """request() for coroutines (same deadline handling); returns an httpx.Response."""
+    import httpx
+    if isinstance(timeout, (int, float)):
+        if deadline.remaining() is not None:
+            timeout = httpx.Timeout(deadline.timeout(timeout, _what(url)),
+                                    connect=deadline.timeout(HTTP_CONNECT_TIMEOUT, _what(url)))
+        else:
+            timeout = httpx.Timeout(timeout, connect=HTTP_CONNECT_TIMEOUT)
+    try:
+        async with _async_pool()[1]:
+            return await async_client().request(method, url, timeout=timeout, **kw)
+    except httpx.TimeoutException as e:
+        if deadline.expired():
+            raise deadline.DeadlineExceeded(_what(url)) from e
+        raise
+
+async def apost(url, **kw): return await arequest("POST", url, **kw)
+
+def pool_stats() -> dict:
+    """Per host: connections opened vs requests served (the difference is keep-alive reuse)."""
+    out = {}
+    s = _session
+    if s is None or _pid != os.getpid():
+        return out
+    seen = set()
+    for adapter in s.adapters.values():
+        if id(adapter) in seen:
+            continue
+        seen.add(id(adapter))
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host = f"{key.key_scheme}://{key.key_host}" + (f":{key.key_port}" if key.key_port else "")
+            opened, served = pool.num_connections, pool.num_requests
+            out[host] = {"connections": opened, "requests": served, "reused": max(0, served - opened)}
+    return out
@@ -1,15 +1,19 @@
-# ingest.py  (drop-in replacement)
+# ingest.py  — corpus extraction; streams documents into ingest_to_qdrant (CSV export optional)
 import os
 import re
 import csv
+import json
+import time
+import datetime
+import tempfile
+import signal
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
 from pathlib import Path
 
-# 3rd-party extractors
-from bs4 import BeautifulSoup
-import chardet
-from pdfminer.high_level import extract_text as pdf_extract
-from docx import Document
-import pandas as pd
+from utils.manifest import sha256_file
+from utils.text import chunk_stream
 
 ROOT = Path(__file__).parent
 # Your unified folder (as you created it)
@@ -18,59 +22,233 @@ OUT_CSV = ROOT / "data" / "drive_corpus.csv"
 
 DOC_CHAR_LIMIT = int(os.getenv("DOC_CHAR_LIMIT", "25000"))  # hard cap per file
 CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1800"))           # chunk size for Qdrant
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "0"))        # chars shared by neighbouring chunks
+
+# Extraction fans out over processes; one stuck file can't hold the run past EXTRACT_TIMEOUT
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", "0")) or (os.cpu_count() or 2)
+EXTRACT_TIMEOUT = float(os.getenv("EXTRACT_TIMEOUT", "120"))   # seconds per file
+
+log = logging.getLogger("ingest")
 
 def _read_bin_text(path: Path) -> str:
     """Load binary then decode using best-guess encoding."""
     with path.open("rb") as f:
         raw = f.read()
+    import chardet
     enc = (chardet.detect(raw) or {}).get("encoding") or "utf-8"
     return raw.decode(enc, errors="ignore")
 
-def read_file_text(path: Path) -> str:
+def _cell(v) -> str:
+    """A cell value as one line of text; a value that won't format cleanly falls back to str()."""
+    if v is None:
+        return ""
+    try:
+        if isinstance(v, float) and v.is_integer():
+            v = int(v)
+        elif isinstance(v, datetime.datetime):
+            v = v.isoformat(sep=" ") if (v.hour or v.minute or v.second) else v.date().isoformat()
+        elif isinstance(v, (datetime.date, datetime.time)):
+            v = v.isoformat()
+    except Exception:
+        pass
+    return " ".join(str(v).split())
+
+def _row_line(cells) -> str:
+    """A row as a CSV-ish line; values with commas or quotes are quoted."""
+    out = []
+    for c in cells:
+        out.append(f'"{c.replace(chr(34), chr(34) * 2)}"' if ("," in c or '"' in c) else c)
+    return ",".join(out)
+
+def sheet_chunks(path: Path, size: int = CHUNK_SIZE):
+    """
+    Stream an .xlsx with openpyxl in read-only mode and yield row-group chunks:
+    each starts with "# Sheet: <name>" and the sheet's header row, followed by as many
+    whole data rows as fit in `size` chars. Rows are never split across chunks (a single
+    oversized row is cut into pieces, each under the same header), and nothing is truncated.
+    Memory is bounded by one chunk, not the workbook.
+    """
+    from openpyxl import load_workbook
+    wb = load_workbook(str(path), read_only=True, data_only=True)
+    try:
+        for ws in wb.worksheets:
+            if not hasattr(ws, "iter_rows"):
+                continue   # chartsheet
+            ws.reset_dimensions()   # don't trust the stored sheet size; read every row there is
+            header, rows, used = None, [], 0
+            for values in ws.iter_rows(values_only=True):
+                cells = [_cell(v) for v in values]
+                while cells and not cells[-1]:
+                    cells.pop()
+                if not cells:
+                    continue
+                line = _row_line(cells)
+                if header is None:
+                    header = f"# Sheet: {ws.title}\n{line}"
+                    continue
+                if rows and used + len(line) + 1 > size - len(header):
+                    yield header + "\n" + "\n".join(rows)
+                    rows, used = [], 0
+                room = max(200, size - len(header) - 1)
+                if len(line) > room:
+                    for piece in chunk_stream(line, size=room, overlap=0):
+                        yield header + "\n" + piece
+                    continue
+                rows.append(line)
+                used += len(line) + 1
+            if rows:
+                yield header + "\n" + "\n".join(rows)
+            elif header is not None:
+                yield header   # header-only sheet: still say what it tracks
+    finally:
+        wb.close()
+
+def _extract(path: Path):
+    """Text of a file, or for spreadsheets a lazy iterator of row-group chunks."""
+    # Extractors are imported on first use (in the pool processes), not when ingest is imported
     ext = path.suffix.lower()
+    if ext == ".pdf":
+        from pdfminer.high_level import extract_text as pdf_extract
+        return pdf_extract(str(path))
+    elif ext == ".docx":
+        from docx import Document
+        doc = Document(str(path))
+        return "\n".join(p.text for p in doc.paragraphs)
+    elif ext == ".xlsx":
+        return sheet_chunks(path)
+    elif ext == ".xls":
+        # legacy format (openpyxl can't stream it): all sheets as CSV-ish text
+        import pandas as pd
+        out = []
+        xls = pd.read_excel(str(path), sheet_name=None, dtype=str)
+        for name, df in xls.items():
+            out.append(f"# Sheet: {name}\n" + df.to_csv(index=False))
+        return "\n\n".join(out)
+    elif ext == ".csv":
+        return _read_bin_text(path)
+    elif ext in (".html", ".htm"):
+        html = _read_bin_text(path)
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup(html, "lxml")
+        return soup.get_text(" ", strip=True)
+    else:
+        # txt, md, json, etc.
+        return _read_bin_text(path)
+
+class SpooledChunks:
+    """
+    Chunks a pool process wrote to a temp file, one JSON string per line, so they cross the
+    process boundary as a path instead of one pickled list. Iterating reads them back one at
+    a time and deletes the file at the end; discard() deletes it unread.
+    """
+    def __init__(self, chunks):
+        fd, self.path = tempfile.mkstemp(prefix="ingest_", suffix=".jsonl")
+        self.count = self.chars = 0
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                for chunk in chunks:
+                    f.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+                    self.count += 1
+                    self.chars += len(chunk)
+        except BaseException:
+            self.discard()
+            raise
+
+    def __len__(self):
+        return self.chars
+
+    def __iter__(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    yield json.loads(line)
+        finally:
+            self.discard()
+
+    def discard(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+def _on_alarm(signum, frame):
+    raise TimeoutError("extraction timed out")
+
+def _extract_worker(path: str, timeout: float):
+    """Runs in a pool process. Returns (text or SpooledChunks or None, seconds, error or None); never raises."""
+    t0 = time.perf_counter()
+    # SIGALRM interrupts a runaway parser inside the worker (POSIX only); the parent
+    # also stops waiting after the timeout, which covers platforms without it.
+    use_alarm = hasattr(signal, "SIGALRM") and timeout > 0
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _on_alarm)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
     try:
-        if ext == ".pdf":
-            return pdf_extract(str(path))
-        elif ext == ".docx":
-            doc = Document(str(path))
-            return "\n".join(p.text for p in doc.paragraphs)
-        elif ext in (".xlsx", ".xls"):
-            # read all sheets as CSV-ish text
-            out = []
-            xls = pd.read_excel(str(path), sheet_name=None, dtype=str)
-            for name, df in xls.items():
-                out.append(f"# Sheet: {name}\n" + df.to_csv(index=False))
-            return "\n\n".join(out)
-        elif ext == ".csv":
-            return _read_bin_text(path)
-        elif ext in (".html", ".htm"):
-            html = _read_bin_text(path)
-            soup = BeautifulSoup(html, "lxml")
-            return soup.get_text(" ", strip=True)
-        else:
-            # txt, md, json, etc.
-            return _read_bin_text(path)
-    except Exception as e:
-        print(f"[ingest] WARN: failed to read {path}: {e}")
-        return ""
+        out = _extract(Path(path))
+        if not isinstance(out, str):
+            out = SpooledChunks(out)
+        return out, time.perf_counter() - t0, None
+    except BaseException as e:
+        return None, time.perf_counter() - t0, f"{type(e).__name__}: {e}"
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+def extract_files(paths, workers: int = EXTRACT_WORKERS, timeout: float = EXTRACT_TIMEOUT):
+    """
+    Extract text from `paths` across a process pool. Yields (path, text) in the
+    same order as `paths`; for spreadsheets text is a SpooledChunks (see sheet_chunks),
+    and failed or timed-out files yield None (an empty file yields ""). At most
+    2 * workers files are in flight, so results don't pile up in memory.
+    """
+    paths = list(paths)
+    if not paths:
+        return
+    t0 = time.perf_counter()
+    ok = failed = 0
+    pool = ProcessPoolExecutor(max_workers=min(workers, len(paths)))
+    pending = deque()
+    it = iter(paths)
+    try:
+        while True:
+            while len(pending) < 2 * workers:
+                p = next(it, None)
+                if p is None:
+                    break
+                pending.append((p, pool.submit(_extract_worker, str(p), timeout)))
+            if not pending:
+                break
+            p, fut = pending.popleft()
+            try:
+                text, secs, err = fut.result(timeout=timeout + 5 if timeout > 0 else None)
+            except FutureTimeout:
+                text, secs, err = None, timeout, "TimeoutError: no result from worker"
+            except Exception as e:   # worker died (BrokenProcessPool, pickling, ...)
+                text, secs, err = None, 0.0, f"{type(e).__name__}: {e}"
+            if err:
+                failed += 1
+                log.warning("failed %s after %.2fs: %s", p.name, secs, err)
+            else:
+                ok += 1
+                log.info("extracted %s: %d chars in %.2fs", p.name, len(text), secs)
+            yield p, text
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+    log.info("extraction: %d ok, %d failed in %.1fs (%d workers)",
+             ok, failed, time.perf_counter() - t0, workers)
 
-def chunk_text(text: str, size: int) -> list[str]:
+def chunk_text(text: str, size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP):
+    """Collapse whitespace, cap at DOC_CHAR_LIMIT, then yield chunks lazily."""
     text = re.sub(r"\s+", " ", text).strip()
     text = text[:DOC_CHAR_LIMIT]
-    if not text:
-        return []
-    return [text[i:i + size] for i in range(0, len(text), size)]
-
-def build_drive_corpus_from_folder():
-    OUT_CSV.parent.mkdir(parents=True, exist_ok=True)
-    rows = []
+    return chunk_stream(text, size=size, overlap=overlap)
 
-    if not CORPUS_DIR.exists():
-        print(f"[ingest] WARN: corpus folder not found: {CORPUS_DIR}")
-        return
+FIELDS = ["source", "sha256", "chunk", "text"]
 
-    print(f"[ingest] scanning: {CORPUS_DIR}")
-    for p in CORPUS_DIR.rglob("*"):
+def _scan_corpus():
+    """(path, source, sha256) for every non-empty corpus file, in path order."""
+    out = []
+    for p in sorted(CORPUS_DIR.rglob("*")):
         if not p.is_file():
             continue
         try:
@@ -78,20 +256,54 @@ def build_drive_corpus_from_folder():
                 continue
         except Exception:
             pass
+        # Keep the file path (relative, forward slashes) as "source"; point ids derive from it
+        out.append((p, p.relative_to(ROOT).as_posix(), sha256_file(p)))
+    return out
+
+def iter_documents(known: dict | None = None):
+    """
+    Stream corpus documents in path order as {"source", "sha256", "chunks"}.
+    `chunks` is a lazy iterator of chunk strings, or None when the file's hash
+    matches known[source]["sha256"] (unchanged since the last ingest; not extracted)
+    or when extraction failed, which is also marked "failed": True.
+    """
+    if not CORPUS_DIR.exists():
+        log.warning("corpus folder not found: %s", CORPUS_DIR)
+        return
+    known = known or {}
+    print(f"[ingest] scanning: {CORPUS_DIR}")
+    files = _scan_corpus()
+    changed = [(p, src, h) for p, src, h in files if (known.get(src) or {}).get("sha256") != h]
+    print(f"[ingest] {len(files)} files, {len(changed)} new/changed")
 
-        txt = read_file_text(p)
-        for idx, chunk in enumerate(chunk_text(txt, CHUNK_SIZE), start=1):
-            # Keep the file path (relative) as "source"
-            rows.append({"source": str(p.relative_to(ROOT)), "text": chunk})
+    texts = extract_files(p for p, _, _ in changed)
+    for p, src, h in files:
+        if (known.get(src) or {}).get("sha256") == h:
+            yield {"source": src, "sha256": h, "chunks": None}
+            continue
+        _, txt = next(texts)
+        if txt is None:
+            yield {"source": src, "sha256": h, "chunks": None, "failed": True}
+            continue
+        yield {"source": src, "sha256": h, "chunks": chunk_text(txt) if isinstance(txt, str) else iter(txt)}
+    next(texts, None)   # let the extractor finish and log its summary
 
-    with OUT_CSV.open("w", encoding="utf-8", newline="") as f:
-        w = csv.DictWriter(f, fieldnames=["source", "text"])
+def export_csv(docs=None, path: Path = OUT_CSV) -> int:
+    """Write every chunk of `docs` (default: full corpus extraction) to CSV, streaming."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    n = 0
+    with path.open("w", encoding="utf-8", newline="") as f:
+        w = csv.DictWriter(f, fieldnames=FIELDS)
         w.writeheader()
-        w.writerows(rows)
-
-    print(f"[ingest] wrote {len(rows)} rows → {OUT_CSV}")
+        for doc in (iter_documents() if docs is None else docs):
+            for idx, chunk in enumerate(doc["chunks"] or ()):
+                w.writerow({"source": doc["source"], "sha256": doc["sha256"], "chunk": idx, "text": chunk})
+                n += 1
+    print(f"[ingest] wrote {n} rows → {path}")
+    return n
 
 if __name__ == "__main__":
-    # Sheets CSV was causing crashes earlier. If you ever add one, handle it in a separate script.
-    build_drive_corpus_from_folder()
-    print("[ingest] Done. Now run:  python ingest_to_qdrant.py")
+    logging.basicConfig(level=logging.INFO, format="[%(name)s] %(message)s")
+    # Optional: a CSV snapshot of the corpus. ingest_to_qdrant.py streams without it.
+    export_csv()
+    print("[ingest] Done. To index, run:  python ingest_to_qdrant.py")
@@ -1,113 +1,279 @@
-# ingest_to_qdrant.py — push data/drive_corpus.csv to Qdrant
+# ingest_to_qdrant.py — stream corpus → chunks → embeddings → Qdrant or the local index (VECTOR_BACKEND)
+# Incremental: only new/changed chunks are embedded.
 import os
 import csv
 import time
-import uuid
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-import requests
 from dotenv import load_dotenv
 
-# Reuse your OpenAI embed function
-from openai_integration import embed_text
+# Reuse your OpenAI embed function (batched: many rows per /embeddings call)
+from openai_integration import embed_texts, EMBED_MODEL
+from embedding_store import EmbeddingStore
+import rate_limit
+from vector_store import get_store, VECTOR_BACKEND
+from qdrant_rest import COLLECTION
+from bm25 import BM25Index, index_path
+from utils.manifest import Manifest, point_id, sha256_text, bump_collection_version
+import ingest
 
 load_dotenv()
 
 ROOT = Path(__file__).parent
-CSV_PATH = ROOT / "data" / "drive_corpus.csv"
+MANIFEST_PATH = Path(os.getenv("INGEST_MANIFEST") or ROOT / "data" / "ingest_manifest.json")
 
 QDRANT_URL        = (os.getenv("QDRANT_URL") or "").rstrip("/")
 QDRANT_API_KEY    = os.getenv("QDRANT_API_KEY") or ""
-QDRANT_COLLECTION = os.getenv("QDRANT_COLLECTION") or "am_sm_corpus"
-VECTOR_SIZE       = int(os.getenv("QDRANT_VECTOR_SIZE") or "1536")
+# Same name (and default) as the server's, which keys the version, BM25 and local index files on it
+QDRANT_COLLECTION = COLLECTION
 
-HDRS = {"api-key": QDRANT_API_KEY, "Content-Type": "application/json"}
+# Throughput knobs: rows per /embeddings call, embed calls in flight, upserts in flight
+EMBED_BATCH_SIZE   = int(os.getenv("EMBED_BATCH_SIZE") or "96")
+EMBED_CONCURRENCY  = int(os.getenv("EMBED_CONCURRENCY") or "4")
+UPSERT_CONCURRENCY = int(os.getenv("UPSERT_CONCURRENCY") or "2")
 
-def _q(url, method="GET", json=None, timeout=60):
-    r = requests.request(method, url, headers=HDRS, json=json, timeout=timeout)
-    r.raise_for_status()
-    return r.json()
+# Input: default streams straight from ingest.CORPUS_DIR. INGEST_CSV=<path> ingests a
+# source,text[,sha256,chunk] CSV instead (e.g. data/uploaddigital_corpus.csv from scrape_site.py).
+INGEST_CSV = os.getenv("INGEST_CSV") or ""
+# INGEST_SITE=1 crawls SITE_SEEDS (scrape_site.py) and ingests pages as they are fetched
+INGEST_SITE = (os.getenv("INGEST_SITE") or "").strip().lower() in ("1", "true", "yes", "on")
+# Side output: WRITE_CSV=1 also writes every chunk to ingest.OUT_CSV (forces full extraction)
+WRITE_CSV  = (os.getenv("WRITE_CSV") or "").strip().lower() in ("1", "true", "yes", "on")
+# Lexical side index for hybrid retrieval, built over the same chunks (see bm25.py)
+ENABLE_BM25 = (os.getenv("ENABLE_BM25") or "1").strip().lower() in ("1", "true", "yes", "on")
+# Keep every chunk embedding on disk (embedding_store.py): re-creating or switching collections
+# then re-uploads stored vectors instead of paying for /embeddings again
+EMBED_STORE = (os.getenv("EMBED_STORE") or "1").strip().lower() in ("1", "true", "yes", "on")
+# Re-answer the most-asked questions (prewarm.py) once the corpus has changed: each ingest bumps
+# the collection version, and answers for an older version aren't served. Costs at most
+# PREWARM_TOP_N chat calls, PREWARM_CONCURRENCY at a time; skipped if they're already current.
+PREWARM_AFTER_INGEST = (os.getenv("PREWARM_AFTER_INGEST") or "1").strip().lower() in ("1", "true", "yes", "on")
 
-def ensure_collection():
-    # create collection if missing
-    info_url = f"{QDRANT_URL}/collections/{QDRANT_COLLECTION}"
-    try:
-        _q(info_url, "GET")
-        print(f"[qdrant] collection exists: {QDRANT_COLLECTION}")
-        return
-    except requests.HTTPError as e:
-        if e.response is None or e.response.status_code != 404:
-            raise
-
-    print(f"[qdrant] creating collection: {QDRANT_COLLECTION}")
-    create_url = f"{QDRANT_URL}/collections/{QDRANT_COLLECTION}"
-    payload = {
-        "vectors": {"size": VECTOR_SIZE, "distance": "Cosine"},
+def docs_from_csv(path: Path):
+    """Group a source,text[,sha256,chunk] CSV (rows grouped by source) into documents."""
+    with Path(path).open("r", encoding="utf-8", newline="") as f:
+        doc = None
+        for r in csv.DictReader(f):
+            src = (r.get("source") or "").strip()
+            txt = (r.get("text") or "").strip()
+            if doc is None or doc["source"] != src:
+                if doc:
+                    yield doc
+                doc = {"source": src, "sha256": r.get("sha256") or "", "chunks": []}
+            if txt:
+                doc["chunks"].append(txt)
+        if doc:
+            yield doc
+
+def iter_changes(docs, known, files, stale, prune_prefix=None, on_chunk=()):
+    """
+    Diff streamed documents against the manifest entries `known` and yield only
+    the chunk rows that need embedding. As a side effect fills `files` (the new
+    manifest entries) and `stale` (point ids to delete). A chunk is skipped when
+    its point already holds the same text hash. Sources in `known` under
+    `prune_prefix` that never showed up are treated as removed. Every chunk
+    seen (changed or not) is also passed to each callable in `on_chunk`.
+    """
+    seen = set()
+    for doc in docs:
+        src = doc["source"]
+        seen.add(src)
+        entry = known.get(src) or {}
+        prev = entry.get("chunks", [])
+        if doc["chunks"] is None:
+            # unchanged file, or a failed extraction: keep its points and old hash as they are, so
+            # a failed file is extracted again next run (a new one gets no entry until it succeeds)
+            if entry:
+                files[src] = entry
+            continue
+        hashes = []
+        for idx, text in enumerate(doc["chunks"]):
+            h = sha256_text(text)
+            hashes.append(h)
+            row = {"source": src, "sha256": doc["sha256"], "chunk": idx, "text": text}
+            for fn in on_chunk:
+                fn(row)
+            if idx < len(prev) and prev[idx] == h:
+                continue
+            yield row
+        if not hashes and prev:
+            # file now extracts to nothing: keep the old points; the old hash means a retry next run
+            files[src] = entry
+            continue
+        # file shrank: drop the tail chunks it no longer has
+        stale.extend(point_id(src, i) for i in range(len(hashes), len(prev)))
+        files[src] = {"sha256": doc["sha256"], "chunks": hashes}
+
+    if prune_prefix is not None:
+        for src, entry in known.items():
+            if src not in seen and src.startswith(prune_prefix):   # file removed from corpus
+                stale.extend(point_id(src, i) for i in range(len(entry.get("chunks", []))))
+                files.pop(src, None)
+
+def _batched(items, n):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= n:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _payload(row):
+    return {
+        "source": row["source"],
+        "text": row["text"],
+        "brand": "AM/SM"
     }
-    _q(create_url, "PUT", json=payload)
-    print("[qdrant] created.")
 
-def upsert_batch(points):
-    """points: list of {id, vector, payload}"""
-    if not points:
-        return
-    url = f"{QDRANT_URL}/collections/{QDRANT_COLLECTION}/points?wait=true"
-    payload = {"points": points}
-    _q(url, "PUT", json=payload)
+def _to_points(rows, vectors):
+    return [{
+        "id": point_id(row["source"], row["chunk"]),
+        "vector": vec,
+        "payload": _payload(row),
+    } for row, vec in zip(rows, vectors)]
+
+def _lexical_gaps(lexical, known, prefix) -> bool:
+    """True if some chunk recorded in the manifest under `prefix` is missing from the BM25 index."""
+    return any(point_id(src, i) not in lexical
+               for src, entry in known.items() if src.startswith(prefix)
+               for i in range(len(entry.get("chunks", []))))
+
+def _upsert_counted(store, points):
+    store.upsert(points)
+    return len(points)
+
+def embed_and_upsert(store, rows, batch_size=EMBED_BATCH_SIZE, concurrency=EMBED_CONCURRENCY,
+                     upsert_concurrency=UPSERT_CONCURRENCY, embed_many=embed_texts):
+    """
+    Embed `rows` ({source, chunk, text}) in batches of `batch_size`, keeping up to
+    `concurrency` /embeddings calls in flight. Finished batches are upserted on a
+    separate pool into `store` while the next batches embed. Batches complete in input order.
+    `embed_many` maps a list of texts to their vectors (default: one /embeddings call).
+    Returns the number of rows upserted.
+    """
+    t0 = time.perf_counter()
+    count = 0
+    embeds, upserts = deque(), deque()   # futures, oldest first
+
+    def report():
+        dt = max(time.perf_counter() - t0, 1e-9)
+        print(f"[ingest] upserted: {count} ({count / dt:.1f} rows/s)")
+
+    def drain_upserts(keep):
+        nonlocal count
+        while len(upserts) > keep:
+            count += upserts.popleft().result()
+            report()
+
+    def flush_oldest_embed():
+        batch, fut = embeds.popleft()
+        points = _to_points(batch, fut.result())
+        upserts.append(upsert_pool.submit(_upsert_counted, store, points))
+        drain_upserts(upsert_concurrency)
+
+    embed_pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="embed")
+    upsert_pool = ThreadPoolExecutor(max_workers=upsert_concurrency, thread_name_prefix="upsert")
+    try:
+        for batch in _batched(rows, batch_size):
+            embeds.append((batch, embed_pool.submit(embed_many, [r["text"] for r in batch])))
+            if len(embeds) >= concurrency:
+                flush_oldest_embed()
+        while embeds:
+            flush_oldest_embed()
+        drain_upserts(0)
+    finally:
+        embed_pool.shutdown(wait=True, cancel_futures=True)
+        upsert_pool.shutdown(wait=True, cancel_futures=True)
+
+    dt = max(time.perf_counter() - t0, 1e-9)
+    print(f"[ingest] {count} rows in {dt:.1f}s → {count / dt:.1f} rows/s")
+    return count
 
 def main():
-    if not QDRANT_URL or not QDRANT_API_KEY:
+    rate_limit.set_default_priority("bulk")   # yield OpenAI capacity to live /ask traffic
+    if VECTOR_BACKEND == "qdrant" and (not QDRANT_URL or not QDRANT_API_KEY):
         raise SystemExit("Missing QDRANT_URL or QDRANT_API_KEY in .env")
 
-    if not CSV_PATH.exists():
-        raise SystemExit(f"CSV not found: {CSV_PATH} — run `python ingest.py` first")
+    store = get_store(QDRANT_COLLECTION)
+    points_count = store.ensure()
+    manifest = Manifest(MANIFEST_PATH)
+    lexical = BM25Index.load(index_path(QDRANT_COLLECTION)) if ENABLE_BM25 else None
+    if points_count == 0 and manifest.files(QDRANT_COLLECTION):
+        print("[ingest] collection is empty; ignoring manifest and re-ingesting everything")
+        manifest.reset(QDRANT_COLLECTION)
+        lexical = BM25Index(index_path(QDRANT_COLLECTION)) if ENABLE_BM25 else None
+    known = manifest.files(QDRANT_COLLECTION)
 
-    ensure_collection()
+    if INGEST_SITE:
+        import scrape_site
+        docs, prune = scrape_site.iter_site_documents(None if WRITE_CSV else known), None
+    elif INGEST_CSV:
+        if not Path(INGEST_CSV).exists():
+            raise SystemExit(f"CSV not found: {INGEST_CSV}")
+        docs, prune = docs_from_csv(INGEST_CSV), None   # partial input: never prune other sources
+    else:
+        prune = ingest.CORPUS_DIR.relative_to(ROOT).as_posix() + "/"
+        # A CSV side output or a BM25 backfill needs every file extracted;
+        # chunk hashes still skip re-embedding the unchanged ones.
+        backfill = lexical is not None and _lexical_gaps(lexical, known, prune)
+        if backfill:
+            print("[ingest] BM25 index is missing chunks; extracting every file to backfill it")
+        docs = ingest.iter_documents(None if (WRITE_CSV or backfill) else known)
 
-    # read rows
-    rows = []
-    with CSV_PATH.open("r", encoding="utf-8", newline="") as f:
-        rdr = csv.DictReader(f)
-        for r in rdr:
-            txt = (r.get("text") or "").strip()
-            src = (r.get("source") or "").strip()
-            if txt:
-                rows.append({"source": src, "text": txt})
-
-    if not rows:
-        raise SystemExit("No rows in CSV to ingest.")
-
-    print(f"[ingest] rows to upsert: {len(rows)}")
-
-    batch, count = [], 0
-    for row in rows:
-        vec = embed_text(row["text"])  # 1536-d from OpenAI
-        pid = str(uuid.uuid4())
-        point = {
-            "id": pid,
-            "vector": vec,
-            "payload": {
-                "source": row["source"],
-                "text": row["text"],
-                "brand": "AM/SM"
-            },
-        }
-        batch.append(point)
-
-        if len(batch) >= 64:
-            upsert_batch(batch)
-            count += len(batch)
-            print(f"[ingest] upserted: {count}")
-            batch = []
-            # be gentle on the API
-            time.sleep(0.2)
+    print(f"[ingest] streaming (batch={EMBED_BATCH_SIZE}, embed_concurrency={EMBED_CONCURRENCY}, "
+          f"upsert_concurrency={UPSERT_CONCURRENCY})")
 
-    if batch:
-        upsert_batch(batch)
-        count += len(batch)
-        print(f"[ingest] upserted: {count}")
+    files, stale = dict(known), []
+    vectors = EmbeddingStore(EMBED_MODEL) if EMBED_STORE else None
+    out = None
+    try:
+        sinks = []
+        if WRITE_CSV:
+            ingest.OUT_CSV.parent.mkdir(parents=True, exist_ok=True)
+            out = ingest.OUT_CSV.open("w", encoding="utf-8", newline="")
+            writer = csv.DictWriter(out, fieldnames=ingest.FIELDS)
+            writer.writeheader()
+            sinks.append(writer.writerow)
+        if lexical is not None:
+            sinks.append(lambda row: lexical.add(point_id(row["source"], row["chunk"]), _payload(row)))
+        embed_many = embed_texts
+        if vectors is not None:
+            embed_many = lambda texts: vectors.embed(texts, embed_texts)
+        upserted = embed_and_upsert(store, iter_changes(docs, known, files, stale, prune, sinks),
+                                    embed_many=embed_many)
+    finally:
+        if out:
+            out.close()
+            print(f"[ingest] wrote CSV side output → {ingest.OUT_CSV}")
+
+    if vectors is not None:
+        print(f"[ingest] embedding store: {vectors.hits} reused, {vectors.embedded} embedded "
+              f"({len(vectors)} stored → {vectors.dir})")
+    print(f"[ingest] stale points to delete: {len(stale)}")
+    store.delete(stale)
+    store.flush()
+    lexical_changed = False
+    if lexical is not None:
+        lexical.delete(stale)
+        if lexical.dirty:
+            lexical.save()
+            lexical_changed = True
 
+    manifest.data["collections"][QDRANT_COLLECTION] = files
+    manifest.save()
+    if upserted or stale or lexical_changed:
+        bump_collection_version(QDRANT_COLLECTION)   # invalidates the server's cached answers
+    if PREWARM_AFTER_INGEST:
+        import prewarm
+        if not prewarm.is_current(QDRANT_COLLECTION):
+            prewarm.build(QDRANT_COLLECTION, store=store)
     print("Done.")
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="[%(name)s] %(message)s")
     main()
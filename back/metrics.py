@@ -0,0 +1,125 @@
+# metrics.py — per-stage timing spans and counters, exported in Prometheus text format
+import time, threading, contextvars
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Tuple
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_lock = threading.Lock()
+_counters: Dict[Tuple[str, tuple], float] = {}
+_histograms: Dict[Tuple[str, tuple], list] = {}     # key → [bucket counts..., sum, count]
+_help: Dict[str, Tuple[str, str]] = {}              # name → (type, help)
+_collectors: List[Callable[[], List[Tuple[str, dict, float]]]] = []
+
+# Per-request stage timings (seconds), when a request opted in via start_request()
+_timings: contextvars.ContextVar = contextvars.ContextVar("timings", default=None)
+
+def _labels(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in (labels or {}).items()))
+
+def describe(name: str, kind: str, help_text: str):
+    _help[name] = (kind, help_text)
+
+def inc(name: str, value: float = 1.0, **labels):
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0.0) + value
+
+def observe(name: str, seconds: float, **labels):
+    key = (name, _labels(labels))
+    with _lock:
+        h = _histograms.get(key)
+        if h is None:
+            h = _histograms[key] = [0] * len(BUCKETS) + [0.0, 0]
+        for i, b in enumerate(BUCKETS):
+            if seconds <= b:
+                h[i] += 1
+        h[-2] += seconds
+        h[-1] += 1
+
+def reset():
+    """Zero all counters and histograms (a forked worker starts its own series)."""
+    global _lock
+    _lock = threading.Lock()
+    _counters.clear()
+    _histograms.clear()
+
+def register_collector(fn: Callable[[], List[Tuple[str, dict, float]]]):
+    """fn() → [(counter name, labels, value)], evaluated at scrape time (e.g. cache stats)."""
+    _collectors.append(fn)
+
+def start_request() -> dict:
+    """Collect this request's stage timings into the returned dict."""
+    d = {}
+    _timings.set(d)
+    return d
+
+def record(stage: str, seconds: float):
+    observe("ask_stage_seconds", seconds, stage=stage)
+    d = _timings.get()
+    if d is not None:
+        d[stage] = d.get(stage, 0.0) + seconds
+
+@contextmanager
+def span(stage: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - t0)
+
+def submit(pool, fn, *args, **kwargs):
+    """pool.submit() that carries the caller's context, so spans in the worker land in its timings."""
+    return pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+def _fmt_labels(labels: tuple, extra: tuple = ()) -> str:
+    items = labels + extra
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+def render() -> str:
+    lines, typed = [], set()
+
+    def header(name, default_kind):
+        if name in typed:
+            return
+        typed.add(name)
+        kind, text = _help.get(name, (default_kind, name))
+        lines.append(f"# HELP {name} {text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    with _lock:
+        counters = dict(_counters)
+        hists = {k: list(v) for k, v in _histograms.items()}
+    for fn in _collectors:
+        try:
+            for name, labels, value in fn():
+                counters[(name, _labels(labels))] = value
+        except Exception as e:
+            print(f"[metrics] collector failed: {e}")
+
+    for (name, labels), value in sorted(counters.items()):
+        header(name, "counter")
+        lines.append(f"{name}{_fmt_labels(labels)} {value:g}")
+    for (name, labels), h in sorted(hists.items()):
+        header(name, "histogram")
+        for i, b in enumerate(BUCKETS):
+            lines.append(f"{name}_bucket{_fmt_labels(labels, (('le', f'{b:g}'),))} {h[i]}")
+        lines.append(f"{name}_bucket{_fmt_labels(labels, (('le', '+Inf'),))} {h[-1]}")
+        lines.append(f"{name}_sum{_fmt_labels(labels)} {h[-2]:.6f}")
+        lines.append(f"{name}_count{_fmt_labels(labels)} {h[-1]}")
+    return "\n".join(lines) + "\n"
+
+describe("ask_stage_seconds", "histogram", "Time spent per /ask pipeline stage.")
+describe("ask_requests_total", "counter", "/ask requests by endpoint and outcome.")
+describe("openai_retries_total", "counter", "OpenAI calls retried, by endpoint and HTTP status.")
+describe("openai_tokens_total", "counter", "OpenAI token usage by endpoint and kind.")
+describe("cache_requests_total", "counter", "Cache lookups by cache, tier and result.")
+describe("http_pool_connections_total", "counter", "Sockets opened per upstream host (this worker).")
+describe("http_pool_requests_total", "counter", "Requests sent per upstream host (this worker).")
+describe("openai_concurrency_limit", "gauge", "Current AIMD limit on concurrent OpenAI calls (this worker).")
+describe("openai_in_flight", "gauge", "OpenAI calls in flight (this worker).")
+describe("openai_slots_granted_total", "counter", "OpenAI call slots granted, by priority.")
+describe("openai_throttled_total", "counter", "OpenAI calls answered 429/503.")
+describe("singleflight_total", "counter", "Coalesced /ask computations: leaders ran, followers shared.")
@@ -1,8 +1,15 @@
 # openai_integration.py
-import os, time, random, requests
-from typing import Any, Dict, List, Optional
+import os, json, random
+from typing import Any, Dict, Iterator, List, Optional
 from dotenv import load_dotenv
-from openai import OpenAI
+import requests
+
+import http_client
+import metrics
+import rate_limit
+import deadline
+from hedge import hedger
+from rate_limit import scheduler
 
 load_dotenv()
 
@@ -10,7 +17,20 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 if not OPENAI_API_KEY:
     raise RuntimeError("OPENAI_API_KEY is not set. Put it in back/.env")
 
-_client = OpenAI(api_key=OPENAI_API_KEY)
+# The SDK (only web_answer uses it) costs ~0.5s to import; build it on first use, after any fork
+_client = None
+
+def _openai():
+    global _client
+    if _client is None:
+        from openai import OpenAI
+        _client = OpenAI(api_key=OPENAI_API_KEY)
+    return _client
+
+def reset_client():
+    """Drop the SDK client (and its connection pool), e.g. in a freshly forked worker."""
+    global _client
+    _client = None
 
 def _env_bool(name: str, default: bool = False) -> bool:
     v = (os.getenv(name) or "").strip().lower()
@@ -72,14 +92,34 @@ def web_answer(
     # Context size hint (harmless if ignored)
     tool_cfg["search_context_size"] = (context_size or os.getenv("WEB_CONTEXT_SIZE","medium"))
 
-    # Call
-    resp = _client.responses.create(
-        model=mdl,
-        tools=[tool_cfg],
-        tool_choice="auto",
-        include=["web_search_call.action.sources"],
-        input=scoped_q,
-    )
+    # Call (the SDK retries on its own; the scheduler still sees each outcome).
+    # Inside a request budget the whole call, retries included, gets only what's left of it.
+    client = _openai()
+    from openai import APIStatusError, APITimeoutError
+    if deadline.remaining() is not None:
+        client = client.with_options(timeout=deadline.timeout(600, "web"), max_retries=0)
+    with scheduler.slot(rate_limit.estimate_tokens({"input": scoped_q, "tools": [tool_cfg]})) as slot:
+        try:
+            resp = client.responses.create(
+                model=mdl,
+                tools=[tool_cfg],
+                tool_choice="auto",
+                include=["web_search_call.action.sources"],
+                input=scoped_q,
+            )
+        except APIStatusError as e:
+            slot.done(e.status_code, e.response.headers)
+            raise
+        except APITimeoutError as e:
+            if deadline.expired():
+                raise deadline.DeadlineExceeded("web") from e
+            raise
+        slot.done(200)
+
+    usage = getattr(resp, "usage", None)
+    if usage is not None:
+        _count_usage("web", {"prompt_tokens": getattr(usage, "input_tokens", 0),
+                             "completion_tokens": getattr(usage, "output_tokens", 0)})
 
     # Extract text
     text = getattr(resp, "output_text", "") or ""
@@ -95,25 +135,106 @@ def web_answer(
 # --- Embeddings + chat (grounded) ---
 
 BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+EMBED_MODEL = os.getenv("EMBED_MODEL", "text-embedding-3-small")
 _DEFAULT_HEADERS = {"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"}
 
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "6"))
+
 def _headers(): return _DEFAULT_HEADERS
 
-def _post_with_retry(url: str, json_payload: dict, timeout: int = 120, max_retries: int = 3):
-    backoff = 1.5
+def _post_with_retry(url: str, json_payload: dict, timeout: int = 120, max_retries: int = OPENAI_MAX_RETRIES,
+                     stream: bool = False):
+    """
+    POST through the shared rate_limit.scheduler: waits for a slot (priority, buckets,
+    AIMD window), reports the status and x-ratelimit headers back, and retries 429/5xx
+    and connection errors with jittered backoff (honoring Retry-After).
+    A streamed call holds its slot until the response headers arrive. Inside a
+    deadline.budget() a backoff that would overrun it raises DeadlineExceeded instead.
+    """
+    endpoint = url.rsplit("/", 1)[-1]
+    est = rate_limit.estimate_tokens(json_payload)
     for i in range(max_retries):
-        r = requests.post(url, headers=_headers(), json=json_payload, timeout=timeout)
-        if r.status_code in (429,500,502,503,504) and i < max_retries-1:
-            time.sleep(backoff ** (i+1)); continue
+        last = i == max_retries - 1
+        with scheduler.slot(est) as slot:
+            try:
+                r = http_client.post(url, headers=_headers(), json=json_payload, timeout=timeout, stream=stream)
+            except requests.ConnectionError:
+                if last:
+                    raise
+                metrics.inc("openai_retries_total", endpoint=endpoint, status="connection")
+                r = None
+            else:
+                slot.done(r.status_code, r.headers)
+        if r is None:
+            deadline.sleep(rate_limit.backoff(i), endpoint); continue
+        if r.status_code in (429,500,502,503,504) and not last:
+            metrics.inc("openai_retries_total", endpoint=endpoint, status=r.status_code)
+            r.close()
+            deadline.sleep(rate_limit.backoff(i, rate_limit.retry_after(r.headers)), endpoint); continue
         r.raise_for_status(); return r
-    r.raise_for_status(); return r
+
+async def _apost_with_retry(url: str, json_payload: dict, timeout: int = 120,
+                            max_retries: int = OPENAI_MAX_RETRIES):
+    """_post_with_retry for coroutines (asgi.py): scheduler.aslot() and the async HTTP client."""
+    import httpx
+    endpoint = url.rsplit("/", 1)[-1]
+    est = rate_limit.estimate_tokens(json_payload)
+    for i in range(max_retries):
+        last = i == max_retries - 1
+        async with scheduler.aslot(est) as slot:
+            try:
+                r = await http_client.apost(url, headers=_headers(), json=json_payload, timeout=timeout)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError):
+                if last:
+                    raise
+                metrics.inc("openai_retries_total", endpoint=endpoint, status="connection")
+                r = None
+            else:
+                slot.done(r.status_code, r.headers)
+        if r is None:
+            await deadline.asleep(rate_limit.backoff(i), endpoint); continue
+        if r.status_code in (429,500,502,503,504) and not last:
+            metrics.inc("openai_retries_total", endpoint=endpoint, status=r.status_code)
+            await deadline.asleep(rate_limit.backoff(i, rate_limit.retry_after(r.headers)), endpoint); continue
+        r.raise_for_status(); return r
+
+def _count_usage(endpoint: str, usage: Optional[dict]):
+    for kind in ("prompt_tokens", "completion_tokens"):
+        n = (usage or {}).get(kind)
+        if n:
+            metrics.inc("openai_tokens_total", n, endpoint=endpoint, kind=kind.split("_")[0])
+
+def _embed_one(text: str):
+    r = _post_with_retry(f"{BASE_URL}/embeddings", {"model": EMBED_MODEL, "input": text}, timeout=60)
+    body = r.json()
+    _count_usage("embeddings", body.get("usage"))
+    return body["data"][0]["embedding"]
+
+async def _aembed_one(text: str):
+    r = await _apost_with_retry(f"{BASE_URL}/embeddings", {"model": EMBED_MODEL, "input": text}, timeout=60)
+    body = r.json()
+    _count_usage("embeddings", body.get("usage"))
+    return body["data"][0]["embedding"]
 
 def embed_text(text: str):
-    """text-embedding-3-small (1536 dims)"""
+    """text-embedding-3-small (1536 dims); hedged past the observed p95 (hedge.py)"""
+    return hedger("embeddings").call(_embed_one, text)
+
+async def aembed_text(text: str):
+    """embed_text for coroutines."""
+    return await hedger("embeddings").acall(_aembed_one, text)
+
+def embed_texts(texts: List[str]) -> List[List[float]]:
+    """Batch variant of embed_text: one /embeddings call for many inputs, order preserved."""
+    if not texts:
+        return []
     url = f"{BASE_URL}/embeddings"
-    payload = {"model": "text-embedding-3-small", "input": text}
+    payload = {"model": EMBED_MODEL, "input": list(texts)}
     r = _post_with_retry(url, payload, timeout=60)
-    return r.json()["data"][0]["embedding"]
+    body = r.json()
+    _count_usage("embeddings", body.get("usage"))
+    data = sorted(body["data"], key=lambda d: d["index"])
+    return [d["embedding"] for d in data]
 
 _CLOSERS = [
     "Would you like a quick example from the dataset?",
@@ -124,8 +245,7 @@ _CLOSERS = [
 ]
 def _closer(): return random.choice(_CLOSERS)
 
-def chat_answer(context: str, question: str, temperature: float = 0.2) -> str:
-    """Answer ONLY from provided context."""
+def _chat_payload(context: str, question: str, temperature: float) -> dict:
     system = (
         "You are the AM/SM knowledge bot. Answer ONLY using the supplied context. "
         "If the context is insufficient, say: 'I don’t know from the current dataset.' "
@@ -137,14 +257,64 @@ def chat_answer(context: str, question: str, temperature: float = 0.2) -> str:
         "- Do NOT include raw URLs or a 'Sources:' block."
     )
     user = f"Question: {question}\n\nContext (use this to answer; if it's not enough, say you don't know):\n{context}"
-    url = f"{BASE_URL}/chat/completions"
-    payload = {
+    return {
         "model": os.getenv("CHAT_MODEL","gpt-4o-mini"),
         "temperature": temperature,
         "messages": [{"role":"system","content":system},{"role":"user","content":user}],
     }
+
+def chat_answer(context: str, question: str, temperature: float = 0.2) -> str:
+    """Answer ONLY from provided context."""
+    url = f"{BASE_URL}/chat/completions"
+    payload = _chat_payload(context, question, temperature)
     r = _post_with_retry(url, payload, timeout=120)
-    msg = (r.json()["choices"][0]["message"]["content"] or "").strip()
+    return _chat_text(r.json())
+
+async def achat_answer(context: str, question: str, temperature: float = 0.2) -> str:
+    """chat_answer for coroutines."""
+    payload = _chat_payload(context, question, temperature)
+    r = await _apost_with_retry(f"{BASE_URL}/chat/completions", payload, timeout=120)
+    return _chat_text(r.json())
+
+def _chat_text(body: dict) -> str:
+    _count_usage("chat", body.get("usage"))
+    msg = (body["choices"][0]["message"]["content"] or "").strip()
     c = _closer()
     if c not in msg: msg = (msg + "\n\n" + c).strip()
     return msg
+
+def chat_answer_stream(context: str, question: str, temperature: float = 0.2) -> Iterator[str]:
+    """
+    Same as chat_answer, but yields text deltas as the completion streams in
+    (the closer arrives as the last delta). Retries only happen before the first byte.
+    """
+    url = f"{BASE_URL}/chat/completions"
+    payload = {**_chat_payload(context, question, temperature), "stream": True,
+               "stream_options": {"include_usage": True}}
+    r = _post_with_retry(url, payload, timeout=120, stream=True)
+    r.encoding = "utf-8"
+    parts = []
+    try:
+        for line in r.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            event = json.loads(data)
+            if event.get("usage"):
+                _count_usage("chat", event["usage"])
+            choices = event.get("choices") or []
+            delta = (choices[0].get("delta") or {}).get("content") if choices else None
+            if delta:
+                if not parts:
+                    delta = delta.lstrip()
+                    if not delta:
+                        continue
+                parts.append(delta)
+                yield delta
+    finally:
+        r.close()
+    c = _closer()
+    if c not in "".join(parts):
+        yield ("\n\n" + c) if parts else c
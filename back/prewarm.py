@@ -0,0 +1,209 @@
+# prewarm.py — precompute answers to the most frequent questions in the query log
+#
+#   python prewarm.py [collection]     (also runs at the end of ingest_to_qdrant.py)
+#
+# Counts the logged corpus questions, embeds the distinct ones, groups near-duplicates
+# (cosine ≥ PREWARM_CLUSTER_SIM), and answers the PREWARM_TOP_N most-asked groups through
+# the same retrieval + chat path as /ask (retrieval.py; corpus only, never web). The answers are stamped
+# with the collection version and written to PREWARM_DIR/<collection>.{npy,json}; the server
+# serves a question within PREWARM_MATCH_SIM of any asked form of a group without a chat call.
+import os, json, time, threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional, Tuple
+
+from dotenv import load_dotenv
+
+from utils.manifest import read_collection_version
+
+ROOT = Path(__file__).parent
+load_dotenv(dotenv_path=ROOT / ".env")   # standalone runs read the server's .env too
+PREWARM_DIR            = Path(os.getenv("PREWARM_DIR") or ROOT / "data" / "prewarm")
+PREWARM_TOP_N          = int(os.getenv("PREWARM_TOP_N", "50"))
+PREWARM_MIN_COUNT      = int(os.getenv("PREWARM_MIN_COUNT", "2"))       # times a group was asked
+PREWARM_MAX_QUESTIONS  = int(os.getenv("PREWARM_MAX_QUESTIONS", "2000")) # distinct questions clustered
+PREWARM_CLUSTER_SIM    = float(os.getenv("PREWARM_CLUSTER_SIM", "0.90"))
+PREWARM_MATCH_SIM      = float(os.getenv("PREWARM_MATCH_SIM", "0.93"))
+PREWARM_CONCURRENCY    = int(os.getenv("PREWARM_CONCURRENCY", "4"))      # answers computed in parallel
+
+def _paths(collection: str, root: Path = PREWARM_DIR):
+    return root / f"{collection}.npy", root / f"{collection}.json"
+
+class PrewarmIndex:
+    """
+    Per-worker read-only view of one collection's prewarmed answers, reloaded when the job
+    rewrites them. lookup() is a single matrix-vector product over every asked form.
+    """
+    def __init__(self, collection: str, root: Path = PREWARM_DIR, min_sim: float = PREWARM_MATCH_SIM):
+        self.vec_path, self.meta_path = _paths(collection, root)
+        self.min_sim = min_sim
+        self._mat, self._rows, self._answers, self._version = None, [], [], None
+        self._mtime, self._checked = None, 0.0
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked < 5.0:
+            return
+        with self._lock:
+            self._checked = now
+            try:
+                mtime = self.meta_path.stat().st_mtime_ns
+            except OSError:
+                self._mat, self._mtime = None, None
+                return
+            if mtime == self._mtime:
+                return
+            try:
+                import numpy as np
+                meta = json.loads(self.meta_path.read_text(encoding="utf-8"))
+                mat = np.load(self.vec_path, mmap_mode="r")
+                if mat.shape[0] != len(meta["rows"]):
+                    return   # caught between the two writes; retry on the next check
+                self._mat, self._rows, self._answers = mat, meta["rows"], meta["answers"]
+                self._version, self._mtime = meta["version"], mtime
+            except Exception as e:
+                print(f"[prewarm] failed to load {self.meta_path}: {e}")
+
+    def ready(self, version: Optional[str]) -> bool:
+        """True if there are answers for this collection version (None: any) so a lookup is worth an embed."""
+        self._maybe_reload()
+        return self._mat is not None and version in (None, self._version) and len(self._rows) > 0
+
+    def lookup(self, qvec, version: Optional[str]) -> Optional[Tuple[dict, float]]:
+        """({"question", "answer", "sources"}, similarity) of the nearest asked form, if close enough."""
+        import numpy as np
+        if not self.ready(version):
+            return None
+        mat, rows, answers = self._mat, self._rows, self._answers
+        v = np.asarray(qvec, dtype=np.float32)
+        v /= (np.linalg.norm(v) or 1.0)
+        scores = mat @ v
+        i = int(np.argmax(scores))
+        if scores[i] < self.min_sim:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return answers[rows[i]], float(scores[i])
+
+    def stats(self) -> dict:
+        return {"version": self._version, "answers": len(self._answers), "forms": len(self._rows),
+                "hits": self.hits, "misses": self.misses}
+
+def frequent_questions(records, min_count: int = PREWARM_MIN_COUNT, limit: int = PREWARM_MAX_QUESTIONS):
+    """[(question, times asked)] of corpus questions (no web flag), most asked first."""
+    from retrieval import wants_web
+    counts = Counter(r["q"] for r in records
+                     if r.get("q") and not r.get("w") and r.get("o") not in ("bad_request", "error"))
+    return [(q, n) for q, n in counts.most_common() if not wants_web(q, False)][:limit]
+
+def cluster(vectors, counts, threshold: float = PREWARM_CLUSTER_SIM):
+    """
+    Greedy grouping, most-asked first: each question not yet grouped starts a group and takes
+    every ungrouped question within `threshold` cosine of it. Returns [(member indices, total count)]
+    sorted by total count; the first member is the most asked (the group's representative).
+    """
+    import numpy as np
+    m = np.asarray(vectors, dtype=np.float32)
+    m /= np.maximum(np.linalg.norm(m, axis=1, keepdims=True), 1e-12)
+    group = np.full(len(m), -1)
+    groups = []
+    for i in range(len(m)):
+        if group[i] >= 0:
+            continue
+        free = np.flatnonzero(group < 0)
+        members = free[m[free] @ m[i] >= threshold]
+        group[members] = len(groups)
+        members = [i] + [int(j) for j in members if j != i]
+        groups.append((members, sum(counts[j] for j in members)))
+    groups.sort(key=lambda g: g[1], reverse=True)
+    return groups, m
+
+def build(collection: str, store=None, top_n: int = PREWARM_TOP_N, root: Path = PREWARM_DIR) -> int:
+    """
+    Rebuild the prewarmed answers for `collection` from the query log, retrieving from `store`
+    (default: get_store(collection)). Returns how many were written.
+    """
+    import numpy as np
+    import rate_limit
+    from cache import EmbeddingCache
+    from openai_integration import embed_texts, EMBED_MODEL
+    from query_log import query_log
+    from retrieval import Retriever, answer_from_context
+    from vector_store import get_store
+
+    if query_log is None:
+        print("[prewarm] QUERY_LOG is off; nothing to learn from")
+        return 0
+    t0 = time.perf_counter()
+    asked = frequent_questions(query_log.read())
+    if not asked:
+        print("[prewarm] query log is empty")
+        return 0
+    questions, counts = [q for q, _ in asked], [n for _, n in asked]
+
+    def embed_many(texts):
+        return [v for i in range(0, len(texts), 256) for v in embed_texts(texts[i:i + 256])]
+
+    # with EMBED_CACHE_DB set this is the workers' query-embedding cache too: their lookups
+    # for these questions then skip the /embeddings call
+    embed_cache = EmbeddingCache(db_path=os.getenv("EMBED_CACHE_DB") or None)
+    retriever = Retriever(store or get_store(collection), collection, embed_cache)
+    with rate_limit.priority("bulk"):
+        vectors = embed_cache.get_or_embed_many(questions, EMBED_MODEL, embed_many)
+    groups, unit = cluster(vectors, counts)
+    groups = [g for g in groups if g[1] >= PREWARM_MIN_COUNT][:top_n]
+    version = read_collection_version(collection)
+
+    def answer(members):
+        q = questions[members[0]]
+        with rate_limit.priority("bulk"):
+            context, sources = retriever.retrieve(q)
+            if not context.strip():
+                return None   # the corpus has nothing; leave it to the live path (and the web)
+            out, _ = answer_from_context(q, context, sources)
+        return {"question": q, "answer": out["answer"], "sources": sources}
+
+    with ThreadPoolExecutor(max_workers=PREWARM_CONCURRENCY) as pool:
+        results = list(pool.map(lambda g: answer(g[0]), groups))
+
+    answers, rows, vecs = [], [], []
+    for (members, total), res in zip(groups, results):
+        if res is None:
+            continue
+        res["asked"] = total
+        for j in members:
+            rows.append(len(answers))
+            vecs.append(unit[j])
+        answers.append(res)
+
+    vec_path, meta_path = _paths(collection, root)
+    root.mkdir(parents=True, exist_ok=True)
+    tmp = vec_path.with_name(vec_path.stem + ".tmp.npy")
+    np.save(tmp, np.asarray(vecs, dtype=np.float32).reshape(len(vecs), -1))
+    tmp.replace(vec_path)
+    tmp = meta_path.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps({"version": version, "model": EMBED_MODEL, "rows": rows, "answers": answers},
+                              ensure_ascii=False), encoding="utf-8")
+    tmp.replace(meta_path)   # written last: readers check it against the vectors
+    print(f"[prewarm] {len(asked)} distinct questions → {len(groups)} frequent groups → "
+          f"{len(answers)} answers ({len(rows)} asked forms) for version {version} "
+          f"in {time.perf_counter() - t0:.1f}s → {meta_path}")
+    return len(answers)
+
+def is_current(collection: str, root: Path = PREWARM_DIR) -> bool:
+    """True if the prewarmed answers on disk were built for the collection's current version."""
+    try:
+        meta = json.loads(_paths(collection, root)[1].read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return False
+    return meta.get("version") == read_collection_version(collection)
+
+if __name__ == "__main__":
+    import sys
+    import rate_limit
+    from qdrant_rest import COLLECTION
+    rate_limit.set_default_priority("bulk")
+    build(sys.argv[1] if len(sys.argv) > 1 else COLLECTION)
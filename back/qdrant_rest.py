@@ -1,8 +1,11 @@
 # qdrant_rest.py
-import os, json, uuid, requests
+import os, json, uuid
 from dotenv import load_dotenv
 from pathlib import Path
 
+import http_client
+from hedge import hedger
+
 ENV_PATH = Path(__file__).with_name(".env")
 load_dotenv(dotenv_path=ENV_PATH)
 
@@ -10,23 +13,125 @@ QDRANT_URL = os.getenv("QDRANT_URL", "").rstrip("/")
 COLLECTION = os.getenv("QDRANT_COLLECTION", "company_knowledge")
 VECTOR_SIZE = int(os.getenv("QDRANT_VECTOR_SIZE", "1536"))
 
+def _env_bool(name: str, default: bool) -> bool:
+    v = (os.getenv(name) or "").strip().lower()
+    return default if not v else v in ("1", "true", "yes", "on")
+
+# Declared collection schema. ensure_collection() creates it, and brings existing collections to it.
+# int8 scalar quantization keeps ~1 byte/dim in RAM; the float32 originals stay on disk for rescoring.
+QDRANT_QUANTIZATION   = (os.getenv("QDRANT_QUANTIZATION") or "int8").strip().lower()   # int8 | none
+QDRANT_QUANT_QUANTILE = float(os.getenv("QDRANT_QUANT_QUANTILE", "0.99"))
+QDRANT_RESCORE        = _env_bool("QDRANT_RESCORE", True)
+QDRANT_OVERSAMPLING   = float(os.getenv("QDRANT_OVERSAMPLING", "2.0"))
+QDRANT_HNSW_M         = int(os.getenv("QDRANT_HNSW_M", "16"))
+QDRANT_HNSW_EF_CONSTRUCT = int(os.getenv("QDRANT_HNSW_EF_CONSTRUCT", "100"))
+QDRANT_HNSW_EF        = int(os.getenv("QDRANT_HNSW_EF", "0"))          # search-time ef; 0 = server default
+QDRANT_VECTORS_ON_DISK = _env_bool("QDRANT_VECTORS_ON_DISK", QDRANT_QUANTIZATION != "none")
+QDRANT_ON_DISK_PAYLOAD = _env_bool("QDRANT_ON_DISK_PAYLOAD", True)
+QDRANT_MIGRATE        = _env_bool("QDRANT_MIGRATE", True)               # False: only report drift
+PAYLOAD_INDEXES       = {"source": "keyword", "brand": "keyword"}
+
 def _headers():
     key = os.getenv("QDRANT_API_KEY", "")
     if not key:
         print("[qdrant] WARNING: QDRANT_API_KEY is EMPTY at runtime")
     return {"api-key": key, "Content-Type": "application/json"}
 
-def ensure_collection():
-    if not QDRANT_URL or not COLLECTION:
+def _quantization():
+    if QDRANT_QUANTIZATION in ("", "none", "off", "0"):
+        return None
+    if QDRANT_QUANTIZATION != "int8":
+        raise RuntimeError(f"QDRANT_QUANTIZATION={QDRANT_QUANTIZATION!r} (use 'int8' or 'none')")
+    return {"scalar": {"type": "int8", "quantile": QDRANT_QUANT_QUANTILE, "always_ram": True}}
+
+def collection_schema() -> dict:
+    """Create-collection body for the declared schema."""
+    body = {
+        "vectors": {"size": VECTOR_SIZE, "distance": "Cosine", "on_disk": QDRANT_VECTORS_ON_DISK},
+        "hnsw_config": {"m": QDRANT_HNSW_M, "ef_construct": QDRANT_HNSW_EF_CONSTRUCT},
+        "on_disk_payload": QDRANT_ON_DISK_PAYLOAD,
+    }
+    q = _quantization()
+    if q:
+        body["quantization_config"] = q
+    return body
+
+def _schema_patch(info: dict) -> dict:
+    """PATCH /collections body that moves an existing collection (GET result) to the declared schema."""
+    cfg = info.get("config") or {}
+    params = cfg.get("params") or {}
+    vectors = params.get("vectors") or {}
+    patch = {}
+    if bool(vectors.get("on_disk")) != QDRANT_VECTORS_ON_DISK:
+        patch["vectors"] = {"": {"on_disk": QDRANT_VECTORS_ON_DISK}}
+    if bool(params.get("on_disk_payload")) != QDRANT_ON_DISK_PAYLOAD:
+        patch["params"] = {"on_disk_payload": QDRANT_ON_DISK_PAYLOAD}
+    hnsw = cfg.get("hnsw_config") or {}
+    if hnsw.get("m") != QDRANT_HNSW_M or hnsw.get("ef_construct") != QDRANT_HNSW_EF_CONSTRUCT:
+        patch["hnsw_config"] = {"m": QDRANT_HNSW_M, "ef_construct": QDRANT_HNSW_EF_CONSTRUCT}
+    want_q, have_q = _quantization(), cfg.get("quantization_config")
+    if want_q != have_q and not (want_q is None and not have_q):
+        patch["quantization_config"] = want_q or "Disabled"
+    return patch
+
+def _ensure_payload_indexes(collection: str, info: dict):
+    have = info.get("payload_schema") or {}
+    for field, kind in PAYLOAD_INDEXES.items():
+        if (have.get(field) or {}).get("data_type") == kind:
+            continue
+        print(f"[qdrant] creating {kind} payload index on {collection}.{field}")
+        r = http_client.put(f"{QDRANT_URL}/collections/{collection}/index", params={"wait": "true"},
+                            headers=_headers(), data=json.dumps({"field_name": field, "field_schema": kind}),
+                            timeout=120)
+        r.raise_for_status()
+
+def ensure_collection(collection: str = None) -> int:
+    """
+    Create the collection with the declared schema if missing; otherwise verify it and
+    (QDRANT_MIGRATE) patch HNSW, quantization and on-disk settings that drifted.
+    Payload indexes are created when missing. Returns points_count (0 when just created).
+    A different vector size or distance can't be patched: drop and re-ingest (the
+    embedding store makes that upload-only).
+    """
+    collection = collection or COLLECTION
+    if not QDRANT_URL or not collection:
         raise RuntimeError("QDRANT_URL or QDRANT_COLLECTION not set")
-    r = requests.get(f"{QDRANT_URL}/collections/{COLLECTION}", headers=_headers(), timeout=20)
+    r = http_client.get(f"{QDRANT_URL}/collections/{collection}", headers=_headers(), timeout=20)
     if r.status_code == 200:
-        return True
-    payload = {"vectors": {"size": VECTOR_SIZE, "distance": "Cosine"}}
-    r = requests.put(f"{QDRANT_URL}/collections/{COLLECTION}",
-                     headers=_headers(), data=json.dumps(payload), timeout=30)
+        info = r.json().get("result") or {}
+        vectors = ((info.get("config") or {}).get("params") or {}).get("vectors") or {}
+        if vectors.get("size") not in (None, VECTOR_SIZE) or vectors.get("distance") not in (None, "Cosine"):
+            raise RuntimeError(f"[qdrant] {collection} has vectors {vectors.get('size')}/{vectors.get('distance')}, "
+                               f"expected {VECTOR_SIZE}/Cosine; drop it and re-ingest")
+        patch = _schema_patch(info)
+        if patch and QDRANT_MIGRATE:
+            print(f"[qdrant] migrating collection {collection}: {', '.join(patch)}")
+            r = http_client.request("PATCH", f"{QDRANT_URL}/collections/{collection}",
+                                    headers=_headers(), data=json.dumps(patch), timeout=60)
+            r.raise_for_status()
+        elif patch:
+            print(f"[qdrant] collection {collection} differs from the declared schema: {', '.join(patch)}")
+        else:
+            print(f"[qdrant] collection exists: {collection}")
+        if QDRANT_MIGRATE:
+            _ensure_payload_indexes(collection, info)
+        return int(info.get("points_count") or 0)
+    if r.status_code != 404:
+        r.raise_for_status()
+    print(f"[qdrant] creating collection: {collection}")
+    r = http_client.put(f"{QDRANT_URL}/collections/{collection}",
+                     headers=_headers(), data=json.dumps(collection_schema()), timeout=30)
     r.raise_for_status()
-    return True
+    _ensure_payload_indexes(collection, {})
+    return 0
+
+def _search_params() -> dict:
+    params = {}
+    if _quantization():
+        params["quantization"] = {"rescore": QDRANT_RESCORE, "oversampling": QDRANT_OVERSAMPLING}
+    if QDRANT_HNSW_EF:
+        params["hnsw_ef"] = QDRANT_HNSW_EF
+    return params
 
 def _valid_uuid(s: str) -> bool:
     try:
@@ -45,7 +150,7 @@ def _coerce_uuid(point_id):
         return s
     return str(uuid.uuid4())
 
-def upsert_points(points):
+def upsert_points(points, collection: str = None, wait: bool = False):
     if not points:
         return {"result": {"upserted": 0}}
 
@@ -60,29 +165,83 @@ def upsert_points(points):
         })
 
     body = {"points": clean}
-    r = requests.put(f"{QDRANT_URL}/collections/{COLLECTION}/points",
+    r = http_client.put(f"{QDRANT_URL}/collections/{collection or COLLECTION}/points",
+                     params={"wait": "true"} if wait else None,
                      headers=_headers(), data=json.dumps(body), timeout=60)
     if r.status_code >= 400:
         print("[qdrant] UPSERT ERROR:", r.text)
     r.raise_for_status()
     return r.json()
 
-def search(vector, top_k=5):
+def delete_points(ids, collection: str = None):
+    for i in range(0, len(ids), 256):
+        r = http_client.post(f"{QDRANT_URL}/collections/{collection or COLLECTION}/points/delete",
+                             params={"wait": "true"}, headers=_headers(),
+                             data=json.dumps({"points": list(ids[i:i + 256])}), timeout=60)
+        r.raise_for_status()
+
+def _search_body(vector, top_k) -> dict:
     if not isinstance(vector, (list, tuple)):
         raise ValueError("vector must be list/tuple of floats")
     body = {"vector": vector, "limit": int(top_k), "with_payload": True}
-    r = requests.post(f"{QDRANT_URL}/collections/{COLLECTION}/points/search",
-                      headers=_headers(), data=json.dumps(body), timeout=30)
+    params = _search_params()
+    if params:
+        body["params"] = params
+    return body
+
+def search(vector, top_k=5, collection: str = None):
+    """Top-k points for `vector`; a read, so hedged past its observed p95 (hedge.py)."""
+    return hedger("search").call(_search, vector, top_k, collection)
+
+async def asearch(vector, top_k=5, collection: str = None):
+    """search() for coroutines, over the async HTTP client."""
+    return await hedger("search").acall(_asearch, vector, top_k, collection)
+
+def _search(vector, top_k, collection):
+    r = http_client.post(f"{QDRANT_URL}/collections/{collection or COLLECTION}/points/search",
+                      headers=_headers(), data=json.dumps(_search_body(vector, top_k)), timeout=30)
+    if r.status_code == 403:
+        print("[qdrant] SEARCH FORBIDDEN. Check QDRANT_API_KEY and cluster URL in back/.env")
+    r.raise_for_status()
+    return r.json().get("result", [])
+
+async def _asearch(vector, top_k, collection):
+    r = await http_client.apost(f"{QDRANT_URL}/collections/{collection or COLLECTION}/points/search",
+                                headers=_headers(), content=json.dumps(_search_body(vector, top_k)), timeout=30)
+    if r.status_code == 403:
+        print("[qdrant] SEARCH FORBIDDEN. Check QDRANT_API_KEY and cluster URL in back/.env")
+    r.raise_for_status()
+    return r.json().get("result", [])
+
+def search_batch(vectors, top_k=5, collection: str = None):
+    """Many searches in one points/search/batch request; one result list per vector, in order."""
+    if not vectors:
+        return []
+    params = _search_params()
+    body = {"searches": [{"vector": list(v), "limit": int(top_k), "with_payload": True,
+                          **({"params": params} if params else {})} for v in vectors]}
+    r = http_client.post(f"{QDRANT_URL}/collections/{collection or COLLECTION}/points/search/batch",
+                         headers=_headers(), data=json.dumps(body), timeout=60)
     if r.status_code == 403:
         print("[qdrant] SEARCH FORBIDDEN. Check QDRANT_API_KEY and cluster URL in back/.env")
     r.raise_for_status()
     return r.json().get("result", [])
 
 def show_collection():
-    r = requests.get(f"{QDRANT_URL}/collections/{COLLECTION}", headers=_headers(), timeout=20)
+    r = http_client.get(f"{QDRANT_URL}/collections/{COLLECTION}", headers=_headers(), timeout=20)
     if r.status_code == 200:
         return r.json()
     return None
 
 def drop_collection():
-    requests.delete(f"{QDRANT_URL}/collections/{COLLECTION}", headers=_headers(), timeout=20)
+    http_client.delete(f"{QDRANT_URL}/collections/{COLLECTION}", headers=_headers(), timeout=20)
+
+if __name__ == "__main__":
+    # Provision / migrate QDRANT_COLLECTION to the declared schema and show the result
+    n = ensure_collection()
+    info = (show_collection() or {}).get("result") or {}
+    cfg = info.get("config") or {}
+    print(json.dumps({"points_count": n, "vectors": (cfg.get("params") or {}).get("vectors"),
+                      "on_disk_payload": (cfg.get("params") or {}).get("on_disk_payload"),
+                      "hnsw_config": cfg.get("hnsw_config"), "quantization_config": cfg.get("quantization_config"),
+                      "payload_schema": info.get("payload_schema")}, indent=1))
@@ -0,0 +1,96 @@
+# query_log.py — what people ask: anonymized, normalized questions + stage timings, as rotating JSONL
+# One compact line per /ask: {"t": unix seconds, "q": question, "o": outcome, "w": web flag, "ms": {stage: ms}}
+# No client data is kept; emails, URLs, phone numbers and long digit runs in the question are masked.
+import os, re, json, time, threading
+from pathlib import Path
+
+from utils.text import normalize_question
+
+try:
+    import fcntl
+except ImportError:   # Windows: rotation isn't coordinated between processes
+    fcntl = None
+
+ROOT = Path(__file__).parent
+QUERY_LOG           = os.getenv("QUERY_LOG", str(ROOT / "data" / "query_log.jsonl"))   # empty = off
+QUERY_LOG_MAX_BYTES = int(os.getenv("QUERY_LOG_MAX_BYTES", str(8 * 1024 * 1024)))
+QUERY_LOG_BACKUPS   = int(os.getenv("QUERY_LOG_BACKUPS", "5"))    # query_log.jsonl.1 … .N
+
+_MASKS = [
+    (re.compile(r"\b[\w.+-]+@[\w-]+(\.[\w-]+)+\b"), "<email>"),
+    (re.compile(r"\bhttps?://\S+|\bwww\.\S+"), "<url>"),
+    # 9+ digits with separators is a phone number; a date like 2025-08-22 has only 8
+    (re.compile(r"\+?\d[\d ()-]{7,}\d"), lambda m: "<phone>" if sum(c.isdigit() for c in m.group()) >= 9 else m.group()),
+    (re.compile(r"\d{5,}"), "<num>"),
+]
+
+def anonymize(question: str) -> str:
+    """normalize_question() form with personal-looking tokens masked."""
+    q = normalize_question(question)
+    for pattern, mask in _MASKS:
+        q = pattern.sub(mask, q)
+    return q
+
+class QueryLog:
+    """
+    Appends one line per record; each write re-opens the file in append mode, so every
+    gunicorn worker can log to the same path and a rotation is picked up immediately.
+    Past max_bytes the file rolls to .1 (.1 → .2 …), under an flock so only one worker rotates.
+    """
+    def __init__(self, path: str, max_bytes: int = QUERY_LOG_MAX_BYTES, backups: int = QUERY_LOG_BACKUPS):
+        self.path = Path(path)
+        self.max_bytes, self.backups = max_bytes, backups
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    def files(self) -> list:
+        """Existing log files, oldest first."""
+        out = [self.path.with_name(f"{self.path.name}.{i}") for i in range(self.backups, 0, -1)] + [self.path]
+        return [p for p in out if p.exists()]
+
+    def record(self, question: str, outcome: str, web: bool, timings: dict):
+        q = anonymize(question)
+        if not q:
+            return
+        line = json.dumps({"t": int(time.time()), "q": q, "o": outcome, "w": int(bool(web)),
+                           "ms": {k: round(v * 1000, 1) for k, v in (timings or {}).items()}},
+                          ensure_ascii=False, separators=(",", ":")) + "\n"
+        try:
+            with self._lock:
+                with self.path.open("a", encoding="utf-8") as f:
+                    f.write(line)
+                    size = f.tell()
+                if size > self.max_bytes:
+                    self._rotate()
+        except OSError as e:
+            print(f"[query_log] write failed: {e}")
+
+    def _rotate(self):
+        lock = open(self.path.with_name(self.path.name + ".lock"), "w")
+        try:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            if not self.path.exists() or self.path.stat().st_size <= self.max_bytes:
+                return   # another worker rotated first
+            for i in range(self.backups - 1, 0, -1):
+                src = self.path.with_name(f"{self.path.name}.{i}")
+                if src.exists():
+                    src.replace(self.path.with_name(f"{self.path.name}.{i + 1}"))
+            if self.backups > 0:
+                self.path.replace(self.path.with_name(f"{self.path.name}.1"))
+            else:
+                self.path.unlink()
+        finally:
+            lock.close()
+
+    def read(self):
+        """Yield every record in the current and rotated files, oldest first; bad lines are skipped."""
+        for p in self.files():
+            with p.open("r", encoding="utf-8", errors="replace") as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+
+query_log = QueryLog(QUERY_LOG) if QUERY_LOG else None
@@ -0,0 +1,294 @@
+# rate_limit.py — shared OpenAI call scheduler: token buckets, AIMD concurrency, priorities
+#
+# Every OpenAI call takes a slot() (aslot() in asyncio code) first. A slot is granted when
+#   - the request and token buckets (per-minute limits) have room,
+#   - fewer than `limit` calls are in flight (AIMD: +1/limit per success, halved on 429/503),
+#   - no Retry-After pause is active, and
+#   - no higher-priority caller is waiting (interactive /ask beats bulk ingest).
+# Bulk callers also leave INTERACTIVE_RESERVE of concurrency and bucket capacity unused.
+# Limits start from OPENAI_RPM / OPENAI_TPM and follow the x-ratelimit-* response headers.
+import os, time, heapq, random, asyncio, itertools, threading, contextvars
+from contextlib import contextmanager, asynccontextmanager
+
+import deadline
+
+OPENAI_RPM             = float(os.getenv("OPENAI_RPM", "0"))    # 0 = unknown until a response tells us
+OPENAI_TPM             = float(os.getenv("OPENAI_TPM", "0"))
+MAX_CONCURRENCY        = int(os.getenv("OPENAI_MAX_CONCURRENCY", "16"))
+MIN_CONCURRENCY        = int(os.getenv("OPENAI_MIN_CONCURRENCY", "1"))
+INTERACTIVE_RESERVE    = float(os.getenv("OPENAI_INTERACTIVE_RESERVE", "0.2"))   # share bulk may not use
+BACKOFF_BASE           = float(os.getenv("OPENAI_BACKOFF_BASE", "0.5"))
+BACKOFF_CAP            = float(os.getenv("OPENAI_BACKOFF_CAP", "30"))
+
+PRIORITIES = {"interactive": 0, "bulk": 1}
+_default_priority = os.getenv("OPENAI_PRIORITY", "interactive")
+_priority: contextvars.ContextVar = contextvars.ContextVar("openai_priority", default=None)
+
+def set_default_priority(name: str):
+    """Process-wide priority, e.g. "bulk" for the ingest CLI."""
+    global _default_priority
+    if name not in PRIORITIES:
+        raise ValueError(f"unknown priority {name!r}")
+    _default_priority = name
+
+@contextmanager
+def priority(name: str):
+    """Run OpenAI calls in this block (this thread/context) at `name` priority."""
+    if name not in PRIORITIES:
+        raise ValueError(f"unknown priority {name!r}")
+    token = _priority.set(name)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+def current_priority() -> str:
+    return _priority.get() or _default_priority
+
+def retry_after(headers) -> float:
+    """Seconds the server asked us to wait (Retry-After / retry-after-ms), else 0."""
+    if not headers:
+        return 0.0
+    ms = headers.get("retry-after-ms")
+    if ms:
+        try:
+            return float(ms) / 1000.0
+        except ValueError:
+            pass
+    ra = headers.get("retry-after")
+    try:
+        return float(ra) if ra else 0.0
+    except ValueError:
+        return 0.0   # HTTP-date form: let the jittered backoff decide
+
+def backoff(attempt: int, wait_hint: float = 0.0) -> float:
+    """Full-jitter exponential backoff; a server hint is honored, plus a little jitter."""
+    if wait_hint > 0:
+        return wait_hint + random.uniform(0, min(1.0, wait_hint * 0.1))
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * (2 ** attempt)))
+
+def estimate_tokens(payload: dict, completion: int = 400) -> int:
+    """Rough token cost of a request before sending it (~4 chars/token, plus expected completion)."""
+    chars = 0
+    inp = payload.get("input")
+    if isinstance(inp, str):
+        chars += len(inp)
+    elif isinstance(inp, list):
+        chars += sum(len(x) for x in inp if isinstance(x, str))
+    for m in payload.get("messages") or []:
+        chars += len(m.get("content") or "")
+    tokens = chars // 4 + 1
+    if "messages" in payload or payload.get("tools"):
+        tokens += completion
+    return tokens
+
+class _Bucket:
+    """Per-minute token bucket; capacity 0 means unlimited (limit not known yet)."""
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.stamp = time.monotonic()
+
+    def _refill(self, now):
+        if self.capacity > 0:
+            self.level = min(self.capacity, self.level + (now - self.stamp) * self.capacity / 60.0)
+        self.stamp = now
+
+    def wait_time(self, amount: float, floor: float, now: float) -> float:
+        if self.capacity <= 0:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)   # an oversized request still gets through on a full bucket
+        need = amount + floor * self.capacity - self.level
+        return 0.0 if need <= 0 else need * 60.0 / self.capacity
+
+    def take(self, amount: float, now: float):
+        if self.capacity > 0:
+            self._refill(now)
+            self.level -= amount
+
+    def sync(self, limit, remaining, now: float):
+        """Adopt the server's limit; never believe we have more left than it says."""
+        if limit:
+            if self.capacity <= 0:
+                self.level = float(limit)
+            self.capacity = float(limit)
+        if remaining is not None and self.capacity > 0:
+            self._refill(now)
+            self.level = min(self.level, float(remaining))
+
+def _num(headers, name):
+    v = headers.get(name) if headers else None
+    try:
+        return float(v) if v not in (None, "") else None
+    except ValueError:
+        return None
+
+class Slot:
+    """A granted call. Report the outcome with done(status, headers) before leaving the block."""
+    def __init__(self, sched: "Scheduler", prio: int):
+        self.sched, self.prio = sched, prio
+        self.status, self.headers = None, None
+
+    def done(self, status, headers=None):
+        self.status, self.headers = status, headers
+
+class Scheduler:
+    def __init__(self, rpm: float = OPENAI_RPM, tpm: float = OPENAI_TPM,
+                 max_concurrency: int = MAX_CONCURRENCY, min_concurrency: int = MIN_CONCURRENCY,
+                 reserve: float = INTERACTIVE_RESERVE):
+        self.requests, self.tokens = _Bucket(rpm), _Bucket(tpm)
+        self.max_c, self.min_c = max(1, max_concurrency), max(1, min_concurrency)
+        self.limit = float(max(self.min_c, self.max_c // 2))   # AIMD congestion window
+        self.reserve = reserve
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._last_cut = 0.0
+        self._cv = threading.Condition()
+        self._waiting = []   # heap of (priority, seq)
+        self._wakers = {}     # heap entry → (loop, asyncio.Event) of an aslot() waiter
+        self._seq = itertools.count()
+        self.granted = {name: 0 for name in PRIORITIES}
+        self.throttled = 0
+
+    def reset(self):
+        """Fresh per-process state (after a fork): nothing in flight or queued, no pause, zero counters.
+        Learned limits and bucket capacities are kept."""
+        self._cv = threading.Condition()
+        self._waiting, self._wakers, self.in_flight = [], {}, 0
+        self.paused_until = self._last_cut = 0.0
+        self.granted = {name: 0 for name in PRIORITIES}
+        self.throttled = 0
+
+    def _notify(self):
+        """
+        Wake waiters (call with _cv held): all threads in slot(), and the coroutine at the head
+        of the queue if it is one; only the head can be granted, the rest would just re-sleep.
+        """
+        self._cv.notify_all()
+        waker = self._wakers.get(self._waiting[0]) if self._waiting else None
+        if waker is not None:
+            try:
+                waker[0].call_soon_threadsafe(waker[1].set)
+            except RuntimeError:   # loop closed
+                pass
+
+    def _grant(self, name: str, tokens: int):
+        heapq.heappop(self._waiting)
+        now = time.monotonic()
+        self.requests.take(1, now)
+        self.tokens.take(tokens, now)
+        self.in_flight += 1
+        self.granted[name] += 1
+        self._notify()   # the next waiter may fit too
+
+    def _abandon(self, me):
+        self._waiting.remove(me)
+        heapq.heapify(self._waiting)
+        self._notify()
+
+    def _wait_time(self, me, prio: int, tokens: int, now: float) -> float:
+        if self._waiting[0] != me:
+            return float("inf")   # someone more urgent (or earlier) goes first
+        if now < self.paused_until:
+            return self.paused_until - now
+        bulk = prio > PRIORITIES["interactive"]
+        cap = int(self.limit)
+        if bulk:
+            cap = max(1, int(self.limit * (1 - self.reserve)))
+        if self.in_flight >= cap:
+            return float("inf")
+        floor = self.reserve if bulk else 0.0
+        return max(self.requests.wait_time(1, floor, now), self.tokens.wait_time(tokens, floor, now))
+
+    @contextmanager
+    def slot(self, tokens: int = 1, priority: str = None):
+        name = priority or current_priority()
+        prio = PRIORITIES[name]
+        me = (prio, next(self._seq))
+        with self._cv:
+            heapq.heappush(self._waiting, me)
+            try:
+                while True:
+                    wait = self._wait_time(me, prio, tokens, time.monotonic())
+                    if wait <= 0:
+                        break
+                    self._cv.wait(timeout=min(wait, 1.0, deadline.timeout(1.0, "openai slot")))
+            except BaseException:
+                self._abandon(me)
+                raise
+            self._grant(name, tokens)
+        s = Slot(self, prio)
+        try:
+            yield s
+        finally:
+            self._release(s)
+
+    @asynccontextmanager
+    async def aslot(self, tokens: int = 1, priority: str = None):
+        """slot() for coroutines: same queue and limits, but waits without blocking the event loop."""
+        name = priority or current_priority()
+        prio = PRIORITIES[name]
+        me = (prio, next(self._seq))
+        waker = (asyncio.get_running_loop(), asyncio.Event())
+        with self._cv:
+            heapq.heappush(self._waiting, me)
+            self._wakers[me] = waker
+        try:
+            while True:
+                with self._cv:
+                    wait = self._wait_time(me, prio, tokens, time.monotonic())
+                    if wait <= 0:
+                        self._grant(name, tokens)
+                        break
+                    waker[1].clear()   # under _cv, so a release after this point still wakes us
+                wait = min(wait, 1.0, deadline.timeout(1.0, "openai slot"))
+                try:
+                    await asyncio.wait_for(waker[1].wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            with self._cv:
+                self._abandon(me)
+            raise
+        finally:
+            with self._cv:
+                self._wakers.pop(me, None)
+        s = Slot(self, prio)
+        try:
+            yield s
+        finally:
+            self._release(s)
+
+    def _release(self, s: Slot):
+        now = time.monotonic()
+        with self._cv:
+            self.in_flight -= 1
+            h = s.headers
+            if h:
+                self.requests.sync(_num(h, "x-ratelimit-limit-requests"),
+                                   _num(h, "x-ratelimit-remaining-requests"), now)
+                self.tokens.sync(_num(h, "x-ratelimit-limit-tokens"),
+                                 _num(h, "x-ratelimit-remaining-tokens"), now)
+            if s.status in (429, 503):
+                self.throttled += 1
+                if now - self._last_cut > 1.0:   # one cut per burst of concurrent rejections
+                    self.limit = max(float(self.min_c), self.limit / 2)
+                    self._last_cut = now
+                # x-ratelimit-reset-* is the time to a *full* bucket; the synced level already
+                # makes us wait for the refill, so only an explicit Retry-After pauses everyone
+                pause = retry_after(h)
+                if pause:
+                    self.paused_until = max(self.paused_until, now + pause)
+            elif s.status is not None and s.status < 400:
+                self.limit = min(float(self.max_c), self.limit + 1.0 / max(self.limit, 1.0))
+            self._notify()
+
+    def stats(self) -> dict:
+        with self._cv:
+            return {"limit": round(self.limit, 2), "in_flight": self.in_flight,
+                    "waiting": len(self._waiting), "granted": dict(self.granted), "throttled": self.throttled,
+                    "rpm": self.requests.capacity, "tpm": self.tokens.capacity,
+                    "paused_s": round(max(0.0, self.paused_until - time.monotonic()), 2)}
+
+scheduler = Scheduler()
@@ -0,0 +1,74 @@
+# retrieval.py — corpus retrieval and grounded answering, shared by server.py and prewarm.py
+#
+# Everything a corpus answer depends on besides the request: embed (cached) → vector search →
+# BM25 fusion → token-budgeted context → chat. The store, collection and query-embedding cache
+# are passed in, so an offline job answers exactly as /ask would without importing the server.
+import os
+
+from openai_integration import embed_text, chat_answer, EMBED_MODEL
+from bm25 import shared_index, rrf_fuse
+from context_builder import build_context
+from metrics import span
+
+def _env_bool(name: str, default: bool = False) -> bool:
+    v = (os.getenv(name) or "").strip().lower()
+    if v in ("1","true","yes","on"):  return True
+    if v in ("0","false","no","off"): return False
+    return default
+
+SHOW_SOURCES        = _env_bool("SHOW_SOURCES", False)
+TOP_K               = int(os.getenv("TOP_K", "24"))        # candidates per retriever (vector, BM25)
+FUSED_K             = int(os.getenv("FUSED_K", "12"))      # fused chunks sent to chat when hybrid
+ENABLE_BM25         = _env_bool("ENABLE_BM25", True)
+RRF_K               = int(os.getenv("RRF_K", "60"))
+MAX_CONTEXT_CHARS   = int(os.getenv("MAX_CONTEXT_CHARS", "24000"))
+# Context is packed by tokens (near-duplicates dropped); defaults to the old char cap / 4
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET") or MAX_CONTEXT_CHARS // 4)
+
+FRESH_KEYWORDS = ["today","latest","this week","breaking","current","news","2025"]
+NO_ANSWER = "I don’t know from the current dataset."
+
+def wants_web(q: str, use_web: bool) -> bool:
+    """Web is likely before we know anything about the corpus: explicit flag or freshness keywords."""
+    return use_web or any(kw in q.lower() for kw in FRESH_KEYWORDS)
+
+class Retriever:
+    """Question → (context, sources) over one collection's vector store and BM25 index."""
+    def __init__(self, store, collection: str, embed_cache):
+        self.store, self.collection, self.embed_cache = store, collection, embed_cache
+
+    def retrieve(self, q: str):
+        """
+        Embed (cached) → vector search, fused with BM25 hits (reciprocal rank fusion)
+        when ingest has built a lexical index → token-budgeted, de-duplicated context.
+        Returns (context, sources of the chunks that made it in).
+        """
+        with span("embed"):
+            qvec = self.embed_cache.get_or_embed(q, EMBED_MODEL, embed_text)
+        with span("search"):
+            hits = self.store.search(qvec, top_k=TOP_K)
+        return self.context_from_hits(q, hits)
+
+    def context_from_hits(self, q: str, hits: list):
+        """Vector hits for `q` → (context, sources): BM25 fusion, then the token-budgeted context."""
+        lexical = shared_index(self.collection) if ENABLE_BM25 else None
+        if lexical is not None:
+            with span("bm25"):
+                hits = rrf_fuse([hits, lexical.search(q, top_k=TOP_K)], k=RRF_K, limit=FUSED_K)
+        with span("context"):
+            context, kept = build_context(hits, CONTEXT_TOKEN_BUDGET)
+        sources = list(dict.fromkeys([
+            h.get("payload", {}).get("source","") for h in kept if h.get("payload")
+        ]))
+        return context, sources
+
+def answer_from_context(q: str, context: str, sources: list):
+    """Grounded chat answer, or NO_ANSWER without context. Returns (response dict, came_from_web=False)."""
+    # 3) If we have corpus context, answer with grounding
+    if context.strip():
+        with span("chat"):
+            ans = (chat_answer(context, q, temperature=0.2) or "").strip()
+        return {"answer": ans, "sources": sources if SHOW_SOURCES else []}, False
+
+    # 4) Nothing found anywhere
+    return {"answer": NO_ANSWER, "sources": []}, False
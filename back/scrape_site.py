@@ -1,55 +1,231 @@
-import os, re, csv
-from urllib.parse import urljoin, urldefrag
-import requests
+# scrape_site.py — async same-site crawler; streams pages into ingest_to_qdrant (CSV export optional)
+# Re-crawls are conditional (ETag / Last-Modified): unchanged pages aren't re-downloaded or re-embedded.
+import os, re, csv, json, time, queue, asyncio, hashlib, threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urljoin, urldefrag, urlparse
+
+import httpx
 from bs4 import BeautifulSoup
 from dotenv import load_dotenv
 
+from utils.text import chunk_stream
+
 load_dotenv()
-MAX_PAGES = int(os.getenv("MAX_PAGES","0"))
+ROOT = Path(__file__).parent
+MAX_PAGES = int(os.getenv("MAX_PAGES","0"))                      # per seed site
 SEEDS = [s.strip() for s in os.getenv("SITE_SEEDS","").split(",") if s.strip()]
 SITE_CHAR_LIMIT = int(os.getenv("SITE_CHAR_LIMIT","0")) or None
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1800"))                # same default as ingest.py
+OUT_CSV = ROOT / "data" / "uploaddigital_corpus.csv"
+CRAWL_STATE = Path(os.getenv("CRAWL_STATE") or ROOT / "data" / "crawl_state.json")
+
+CRAWL_CONCURRENCY = int(os.getenv("CRAWL_CONCURRENCY", "16"))    # fetches in flight overall
+CRAWL_PER_HOST    = int(os.getenv("CRAWL_PER_HOST", "2"))        # fetches in flight per host
+CRAWL_DELAY       = float(os.getenv("CRAWL_DELAY", "0.25"))      # min seconds between request starts per host
+CRAWL_TIMEOUT     = float(os.getenv("CRAWL_TIMEOUT", "15"))
+MIN_PAGE_CHARS    = 200
+USER_AGENT        = "datadepot-bot/1.0"
 
-def clean_text(html: str) -> str:
+def parse_page(html: str, url: str):
+    """One parse per page: (clean text, same-scheme absolute links without fragments)."""
     soup = BeautifulSoup(html, "html.parser")
+    links = []
+    for a in soup.find_all("a", href=True):
+        u = urldefrag(urljoin(url, a["href"]))[0]
+        if urlparse(u).scheme in ("http", "https"):
+            links.append(u)
     for tag in soup(["script","style","noscript"]): tag.decompose()
     text = soup.get_text(separator=" ", strip=True)
     text = re.sub(r"\s+"," ", text).strip()
-    return text[:SITE_CHAR_LIMIT] if SITE_CHAR_LIMIT else text
-
-def crawl(seed: str, limit: int):
-    origin = requests.utils.urlparse(seed).netloc
-    q, seen, rows = [seed], set(), []
-    while q and len(rows) < limit:
-        url = q.pop(0)
-        if url in seen: continue
-        seen.add(url)
+    return (text[:SITE_CHAR_LIMIT] if SITE_CHAR_LIMIT else text), list(dict.fromkeys(links))
+
+def load_state(path: Path = CRAWL_STATE) -> dict:
+    """{url: {"etag", "last_modified", "sha256", "links"}} from the previous crawl."""
+    try:
+        return json.loads(Path(path).read_text(encoding="utf-8"))
+    except Exception:
+        return {}
+
+def save_state(state: dict, path: Path = CRAWL_STATE):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(json.dumps(state, ensure_ascii=False), encoding="utf-8")
+    tmp.replace(path)
+
+class _HostGate:
+    """Per-host politeness: at most CRAWL_PER_HOST in flight, request starts CRAWL_DELAY apart."""
+    def __init__(self, per_host: int, delay: float):
+        self.sem = asyncio.Semaphore(per_host)
+        self.delay, self.next_at = delay, 0.0
+        self.lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        await self.sem.acquire()
+        async with self.lock:
+            now = time.monotonic()
+            wait = self.next_at - now
+            self.next_at = max(now, self.next_at) + self.delay
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def __aexit__(self, *exc):
+        self.sem.release()
+
+async def crawl_async(seeds, limit: int, emit, state: dict, known: dict = None,
+                      concurrency: int = CRAWL_CONCURRENCY, per_host: int = CRAWL_PER_HOST,
+                      delay: float = CRAWL_DELAY):
+    """
+    Breadth-first crawl of each seed's site (same host only), up to `limit` indexed pages
+    per site, with `concurrency` workers sharing one HTTP/1.1 keep-alive client.
+    Each page is handed to emit(doc) as {"source", "sha256", "chunks"}: chunks is a list,
+    or None when the page is unchanged since the last ingest (304, or same text hash) and
+    `known` (manifest entries) already holds it. Updates `state` in place. emit() may
+    block (e.g. a full queue to a slow consumer): it runs on its own thread, so only the
+    fetches with a page to hand off wait for it, never the event loop.
+    """
+    known = known or {}
+    frontier, seen = deque(), set()
+    indexed, gates = {}, {}
+    for s in seeds:
+        s = urldefrag(s)[0]
+        if s not in seen:
+            seen.add(s); frontier.append(s)
+    origins = {urlparse(s).netloc for s in frontier}
+    wake = asyncio.Event()
+    busy = 0
+    handoff = asyncio.Queue(maxsize=concurrency)   # pages on their way to emit()
+
+    async def forward():
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="crawl-emit") as pool:
+            while True:
+                doc = await handoff.get()
+                if doc is None:
+                    return
+                await loop.run_in_executor(pool, emit, doc)
+
+    def enqueue(links, host):
+        for u in links:
+            if u not in seen and urlparse(u).netloc == host and len(seen) < limit * 3 * len(origins):
+                seen.add(u); frontier.append(u)
+        wake.set()
+
+    async def fetch(client, url):
+        prev = state.get(url) or {}
+        entry = known.get(url) or {}
+        headers = {}
+        # Only ask for a 304 if the indexed copy is the one we hold validators for
+        if prev.get("sha256") and entry.get("sha256") == prev["sha256"]:
+            if prev.get("etag"):          headers["If-None-Match"] = prev["etag"]
+            if prev.get("last_modified"): headers["If-Modified-Since"] = prev["last_modified"]
+        host = urlparse(url).netloc
+        gate = gates.setdefault(host, _HostGate(per_host, delay))
+        async with gate:
+            r = await client.get(url, headers=headers)
+        if r.status_code == 304:
+            indexed[host] = indexed.get(host, 0) + 1
+            await handoff.put({"source": url, "sha256": prev["sha256"], "chunks": None})
+            enqueue(prev.get("links") or [], host)
+            print("Unchanged", url)
+            return
+        if r.status_code != 200 or "html" not in r.headers.get("content-type", "html"):
+            return
+        # Parsing is CPU-bound; keep it off the event loop so other fetches progress
+        txt, links = await asyncio.to_thread(parse_page, r.text, str(r.url))
+        h = hashlib.sha256(txt.encode("utf-8")).hexdigest()
+        state[url] = {"etag": r.headers.get("etag"), "last_modified": r.headers.get("last-modified"),
+                      "sha256": h, "links": [u for u in links if urlparse(u).netloc == host]}
+        if len(txt) > MIN_PAGE_CHARS:
+            indexed[host] = indexed.get(host, 0) + 1
+            unchanged = entry.get("sha256") == h
+            await handoff.put({"source": url, "sha256": h,
+                               "chunks": None if unchanged else list(chunk_stream(txt, size=CHUNK_SIZE, overlap=0))})
+            print("Unchanged" if unchanged else "Indexed", url, f"(len={len(txt)})")
+        enqueue(state[url]["links"], host)
+
+    async def worker(client):
+        nonlocal busy
+        while True:
+            while not frontier:
+                if busy == 0:
+                    wake.set()
+                    return
+                wake.clear()
+                await wake.wait()
+            url = frontier.popleft()
+            if indexed.get(urlparse(url).netloc, 0) >= limit:
+                continue
+            busy += 1
+            try:
+                await fetch(client, url)
+            except Exception as e:
+                print("skip", url, e)
+            finally:
+                busy -= 1
+                wake.set()
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=CRAWL_TIMEOUT, limits=limits, follow_redirects=True,
+                                 headers={"User-Agent": USER_AGENT}) as client:
+        forwarder = asyncio.ensure_future(forward())
         try:
-            r = requests.get(url, timeout=15, headers={"User-Agent":"datadepot-bot/1.0"})
-            if r.status_code != 200: continue
-            txt = clean_text(r.text)
-            if len(txt) > 200:
-                rows.append({"source":url, "text":txt})
-                print("Indexed", url, f"(len={len(txt)})")
-            soup = BeautifulSoup(r.text,"html.parser")
-            for a in soup.find_all("a", href=True):
-                u = urljoin(url, a["href"]); u = urldefrag(u)[0]
-                p = requests.utils.urlparse(u)
-                if p.netloc == origin and p.scheme in ("http","https") and u not in seen and len(q)<limit*3:
-                    q.append(u)
-        except Exception as e:
-            print("skip", url, e)
-    return rows
+            await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        finally:
+            await handoff.put(None)   # behind every page already handed off
+            await forwarder
+
+def iter_site_documents(known: dict = None, seeds=None, limit: int = None, state_path: Path = CRAWL_STATE):
+    """
+    Stream crawled pages as ingest documents ({"source", "sha256", "chunks"}), the same
+    shape as ingest.iter_documents(), so ingest_to_qdrant can diff and embed them as they
+    arrive. The crawl runs on its own event loop thread; the crawl state is saved once
+    the crawl finishes.
+    """
+    seeds = SEEDS if seeds is None else seeds
+    limit = MAX_PAGES if limit is None else limit
+    if not seeds or limit <= 0:
+        print("[crawl] no SITE_SEEDS or MAX_PAGES=0 -> nothing to crawl")
+        return
+    state = load_state(state_path)
+    out = queue.Queue(maxsize=256)
+    done = object()
+
+    def run():
+        try:
+            asyncio.run(crawl_async(seeds, limit, out.put, state, known))
+            save_state(state, state_path)
+        except BaseException as e:
+            out.put(e)
+        finally:
+            out.put(done)
+
+    t0 = time.perf_counter()
+    threading.Thread(target=run, name="crawler", daemon=True).start()
+    n = 0
+    while True:
+        item = out.get()
+        if item is done:
+            break
+        if isinstance(item, BaseException):
+            raise item
+        n += 1
+        yield item
+    print(f"[crawl] {n} pages in {time.perf_counter() - t0:.1f}s")
 
 def main():
-    all_rows = []
-    for s in SEEDS:
-        all_rows += crawl(s, MAX_PAGES)
-    os.makedirs("data", exist_ok=True)
-    out = os.path.join("data","uploaddigital_corpus.csv")
-    with open(out,"w",newline="",encoding="utf-8") as f:
-        w=csv.DictWriter(f, fieldnames=["source","text"]); w.writeheader()
-        for r in all_rows: w.writerow(r)
-    print("Saved:", out, "rows:", len(all_rows))
+    # Full export: fetch everything unconditionally so every page has its text in the CSV
+    OUT_CSV.parent.mkdir(parents=True, exist_ok=True)
+    n = 0
+    with OUT_CSV.open("w",newline="",encoding="utf-8") as f:
+        w=csv.DictWriter(f, fieldnames=["source","sha256","chunk","text"]); w.writeheader()
+        for doc in iter_site_documents():
+            for idx, chunk in enumerate(doc["chunks"] or ()):
+                w.writerow({"source": doc["source"], "sha256": doc["sha256"], "chunk": idx, "text": chunk})
+                n += 1
+    print("Saved:", OUT_CSV, "rows:", n)
 
 if __name__ == "__main__":
     if MAX_PAGES > 0:
@@ -1,8 +1,9 @@
 # server.py
-import os
+import os, json, time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 from pathlib import Path
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 
 # Load .env sitting next to this file
@@ -15,8 +16,26 @@ k = (os.getenv("QDRANT_API_KEY") or "").strip()
 print(f"[boot] QDRANT_API_KEY prefix={k[:8]} len={len(k)}")
 print(f"[boot] WEB_MODEL={os.getenv('WEB_MODEL','gpt-4.1')}")
 
-from openai_integration import embed_text, chat_answer, web_answer
-from qdrant_rest import search
+import openai_integration
+from openai_integration import embed_text, embed_texts, chat_answer_stream, web_answer, EMBED_MODEL
+from qdrant_rest import COLLECTION
+from vector_store import get_store
+from bm25 import shared_index
+from context_builder import count_tokens
+from retrieval import (Retriever, answer_from_context, wants_web, NO_ANSWER, SHOW_SOURCES, TOP_K,
+                       ENABLE_BM25)
+import metrics
+from metrics import span
+from cache import EmbeddingCache, AnswerCache, CollectionVersion, reset_tiers
+from singleflight import SingleFlight
+from prewarm import PrewarmIndex
+from query_log import query_log
+import http_client
+from http_client import pool_stats
+import rate_limit
+from rate_limit import scheduler as openai_scheduler
+import deadline
+import hedge
 
 def _env_bool(name: str, default: bool = False) -> bool:
     v = (os.getenv(name) or "").strip().lower()
@@ -27,58 +46,489 @@ def _env_bool(name: str, default: bool = False) -> bool:
 # Config
 PORT                = int(os.getenv("PORT", "8000"))
 CORS_ORIGINS        = [o.strip() for o in os.getenv("CORS_ORIGINS", "http://localhost:3000").split(",")]
-SHOW_SOURCES        = _env_bool("SHOW_SOURCES", False)
-TOP_K               = int(os.getenv("TOP_K", "24"))
-MAX_CONTEXT_CHARS   = int(os.getenv("MAX_CONTEXT_CHARS", "24000"))
+# SHOW_SOURCES, TOP_K, FUSED_K, ENABLE_BM25, RRF_K and the context budget live in retrieval.py
 ENABLE_WEB_SEARCH   = _env_bool("ENABLE_WEB_SEARCH", True)
+EMBED_CACHE_SIZE    = int(os.getenv("EMBED_CACHE_SIZE", "2048"))
+EMBED_CACHE_DB      = os.getenv("EMBED_CACHE_DB", "")   # e.g. data/cache.sqlite3 (shared by workers)
+
+ANSWER_CACHE_SIZE   = int(os.getenv("ANSWER_CACHE_SIZE", "1024"))
+ANSWER_CACHE_DB     = os.getenv("ANSWER_CACHE_DB", EMBED_CACHE_DB)
+ANSWER_CACHE_TTL    = float(os.getenv("ANSWER_CACHE_TTL", "3600"))     # corpus answers, seconds
+WEB_ANSWER_CACHE_TTL = float(os.getenv("WEB_ANSWER_CACHE_TTL", "300")) # web answers go stale faster
+# When the web flag/keywords make a web answer likely, start it alongside retrieval instead of after it
+WEB_SPECULATE       = _env_bool("WEB_SPECULATE", True)
+WEB_BUDGET_S        = float(os.getenv("WEB_BUDGET_S", "20"))   # past this, a ready corpus answer wins
+# Whole-/ask budget shared by embed, search, web and chat (well under gunicorn's timeout); when
+# it runs out the last answer to the question or a prewarmed one is served, else a 504
+ASK_DEADLINE_S      = float(os.getenv("ASK_DEADLINE_S", "60"))
+CHAT_RESERVE_S      = float(os.getenv("CHAT_RESERVE_S", "15"))  # budget the web branch leaves for chat
+BRANCH_WORKERS      = int(os.getenv("BRANCH_WORKERS", "16"))
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "100"))
+BATCH_CHAT_CONCURRENCY = int(os.getenv("BATCH_CHAT_CONCURRENCY", "4"))   # per worker, across all batches
+# Whole-/ask/batch budget; questions not answered by then get an error entry
+BATCH_DEADLINE_S    = float(os.getenv("BATCH_DEADLINE_S", "90"))
+# Identical concurrent /ask questions share one computation (per worker). With SINGLEFLIGHT_DIR
+# set, workers also coordinate through lock files there; pair it with ANSWER_CACHE_DB so the
+# waiting workers can pick up the answer instead of recomputing it.
+SINGLEFLIGHT        = _env_bool("SINGLEFLIGHT", True)
+SINGLEFLIGHT_DIR    = os.getenv("SINGLEFLIGHT_DIR", "")
+SINGLEFLIGHT_WAIT_S = float(os.getenv("SINGLEFLIGHT_WAIT_S", "60"))
+# Load read-only state (local index, BM25, tokenizer) at import instead of on the first request.
+# Under gunicorn --preload (gunicorn.conf.py) that import runs once in the master and the
+# workers share the result copy-on-write.
+WARM_START          = _env_bool("WARM_START", True)
+# Answers precomputed by prewarm.py for the most-asked corpus questions
+PREWARM             = _env_bool("PREWARM", True)
+# Send this request header (any non-empty value) to get per-stage "timings" (ms) in the response
+DEBUG_TIMINGS_HEADER = os.getenv("DEBUG_TIMINGS_HEADER", "X-Debug-Timings")
+
+# Repeated questions skip the /embeddings round trip
+embed_cache = EmbeddingCache(maxsize=EMBED_CACHE_SIZE, db_path=EMBED_CACHE_DB or None)
+# ...and, within the TTL and the same ingest version, the whole pipeline
+answer_cache = AnswerCache(maxsize=ANSWER_CACHE_SIZE, db_path=ANSWER_CACHE_DB or None,
+                           ttl=ANSWER_CACHE_TTL, web_ttl=WEB_ANSWER_CACHE_TTL)
+collection_version = CollectionVersion(COLLECTION)
+# Remote Qdrant or the local memory-mapped index (VECTOR_BACKEND)
+store = get_store(COLLECTION)
+retriever = Retriever(store, COLLECTION, embed_cache)
+retrieve, context_from_hits = retriever.retrieve, retriever.context_from_hits
+prewarmed = PrewarmIndex(COLLECTION)
+flights = SingleFlight(lock_dir=SINGLEFLIGHT_DIR or None, wait_timeout=SINGLEFLIGHT_WAIT_S)
+if SINGLEFLIGHT_DIR and not ANSWER_CACHE_DB:
+    print("[boot] SINGLEFLIGHT_DIR without ANSWER_CACHE_DB: workers will queue but not share answers")
+# Runs the speculative web/retrieval branches of /ask
+branch_pool = ThreadPoolExecutor(max_workers=BRANCH_WORKERS, thread_name_prefix="branch")
+# Per-question answering for /ask/batch; its size bounds concurrent chat calls from batches
+batch_pool = ThreadPoolExecutor(max_workers=BATCH_CHAT_CONCURRENCY, thread_name_prefix="batch")
+
+def warm():
+    """Load what the first /ask would otherwise pay for. Opens no sockets (safe before a fork)."""
+    t0 = time.perf_counter()
+    n = store.warm()
+    lexical = shared_index(COLLECTION) if ENABLE_BM25 else None
+    count_tokens("warm")   # loads the tokenizer
+    collection_version.get()
+    print(f"[boot] warm: {n} vectors, bm25={'yes' if lexical else 'no'} in {time.perf_counter() - t0:.2f}s")
+
+def after_fork():
+    """In a worker forked from a preloaded master: per-process state starts fresh."""
+    http_client.reset()
+    openai_integration.reset_client()
+    openai_scheduler.reset()
+    metrics.reset()
+    hedge.reset()
+    reset_tiers(embed_cache, answer_cache)
+
+def _cache_counters():
+    out = []
+    for name, c in (("embedding", embed_cache), ("answer", answer_cache)):
+        for tier, st in c.stats().items():
+            out.append(("cache_requests_total", {"cache": name, "tier": tier, "result": "hit"}, st["hits"]))
+            out.append(("cache_requests_total", {"cache": name, "tier": tier, "result": "miss"}, st["misses"]))
+    st = openai_scheduler.stats()
+    out += [("openai_concurrency_limit", {}, st["limit"]), ("openai_in_flight", {}, st["in_flight"]),
+            ("openai_throttled_total", {}, st["throttled"])]
+    out += [("openai_slots_granted_total", {"priority": p}, n) for p, n in st["granted"].items()]
+    sf = flights.stats()
+    out += [("singleflight_total", {"role": "leader"}, sf["leaders"]),
+            ("singleflight_total", {"role": "follower"}, sf["followers"]),
+            ("singleflight_total", {"role": "cross_worker"}, sf["cross_worker_hits"])]
+    for host, st in pool_stats().items():
+        out.append(("http_pool_connections_total", {"host": host}, st["connections"]))
+        out.append(("http_pool_requests_total", {"host": host}, st["requests"]))
+    return out
+
+metrics.register_collector(_cache_counters)
+
+if WARM_START:
+    warm()
 
 app = Flask(__name__)
 CORS(app, origins=CORS_ORIGINS)
 
+def status_body() -> dict:
+    return {"ok": True, "worker": os.getpid(), "collection_version": collection_version.get(),
+            "embed_cache": embed_cache.stats(), "answer_cache": answer_cache.stats(),
+            "http_pools": pool_stats(),
+            "openai_scheduler": openai_scheduler.stats(),
+            "singleflight": flights.stats(), "prewarm": prewarmed.stats(), "hedge": hedge.stats()}
+
 @app.get("/status")
 def status():
-    return jsonify({"ok": True})
+    return jsonify(status_body())
+
+@app.get("/metrics")
+def prometheus_metrics():
+    # Per worker process: each gunicorn worker keeps and serves its own numbers
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+def _web(q: str, web_domains: list) -> dict:
+    with span("web"):
+        return web_answer(question=q, allowed_domains=web_domains if web_domains else None)
+
+def _web_out(wa: dict, sources: list):
+    if not (wa.get("text") or "").strip():
+        return None
+    out = {"answer": wa["text"]}
+    out["sources"] = (sources + wa.get("sources", [])) if SHOW_SOURCES else wa.get("sources", [])
+    return out
+
+def web_budget() -> float:
+    """Seconds to give the web branch when a corpus answer is the alternative: WEB_BUDGET_S, less
+    whatever would leave the chat call under CHAT_RESERVE_S of the request's deadline."""
+    left = deadline.remaining()
+    return WEB_BUDGET_S if left is None else max(0.0, min(WEB_BUDGET_S, left - CHAT_RESERVE_S))
+
+def try_web(q: str, use_web: bool, web_domains: list, context: str, sources: list):
+    """If user wants fresh info or we have no context, try web. Returns a response dict or None."""
+    if not (ENABLE_WEB_SEARCH and (wants_web(q, use_web) or not context.strip())):
+        return None
+    if deadline.remaining() is None or not context.strip():
+        return _web_out(_web(q, web_domains), sources)
+    # the corpus can answer: the web only gets what the chat call can spare
+    budget = deadline.remaining() - CHAT_RESERVE_S
+    if budget <= 0:
+        metrics.inc("ask_degraded_total", step="skip_web")
+        return None
+    try:
+        with deadline.budget(budget):
+            return _web_out(_web(q, web_domains), sources)
+    except deadline.DeadlineExceeded:
+        print(f"[ask] web search cut after {budget:.1f}s to leave time for chat; answering from the corpus")
+        metrics.inc("ask_degraded_total", step="cut_web")
+        return None
+
+def _race_web(q: str, web_domains: list):
+    """
+    Web search and retrieval in parallel. A non-empty web answer within WEB_BUDGET_S
+    wins and the retrieval result is ignored (cancelled if it hasn't started). Otherwise
+    the corpus path continues with the retrieval result; if that has no context we
+    keep waiting on the web, as the sequential path would have.
+    """
+    web_f = metrics.submit(branch_pool, _web, q, web_domains)
+    ret_f = metrics.submit(branch_pool, retrieve, q)
+
+    def corpus_sources():
+        if SHOW_SOURCES and ret_f.done() and not ret_f.cancelled() and ret_f.exception() is None:
+            return ret_f.result()[1]
+        return []
+
+    budget = web_budget()
+    try:
+        out = _web_out(web_f.result(timeout=budget), [])
+        if out:
+            ret_f.cancel()
+            if SHOW_SOURCES:
+                out["sources"] = corpus_sources() + out["sources"]
+            return out, "", []
+    except FutureTimeout:
+        print(f"[ask] web branch over {budget:.1f}s budget; using corpus if it has context")
+    except Exception as e:
+        print(f"[ask] web branch failed: {type(e).__name__}: {e}")
+
+    context, sources = ret_f.result()
+    if not context.strip() and not web_f.done():
+        try:
+            return _web_out(web_f.result(), sources), context, sources
+        except deadline.DeadlineExceeded:
+            raise
+        except Exception as e:
+            print(f"[ask] web branch failed: {type(e).__name__}: {e}")
+    return None, context, sources
+
+def gather(q: str, use_web: bool, web_domains: list):
+    """
+    Resolve the retrieval and web branches of /ask.
+    Returns (web response dict or None, corpus context, corpus sources).
+    """
+    if ENABLE_WEB_SEARCH and WEB_SPECULATE and wants_web(q, use_web):
+        return _race_web(q, web_domains)
+
+    # 1) Vector search first
+    context, sources = retrieve(q)
+    # 2) If user wants fresh info or we have no context, try web
+    return try_web(q, use_web, web_domains, context, sources), context, sources
+
+def answer_question(q: str, use_web: bool, web_domains: list):
+    """Retrieval (+ maybe web) → (maybe) chat. Returns (response dict, came_from_web)."""
+    out, context, sources = gather(q, use_web, web_domains)
+    if out:
+        return out, True
+    return answer_from_context(q, context, sources)
+
+def prewarmed_answer(q: str, use_web: bool, web_domains: list):
+    """A prewarm.py answer for a corpus question close enough to one people keep asking, else None."""
+    version = collection_version.get()
+    if not PREWARM or use_web or web_domains or wants_web(q, False) or not prewarmed.ready(version):
+        return None
+    with span("embed"):
+        qvec = embed_cache.get_or_embed(q, EMBED_MODEL, embed_text)   # retrieve() reuses it on a miss
+    with span("prewarm"):
+        hit = prewarmed.lookup(qvec, version)
+    if hit is None:
+        return None
+    pre, _ = hit
+    return {"answer": pre["answer"], "sources": pre["sources"] if SHOW_SOURCES else []}
+
+def fallback_answer(q: str, use_web: bool, web_domains: list):
+    """
+    For a question that ran out of time: the last answer given to it (whatever its age or
+    collection version), else a prewarmed answer of any version if the question's vector
+    is already cached (there's no time to embed it). None if neither exists.
+    """
+    out = answer_cache.stale(answer_cache.stale_key(q, use_web, web_domains))
+    if out is not None:
+        return out
+    qvec = embed_cache.get(q, EMBED_MODEL)
+    if PREWARM and qvec is not None and not use_web and not web_domains:
+        hit = prewarmed.lookup(qvec, None)
+        if hit is not None:
+            return {"answer": hit[0]["answer"], "sources": hit[0]["sources"] if SHOW_SOURCES else []}
+    return None
+
+def is_no_answer(out: dict) -> bool:
+    """Don't pin "don't know" for the full TTL; the web (or a re-ingest) may answer later."""
+    return out.get("answer") == NO_ANSWER
+
+def _parse_ask():
+    data = request.get_json(force=True) or {}
+    q = (data.get("question") or "").strip()
+    return q, bool(data.get("web")), data.get("web_domains") or []
+
+def _want_timings() -> bool:
+    return bool(request.headers.get(DEBUG_TIMINGS_HEADER))
+
+def _ms(timings: dict) -> dict:
+    return {k: round(v * 1000, 2) for k, v in timings.items()}
 
 @app.post("/ask")
 def ask():
+    t0 = time.perf_counter()
+    timings = metrics.start_request()
+    outcome = "ok"
+    q, use_web = "", False
     try:
-        data = request.get_json(force=True) or {}
-        q = (data.get("question") or "").strip()
+        q, use_web, web_domains = _parse_ask()
         if not q:
+            outcome = "bad_request"
             return jsonify({"error": "Missing question"}), 400
 
-        use_web     = bool(data.get("web"))
-        web_domains = data.get("web_domains") or []
-        q_lower     = q.lower()
-
-        # 1) Vector search first
-        qvec   = embed_text(q)
-        hits   = search(qvec, top_k=TOP_K)
-        chunks = [h.get("payload", {}).get("text","") for h in hits if h.get("payload")]
-        context = "\n\n---\n\n".join([c for c in chunks if c])[:MAX_CONTEXT_CHARS]
-        sources = list(dict.fromkeys([
-            h.get("payload", {}).get("source","") for h in hits if h.get("payload")
-        ]))
-
-        # 2) If user wants fresh info or we have no context, try web
-        wants_fresh = any(kw in q_lower for kw in ["today","latest","this week","breaking","current","news","2025"])
-        if ENABLE_WEB_SEARCH and (use_web or wants_fresh or not context.strip()):
-            wa = web_answer(question=q, allowed_domains=web_domains if web_domains else None)
-            if (wa.get("text") or "").strip():
-                out = {"answer": wa["text"]}
-                out["sources"] = (sources + wa.get("sources", [])) if SHOW_SOURCES else wa.get("sources", [])
-                return jsonify(out)
-
-        # 3) If we have corpus context, answer with grounding
-        if context.strip():
-            ans = (chat_answer(context, q, temperature=0.2) or "").strip()
-            return jsonify({"answer": ans, "sources": sources if SHOW_SOURCES else []})
-
-        # 4) Nothing found anywhere
-        return jsonify({"answer": "I don’t know from the current dataset.", "sources": []})
+        key = answer_cache.key(q, use_web, web_domains, collection_version.get())
+        stale_key = answer_cache.stale_key(q, use_web, web_domains)
+        with span("answer_cache"):
+            out = answer_cache.get(key)
+        if out is None:
+            def compute():
+                nonlocal outcome
+                res = prewarmed_answer(q, use_web, web_domains)
+                if res is not None:
+                    outcome = "prewarmed"
+                    answer_cache.put(key, res, from_web=False, stale_key=stale_key)
+                    return res
+                res, from_web = answer_question(q, use_web, web_domains)
+                answer_cache.put(key, res, from_web=from_web, short=is_no_answer(res), stale_key=stale_key)
+                return res
+            try:
+                # the wait for another worker's computation (SINGLEFLIGHT_DIR) counts too
+                with deadline.budget(ASK_DEADLINE_S - (time.perf_counter() - t0)):
+                    if SINGLEFLIGHT:
+                        out, shared = flights.do(key, compute, lookup=lambda: answer_cache.get(key))
+                        if shared:
+                            outcome = "coalesced"
+                    else:
+                        out = compute()
+            except deadline.DeadlineExceeded as e:
+                metrics.inc("ask_deadline_exceeded_total", at=e.what)
+                out = fallback_answer(q, use_web, web_domains)
+                if out is None:
+                    outcome = "timeout"
+                    return jsonify({"error": f"No answer within {ASK_DEADLINE_S:g}s", "answer": "", "sources": []}), 504
+                outcome = "degraded"
+        else:
+            outcome = "cached"
+
+        with span("serialize"):
+            resp = jsonify(out)
+        metrics.record("total", time.perf_counter() - t0)
+        if _want_timings():
+            resp = jsonify({**out, "timings": _ms(timings)})
+        return resp
 
     except Exception as e:
+        outcome = "error"
         return jsonify({"error": f"{type(e).__name__}: {e}", "answer": "", "sources": []}), 500
+    finally:
+        metrics.inc("ask_requests_total", endpoint="ask", outcome=outcome)
+        if query_log and q:
+            query_log.record(q, outcome, use_web, timings)
+
+def _batch_answer(q: str, use_web: bool, web_domains: list, hits):
+    """One /ask/batch question, given its vector hits (None: batch retrieval failed, do it alone)."""
+    with rate_limit.priority("bulk"):
+        context, sources = retrieve(q) if hits is None else context_from_hits(q, hits)
+        out = try_web(q, use_web, web_domains, context, sources)
+        if out:
+            return out, True
+        return answer_from_context(q, context, sources)
+
+@app.post("/ask/batch")
+def ask_batch():
+    """
+    {"questions": [...], "web": bool, "web_domains": [...]} →
+    {"results": [{"question", "answer", "sources"} or {"question", "error"}, ...]} in input order.
+    Uncached questions are embedded in one /embeddings call and retrieved in one batch search;
+    chat runs on batch_pool at bulk OpenAI priority. A failing question only fails its own entry,
+    including one still unanswered after BATCH_DEADLINE_S.
+    """
+    metrics.start_request()
+    with deadline.budget(BATCH_DEADLINE_S):
+        return _ask_batch()
+
+def _ask_batch():
+    data = request.get_json(force=True) or {}
+    questions = data.get("questions")
+    if not isinstance(questions, list) or not questions:
+        return jsonify({"error": "questions must be a non-empty list"}), 400
+    if len(questions) > BATCH_MAX_QUESTIONS:
+        return jsonify({"error": f"at most {BATCH_MAX_QUESTIONS} questions per batch"}), 413
+    use_web, web_domains = bool(data.get("web")), data.get("web_domains") or []
+    version = collection_version.get()
+
+    results = [None] * len(questions)
+    todo = {}   # answer cache key → (question, [result indexes]); duplicates are answered once
+    for i, raw in enumerate(questions):
+        q = raw.strip() if isinstance(raw, str) else ""
+        if not q:
+            results[i] = {"question": raw, "error": "Missing question"}
+            continue
+        key = answer_cache.key(q, use_web, web_domains, version)
+        out = answer_cache.get(key)
+        if out is not None:
+            results[i] = {"question": q, **out}
+        else:
+            todo.setdefault(key, (q, []))[1].append(i)
+
+    keys = list(todo)
+    texts = [todo[k][0] for k in keys]
+    hit_lists = [None] * len(keys)
+    if keys:
+        try:
+            with rate_limit.priority("bulk"):
+                with span("batch_embed"):
+                    vecs = embed_cache.get_or_embed_many(texts, EMBED_MODEL, embed_texts)
+            with span("batch_search"):
+                hit_lists = store.search_batch(vecs, top_k=TOP_K)
+        except Exception as e:
+            print(f"[batch] batch retrieval failed, retrieving per question: {type(e).__name__}: {e}")
+
+    futures = [metrics.submit(batch_pool, _batch_answer, q, use_web, web_domains, hits)
+               for q, hits in zip(texts, hit_lists)]
+    failed = 0
+    for key, fut in zip(keys, futures):
+        idx = todo[key][1]
+        try:
+            out, from_web = fut.result()
+            answer_cache.put(key, out, from_web=from_web, short=is_no_answer(out))
+        except Exception as e:
+            failed += len(idx)
+            out = {"error": f"{type(e).__name__}: {e}"}
+        for i in idx:
+            results[i] = {"question": questions[i].strip(), **out}
+    metrics.inc("ask_requests_total", endpoint="ask_batch", outcome="partial" if failed else "ok")
+    return jsonify({"results": results})
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/ask/stream")
+def ask_stream():
+    """
+    Same contract as /ask, as Server-Sent Events:
+      event: token  {"text": delta}          (repeated; concatenate for the answer)
+      event: done   {"answer": ..., "sources": [...]}
+      event: error  {"error": ...}
+    Web, cached and prewarmed answers arrive as a single token event. Past ASK_DEADLINE_S
+    without a first token, the last answer to the question (if any) is sent instead, else an error.
+    """
+    q, use_web, web_domains = _parse_ask()
+    if not q:
+        metrics.inc("ask_requests_total", endpoint="ask_stream", outcome="bad_request")
+        return jsonify({"error": "Missing question"}), 400
+    want_timings = _want_timings()
+
+    def events():
+        t0 = time.perf_counter()
+        timings = metrics.start_request()
+        outcome = "ok"
+
+        def done(out):
+            metrics.record("total", time.perf_counter() - t0)
+            return _sse("done", {**out, "timings": _ms(timings)} if want_timings else out)
+
+        def budget():
+            """What's left of ASK_DEADLINE_S, for the work up to the first token."""
+            return deadline.budget(ASK_DEADLINE_S - (time.perf_counter() - t0))
+
+        try:
+            key = answer_cache.key(q, use_web, web_domains, collection_version.get())
+            stale_key = answer_cache.stale_key(q, use_web, web_domains)
+            with span("answer_cache"):
+                out = answer_cache.get(key)
+            stream = None
+            if out is not None:
+                outcome = "cached"
+            else:
+                try:
+                    with budget():
+                        out = prewarmed_answer(q, use_web, web_domains)
+                        if out is not None:
+                            outcome = "prewarmed"
+                            answer_cache.put(key, out, stale_key=stale_key)
+                        else:
+                            out, context, sources = gather(q, use_web, web_domains)
+                            if out:
+                                answer_cache.put(key, out, from_web=True, stale_key=stale_key)
+                            elif not context.strip():
+                                out = {"answer": NO_ANSWER, "sources": []}
+                                answer_cache.put(key, out, short=True, stale_key=stale_key)
+                            else:
+                                t_chat = time.perf_counter()
+                                stream = chat_answer_stream(context, q, temperature=0.2)
+                                first = next(stream, "")   # the request (and its retries) happen here
+                                metrics.record("chat_first_token", time.perf_counter() - t_chat)
+                except deadline.DeadlineExceeded as e:
+                    metrics.inc("ask_deadline_exceeded_total", at=e.what)
+                    out, stream = fallback_answer(q, use_web, web_domains), None
+                    if out is None:
+                        outcome = "timeout"
+                        yield _sse("error", {"error": f"No answer within {ASK_DEADLINE_S:g}s"})
+                        return
+                    outcome = "degraded"
+            if stream is not None:
+                # past the first token the answer is on its way; the rest streams unbudgeted
+                parts = [first] if first else []
+                if first:
+                    yield _sse("token", {"text": first})
+                for delta in stream:
+                    parts.append(delta)
+                    yield _sse("token", {"text": delta})
+                metrics.record("chat", time.perf_counter() - t_chat)
+                out = {"answer": "".join(parts).strip(), "sources": sources if SHOW_SOURCES else []}
+                answer_cache.put(key, out, stale_key=stale_key)
+                yield done(out)
+                return
+            yield _sse("token", {"text": out["answer"]})
+            yield done(out)
+        except Exception as e:
+            outcome = "error"
+            yield _sse("error", {"error": f"{type(e).__name__}: {e}"})
+        finally:
+            metrics.inc("ask_requests_total", endpoint="ask_stream", outcome=outcome)
+            if query_log:
+                query_log.record(q, outcome, use_web, timings)
+
+    return Response(stream_with_context(events()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=PORT, debug=True)
@@ -0,0 +1,160 @@
+# singleflight.py — coalesce identical in-flight computations (one runs, the rest share its result)
+import os, time, asyncio, threading
+from pathlib import Path
+from typing import Awaitable, Callable, Optional, Tuple
+
+import deadline
+
+try:
+    import fcntl
+except ImportError:   # Windows: in-process coalescing only
+    fcntl = None
+
+class _Call:
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value, self.error = None, None
+
+class SingleFlight:
+    """
+    do(key, fn) runs fn once per key at a time in this process; concurrent callers with
+    the same key block and get the same value (or exception).
+
+    With `lock_dir`, the one caller per process also takes an flock on <lock_dir>/<key>.lock,
+    so one worker computes while the others wait on the lock. When a waiter gets the lock,
+    `lookup()` (e.g. the SQLite-backed answer cache, which fn is expected to fill) is checked
+    before computing again. Keys must be filename-safe (hex digests are).
+    """
+    def __init__(self, lock_dir: Optional[str] = None, wait_timeout: float = 60.0, poll: float = 0.05):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.lock_dir = Path(lock_dir) if (lock_dir and fcntl) else None
+        self.wait_timeout, self.poll = wait_timeout, poll
+        self.leaders = self.followers = self.cross_worker_hits = 0
+        self._acquired = 0
+        if lock_dir and not fcntl:
+            print("[singleflight] fcntl unavailable; cross-worker coalescing disabled")
+        if self.lock_dir:
+            self.lock_dir.mkdir(parents=True, exist_ok=True)
+
+    def do(self, key: str, fn: Callable[[], object], lookup: Callable[[], object] = None) -> Tuple[object, bool]:
+        """Returns (value, shared): shared is True if another caller's computation produced it."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.followers += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value, True
+        try:
+            call.value, shared = self._lead(key, fn, lookup)
+            return call.value, shared
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def _lead(self, key, fn, lookup):
+        if self.lock_dir is None:
+            return fn(), False
+        path = self.lock_dir / f"{key}.lock"
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if not self._flock(fd):
+                return fn(), False   # lock holder too slow or stuck: compute on our own
+            try:
+                if lookup is not None:
+                    value = lookup()
+                    if value is not None:   # another worker finished it while we waited
+                        with self._lock:
+                            self.cross_worker_hits += 1
+                        return value, True
+                return fn(), False
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+            self._maybe_sweep()
+
+    def _flock(self, fd) -> bool:
+        # never past the caller's request deadline: then fn() runs and fails (or degrades) in time
+        left = deadline.remaining()
+        until = time.monotonic() + (self.wait_timeout if left is None else min(self.wait_timeout, left))
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                if time.monotonic() >= until:
+                    return False
+                time.sleep(self.poll)
+
+    def _maybe_sweep(self, max_age: float = 600.0):
+        """Every 256 acquisitions, remove lock files nobody holds that are older than max_age."""
+        with self._lock:
+            self._acquired += 1
+            if self._acquired % 256:
+                return
+        cutoff = time.time() - max_age
+        for p in self.lock_dir.glob("*.lock"):
+            try:
+                if p.stat().st_mtime >= cutoff:
+                    continue
+                fd = os.open(p, os.O_RDWR)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    p.unlink()
+                except (BlockingIOError, FileNotFoundError):
+                    pass
+                finally:
+                    os.close(fd)
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"leaders": self.leaders, "followers": self.followers,
+                    "cross_worker_hits": self.cross_worker_hits, "in_flight": len(self._calls)}
+
+class AsyncSingleFlight:
+    """
+    SingleFlight for one event loop (asgi.py): the first caller's fn() runs as a task and
+    every caller with the same key awaits it. Awaits are shielded, so a caller that gives
+    up (timeout, disconnect) doesn't cancel the work for the others. In-process only.
+    """
+    def __init__(self):
+        self._tasks = {}
+        self.leaders = self.followers = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable]) -> Tuple[object, bool]:
+        """Returns (value, shared), like SingleFlight.do()."""
+        task = self._tasks.get(key)
+        shared = task is not None
+        if shared:
+            self.followers += 1
+        else:
+            self.leaders += 1
+            task = self._tasks[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda t, k=key: self._done(k, t))
+        return await asyncio.shield(task), shared
+
+    def _done(self, key, task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            task.exception()   # retrieved, even if every caller gave up on it
+
+    def stats(self) -> dict:
+        return {"leaders": self.leaders, "followers": self.followers,
+                "cross_worker_hits": 0, "in_flight": len(self._tasks)}
@@ -0,0 +1,75 @@
+import os, json, time, hashlib, uuid
+from pathlib import Path
+
+# Fixed namespace so the same (source, chunk) always maps to the same point id
+POINT_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "datadepot/ingest")
+
+def sha256_bytes(raw: bytes) -> str:
+    return hashlib.sha256(raw).hexdigest()
+
+def sha256_text(text: str) -> str:
+    return sha256_bytes(text.encode("utf-8"))
+
+def sha256_file(path: Path) -> str:
+    h = hashlib.sha256()
+    with Path(path).open("rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def point_id(source: str, chunk: int) -> str:
+    """Deterministic UUIDv5 for chunk #`chunk` of `source`."""
+    return str(uuid.uuid5(POINT_NAMESPACE, f"{source}#{chunk}"))
+
+class Manifest:
+    """
+    What is already in each collection, keyed by file path:
+      {"collections": {name: {source: {"sha256": file_hash, "chunks": [chunk_hash, ...]}}}}
+    Chunk i of a source lives at point_id(source, i).
+    """
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.data = {"collections": {}}
+        if self.path.exists():
+            try:
+                self.data = json.loads(self.path.read_text(encoding="utf-8"))
+            except Exception as e:
+                print(f"[manifest] WARN: unreadable {self.path}, starting fresh: {e}")
+        self.data.setdefault("collections", {})
+
+    def files(self, collection: str) -> dict:
+        return self.data["collections"].setdefault(collection, {})
+
+    def reset(self, collection: str):
+        self.data["collections"][collection] = {}
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        tmp.write_text(json.dumps(self.data, indent=1), encoding="utf-8")
+        tmp.replace(self.path)
+
+# --- Collection version: bumped by ingest, read by the server to invalidate cached answers ---
+
+VERSION_PATH = Path(os.getenv("COLLECTION_VERSION_PATH")
+                    or Path(__file__).resolve().parent.parent / "data" / "collection_version.json")
+
+def _read_versions(path: Path) -> dict:
+    try:
+        return json.loads(Path(path).read_text(encoding="utf-8"))
+    except Exception:
+        return {}
+
+def read_collection_version(collection: str, path: Path = VERSION_PATH) -> str:
+    return str(_read_versions(path).get(collection, "0"))
+
+def bump_collection_version(collection: str, path: Path = VERSION_PATH) -> str:
+    path = Path(path)
+    versions = _read_versions(path)
+    versions[collection] = f"{time.time():.6f}"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(json.dumps(versions, indent=1), encoding="utf-8")
+    tmp.replace(path)
+    print(f"[manifest] collection {collection} now at version {versions[collection]}")
+    return versions[collection]
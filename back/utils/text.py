@@ -13,3 +13,8 @@ def chunk_stream(text: str, size: int = 900, overlap: int = 120):
         i = end - overlap
         if i <= prev: i = prev + 1
         prev = i
+
+def normalize_question(q: str) -> str:
+    """Cache/dedup key form of a question: lowercase, single spaces, no trailing punctuation."""
+    q = " ".join((q or "").lower().split())
+    return q.rstrip(" ?!.")
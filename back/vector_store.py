@@ -0,0 +1,228 @@
+# vector_store.py — one interface over remote Qdrant and a local memory-mapped NumPy index
+import os, json, time, asyncio, threading
+from pathlib import Path
+
+import qdrant_rest
+
+ROOT = Path(__file__).parent
+VECTOR_BACKEND  = (os.getenv("VECTOR_BACKEND") or "qdrant").strip().lower()   # qdrant | local
+LOCAL_INDEX_DIR = Path(os.getenv("LOCAL_INDEX_DIR") or ROOT / "data" / "local_index")
+VECTOR_SIZE     = int(os.getenv("QDRANT_VECTOR_SIZE", "1536"))
+
+class QdrantStore:
+    """The hosted Qdrant collection, via qdrant_rest."""
+    def __init__(self, collection: str):
+        self.collection = collection
+
+    def ensure(self) -> int:
+        return qdrant_rest.ensure_collection(self.collection)
+
+    def upsert(self, points):
+        qdrant_rest.upsert_points(points, collection=self.collection, wait=True)
+
+    def delete(self, ids):
+        qdrant_rest.delete_points(ids, collection=self.collection)
+
+    def search(self, vector, top_k=5):
+        return qdrant_rest.search(vector, top_k=top_k, collection=self.collection)
+
+    async def asearch(self, vector, top_k=5, executor=None):
+        return await qdrant_rest.asearch(vector, top_k=top_k, collection=self.collection)
+
+    def search_batch(self, vectors, top_k=5):
+        return qdrant_rest.search_batch(vectors, top_k=top_k, collection=self.collection)
+
+    def flush(self):
+        pass
+
+    def warm(self) -> int:
+        return 0   # nothing local to load; sockets must be opened after the fork, not before
+
+class LocalStore:
+    """
+    Embedded cosine index for one collection under LOCAL_INDEX_DIR/<collection>/:
+      vectors.f32  (N, dim) float32, rows L2-normalized, memory-mapped read-only
+      meta.json    {"dim", "ids": [...], "payloads": [...]}, row-aligned with vectors
+    Top-k is a single matrix-vector product. Writes stay in memory until flush();
+    readers pick up a flushed index on their next search (meta.json mtime check).
+    """
+    def __init__(self, collection: str, root: Path = LOCAL_INDEX_DIR, dim: int = VECTOR_SIZE):
+        self.collection, self.dir, self.dim = collection, Path(root) / collection, dim
+        self._lock = threading.RLock()
+        self._mat = None
+        self._ids, self._payloads, self._pos = [], [], {}
+        self._stamp, self._checked, self._dirty = None, 0.0, False
+
+    @property
+    def _vec_path(self): return self.dir / "vectors.f32"
+    @property
+    def _meta_path(self): return self.dir / "meta.json"
+
+    def _load(self):
+        import numpy as np
+        try:
+            stamp = self._meta_path.stat().st_mtime_ns
+            meta = json.loads(self._meta_path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            self._mat, self._ids, self._payloads, self._pos = np.zeros((0, self.dim), np.float32), [], [], {}
+            self._stamp = None
+            return
+        n, dim = len(meta["ids"]), int(meta["dim"])
+        if n and self._vec_path.stat().st_size != n * dim * 4:
+            return   # caught between the two writes of a flush; retry on the next check
+        self._mat = (np.memmap(self._vec_path, dtype=np.float32, mode="r", shape=(n, dim))
+                     if n else np.zeros((0, dim), np.float32))
+        self.dim = dim
+        self._ids, self._payloads = meta["ids"], meta["payloads"]
+        self._pos = {pid: i for i, pid in enumerate(self._ids)}
+        self._stamp = stamp
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if self._mat is not None and (self._dirty or now - self._checked < 1.0):
+            return
+        with self._lock:
+            self._checked = now
+            try:
+                stamp = self._meta_path.stat().st_mtime_ns
+            except FileNotFoundError:
+                stamp = None
+            if self._mat is None or stamp != self._stamp:
+                self._load()
+
+    def warm(self) -> int:
+        """Load the index now rather than on the first search."""
+        self._maybe_reload()
+        return len(self._ids)
+
+    def ensure(self) -> int:
+        self.dir.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            self._load()
+            return len(self._ids)
+
+    def _writable(self):
+        import numpy as np
+        if self._mat is None:
+            self._load()
+        if isinstance(self._mat, np.memmap):
+            self._mat = np.array(self._mat)   # copy-on-write into RAM before mutating
+        return self._mat
+
+    @staticmethod
+    def _normalize(m):
+        import numpy as np
+        norms = np.linalg.norm(m, axis=-1, keepdims=True)
+        return m / np.maximum(norms, 1e-12)
+
+    def upsert(self, points):
+        import numpy as np
+        if not points:
+            return
+        vecs = self._normalize(np.asarray([p["vector"] for p in points], dtype=np.float32))
+        if vecs.shape[1] != self.dim:
+            raise ValueError(f"vector size {vecs.shape[1]} != index dim {self.dim}")
+        with self._lock:
+            mat = self._writable()
+            new_rows, new_ids, new_payloads = [], [], []
+            for p, v in zip(points, vecs):
+                pid, payload = str(p["id"]), p.get("payload", {})
+                i = self._pos.get(pid)
+                if i is None:
+                    self._pos[pid] = len(self._ids) + len(new_ids)
+                    new_rows.append(v); new_ids.append(pid); new_payloads.append(payload)
+                else:
+                    mat[i] = v
+                    self._payloads[i] = payload
+            if new_rows:
+                self._mat = np.vstack([mat, np.asarray(new_rows, dtype=np.float32)])
+                self._ids = self._ids + new_ids
+                self._payloads = self._payloads + new_payloads
+            self._dirty = True
+
+    def delete(self, ids):
+        drop = {str(i) for i in ids}
+        with self._lock:
+            mat = self._writable()
+            keep = [i for i, pid in enumerate(self._ids) if pid not in drop]
+            if len(keep) == len(self._ids):
+                return
+            self._mat = mat[keep]
+            self._ids = [self._ids[i] for i in keep]
+            self._payloads = [self._payloads[i] for i in keep]
+            self._pos = {pid: i for i, pid in enumerate(self._ids)}
+            self._dirty = True
+
+    def flush(self):
+        import numpy as np
+        with self._lock:
+            if not self._dirty:
+                return
+            self.dir.mkdir(parents=True, exist_ok=True)
+            vec_tmp = self._vec_path.with_suffix(".f32.tmp")
+            meta_tmp = self._meta_path.with_suffix(".json.tmp")
+            np.ascontiguousarray(self._mat, dtype=np.float32).tofile(vec_tmp)
+            meta_tmp.write_text(json.dumps({"dim": self.dim, "ids": self._ids, "payloads": self._payloads},
+                                           ensure_ascii=False), encoding="utf-8")
+            vec_tmp.replace(self._vec_path)
+            meta_tmp.replace(self._meta_path)
+            self._dirty = False
+            self._load()   # back to a read-only memmap of what was just written
+            print(f"[local] flushed {len(self._ids)} points → {self.dir}")
+
+    def search(self, vector, top_k=5):
+        import numpy as np
+        self._maybe_reload()
+        with self._lock:
+            mat, ids, payloads = self._mat, self._ids, self._payloads
+        n = len(ids)
+        if n == 0:
+            return []
+        q = self._normalize(np.asarray(vector, dtype=np.float32))
+        scores = mat @ q
+        k = min(int(top_k), n)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [{"id": ids[i], "score": float(scores[i]), "payload": payloads[i]} for i in top]
+
+    async def asearch(self, vector, top_k=5, executor=None):
+        """search() off the event loop, on `executor` (default: the loop's); NumPy releases the GIL for the product."""
+        return await asyncio.get_running_loop().run_in_executor(executor, self.search, vector, top_k)
+
+    def search_batch(self, vectors, top_k=5):
+        """One matrix-matrix product for all queries; one hit list per vector, in order."""
+        import numpy as np
+        if len(vectors) == 0:
+            return []
+        self._maybe_reload()
+        with self._lock:
+            mat, ids, payloads = self._mat, self._ids, self._payloads
+        n = len(ids)
+        if n == 0:
+            return [[] for _ in vectors]
+        scores = mat @ self._normalize(np.asarray(vectors, dtype=np.float32)).T   # (n, queries)
+        k = min(int(top_k), n)
+        out = []
+        for col in scores.T:
+            top = np.argpartition(-col, k - 1)[:k]
+            top = top[np.argsort(-col[top])]
+            out.append([{"id": ids[i], "score": float(col[i]), "payload": payloads[i]} for i in top])
+        return out
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_store(collection: str = None, backend: str = None):
+    """Shared store for `collection` on VECTOR_BACKEND (or `backend`)."""
+    collection = collection or qdrant_rest.COLLECTION
+    backend = (backend or VECTOR_BACKEND)
+    with _stores_lock:
+        key = (backend, collection)
+        if key not in _stores:
+            if backend == "local":
+                _stores[key] = LocalStore(collection)
+            elif backend == "qdrant":
+                _stores[key] = QdrantStore(collection)
+            else:
+                raise RuntimeError(f"Unknown VECTOR_BACKEND={backend!r} (use 'qdrant' or 'local')")
+        return _stores[key]
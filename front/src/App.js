@@ -1,6 +1,6 @@
 import React, { useState, useRef, useEffect } from "react";
 import "./App.css";
-import { ask } from "./api";
+import { askStream } from "./api";
 
 export default function App() {
   const [messages, setMessages] = useState([
@@ -21,12 +21,20 @@ export default function App() {
     setMessages((m) => [...m, { role: "user", text: q }]);
     setSending(true);
 
+    // Placeholder bot message that fills in as tokens stream from the server
+    setMessages((m) => [...m, { role: "bot", text: "…" }]);
+    const setLast = (text) =>
+      setMessages((m) => [...m.slice(0, -1), { ...m[m.length - 1], text }]);
+
+    let streamed = "";
     try {
-      const res = await ask(q);
-      const text = res.answer?.trim() || "I couldn’t find that in the current dataset.";
-      setMessages((m) => [...m, { role: "bot", text }]);
+      const res = await askStream(q, {}, (delta) => {
+        streamed += delta;
+        setLast(streamed);
+      });
+      setLast(res.answer?.trim() || streamed.trim() || "I couldn’t find that in the current dataset.");
     } catch (e) {
-      setMessages((m) => [...m, { role: "bot", text: `Error: ${e.message}` }]);
+      setLast(`Error: ${e.message}`);
     } finally {
       setSending(false);
     }
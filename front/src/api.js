@@ -20,3 +20,56 @@ export async function ask(question, opts = {}) {
   }
   return res.json();
 }
+
+// Streaming variant: POST /ask/stream (Server-Sent Events). Calls onToken(text) for every
+// delta as it arrives and resolves with the final { answer, sources }.
+export async function askStream(question, opts = {}, onToken = () => {}) {
+  const payload = {
+    question,
+    ...(opts.web ? { web: true } : {}),
+    ...(opts.web_domains ? { web_domains: opts.web_domains } : {}),
+  };
+
+  const res = await fetch(`${API_BASE}/ask/stream`, {
+    method: "POST",
+    headers: { "Content-Type": "application/json", Accept: "text/event-stream" },
+    body: JSON.stringify(payload),
+  });
+
+  if (!res.ok || !res.body) {
+    let msg = await res.text();
+    throw new Error(`API ${res.status}: ${msg}`);
+  }
+
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buf = "";
+  let final = null;
+
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buf += decoder.decode(value, { stream: true });
+
+    // SSE events are separated by a blank line
+    let sep;
+    while ((sep = buf.indexOf("\n\n")) !== -1) {
+      const raw = buf.slice(0, sep);
+      buf = buf.slice(sep + 2);
+      let event = "message";
+      let data = "";
+      for (const line of raw.split("\n")) {
+        if (line.startsWith("event:")) event = line.slice(6).trim();
+        else if (line.startsWith("data:")) data += line.slice(5).trim();
+      }
+      if (!data) continue;
+      const body = JSON.parse(data);
+      if (event === "token") onToken(body.text || "");
+      else if (event === "done") final = body;
+      else if (event === "error") throw new Error(body.error || "stream error");
+    }
+  }
+
+  if (!final) throw new Error("Stream ended before the answer was complete");
+  return final;
+}